@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import PerfilUsuario, Fraccion, Archivo, HistorialAcceso
+from .models import PerfilUsuario, Fraccion, Archivo, HistorialAcceso, AccesoDiario, SesionCarga, ContenidoArchivo, TrabajoExportacion, TextoContenido, ContadorVersion, VersionCatalogo
 
 # Configuración del admin para PerfilUsuario
 class PerfilUsuarioInline(admin.StackedInline):
@@ -31,10 +31,63 @@ class ArchivoAdmin(admin.ModelAdmin):
     ordering = ['-created_at']
     readonly_fields = ['tamaño', 'nombre_original', 'version', 'created_at', 'updated_at']
 
+@admin.register(ContadorVersion)
+class ContadorVersionAdmin(admin.ModelAdmin):
+    list_display = ['fraccion', 'año', 'periodo_especifico', 'ultima_version', 'updated_at']
+    list_filter = ['fraccion', 'año']
+    search_fields = ['fraccion__numero', 'periodo_especifico']
+    ordering = ['fraccion', '-año', 'periodo_especifico']
+    readonly_fields = ['fraccion', 'año', 'periodo_especifico', 'ultima_version', 'updated_at']
+
+@admin.register(VersionCatalogo)
+class VersionCatalogoAdmin(admin.ModelAdmin):
+    list_display = ['nombre', 'version', 'updated_at']
+    readonly_fields = ['nombre', 'version', 'updated_at']
+
 @admin.register(HistorialAcceso)
 class HistorialAccesoAdmin(admin.ModelAdmin):
     list_display = ['archivo', 'usuario', 'fecha_acceso', 'ip_address']
     list_filter = ['fecha_acceso']
     search_fields = ['archivo__fraccion__numero', 'usuario__username']
     ordering = ['-fecha_acceso']
-    readonly_fields = ['fecha_acceso']
\ No newline at end of file
+    readonly_fields = ['fecha_acceso']
+
+@admin.register(AccesoDiario)
+class AccesoDiarioAdmin(admin.ModelAdmin):
+    list_display = ['archivo', 'fecha', 'es_acceso_publico', 'total']
+    list_filter = ['fecha', 'es_acceso_publico']
+    search_fields = ['archivo__fraccion__numero', 'archivo__nombre_original']
+    ordering = ['-fecha']
+    readonly_fields = ['archivo', 'fecha', 'es_acceso_publico', 'total']
+
+@admin.register(SesionCarga)
+class SesionCargaAdmin(admin.ModelAdmin):
+    list_display = ['nombre_original', 'usuario', 'fraccion', 'tamaño', 'estado', 'updated_at']
+    list_filter = ['estado', 'created_at']
+    search_fields = ['nombre_original', 'usuario__username']
+    ordering = ['-created_at']
+    readonly_fields = ['tamaño', 'tamaño_bloque', 'sha256', 'archivo', 'created_at', 'updated_at']
+
+@admin.register(ContenidoArchivo)
+class ContenidoArchivoAdmin(admin.ModelAdmin):
+    list_display = ['sha256', 'ruta', 'tamaño', 'referencias', 'integro', 'created_at']
+    list_filter = ['integro']
+    search_fields = ['sha256', 'ruta']
+    ordering = ['-created_at']
+    readonly_fields = ['sha256', 'ruta', 'tamaño', 'referencias', 'created_at', 'verificado_at', 'integro', 'error_verificacion']
+
+@admin.register(TextoContenido)
+class TextoContenidoAdmin(admin.ModelAdmin):
+    list_display = ['contenido', 'estado', 'formato', 'paginas', 'updated_at']
+    list_filter = ['estado', 'formato']
+    search_fields = ['contenido__sha256', 'contenido__ruta']
+    ordering = ['-updated_at']
+    readonly_fields = ['contenido', 'estado', 'formato', 'texto', 'paginas', 'error', 'updated_at']
+
+@admin.register(TrabajoExportacion)
+class TrabajoExportacionAdmin(admin.ModelAdmin):
+    list_display = ['nombre_archivo', 'usuario', 'estado', 'procesadas', 'total', 'created_at', 'expira_at']
+    list_filter = ['estado', 'created_at']
+    search_fields = ['nombre_archivo', 'usuario__username']
+    ordering = ['-created_at']
+    readonly_fields = ['procesadas', 'total', 'ruta', 'error', 'created_at', 'updated_at']
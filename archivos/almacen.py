@@ -0,0 +1,279 @@
+"""
+Almacén de archivos direccionado por contenido (SHA-256).
+
+Cada contenido distinto se guarda una sola vez en
+MEDIA_ROOT/blobs/<aa>/<bb>/<sha256><ext>; las filas de Archivo apuntan a él
+(campo `archivo` con la misma ruta y FK `contenido`). Volver a subir un
+archivo idéntico solo suma una referencia: no se escribe nada a disco.
+
+Las referencias se cuentan en ContenidoArchivo.referencias, siempre con la
+fila bloqueada (select_for_update) para que un alta y una baja simultáneas
+del mismo contenido no borren un archivo en uso.
+
+Las cargas escriben en dos fases: preparar_contenido() deja el archivo en
+ARCHIVOS_PREPARACION_DIR antes de abrir la transacción, y dentro de ella
+registrar_preparado() solo toca filas (registrar_preparados(), para un lote,
+con una consulta de bloqueo y un bulk_create). Al confirmarse la transacción
+el archivo se mueve a blobs/ (o se descarta si el contenido ya existía); si
+se revierte, quien lo preparó lo descarta.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+
+from .models import ContenidoArchivo
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO = 'blobs'
+TAMAÑO_LECTURA = 64 * 1024
+
+
+def ruta_contenido(sha256, extension):
+    return f'{DIRECTORIO}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension.lower()}'
+
+
+def calcular_sha256(archivo):
+    """SHA-256 leyendo por partes (archivos que no pasaron por ManejadorCargaVerificada)"""
+    digest = hashlib.sha256()
+    archivo.seek(0)
+    for parte in archivo.chunks(TAMAÑO_LECTURA):
+        digest.update(parte)
+    archivo.seek(0)
+    return digest.hexdigest()
+
+
+def registrar_contenido(archivo, sha256=None):
+    """
+    Devuelve el ContenidoArchivo de estos bytes con una referencia más.
+
+    Solo se escribe a disco si el contenido no existía. Usa el SHA-256 que
+    ya calculó el manejador de carga cuando está disponible.
+    """
+    sha256 = sha256 or getattr(archivo, 'sha256', None) or calcular_sha256(archivo)
+
+    with transaction.atomic():
+        contenido = ContenidoArchivo.objects.select_for_update().filter(sha256=sha256).first()
+        if contenido is not None:
+            logger.info("Contenido ya almacenado, se reutiliza: %s", contenido.ruta)
+        else:
+            extension = os.path.splitext(archivo.name)[1]
+            ruta = default_storage.save(ruta_contenido(sha256, extension), archivo)
+            try:
+                with transaction.atomic():
+                    contenido = ContenidoArchivo.objects.create(
+                        sha256=sha256, ruta=ruta, tamaño=archivo.size
+                    )
+            except IntegrityError:
+                # Otro proceso registró el mismo contenido al mismo tiempo
+                default_storage.delete(ruta)
+                contenido = ContenidoArchivo.objects.select_for_update().get(sha256=sha256)
+
+        contenido.referencias += 1
+        contenido.save(update_fields=['referencias'])
+    return contenido
+
+
+class ContenidoPreparado:
+    """Archivo subido ya escrito en el área de preparación, pendiente de registrar"""
+
+    def __init__(self, nombre, ruta_temporal, sha256, tamaño):
+        self.nombre = nombre
+        self.ruta_temporal = ruta_temporal
+        self.sha256 = sha256
+        self.tamaño = tamaño
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.nombre)[1]
+
+    def promover(self, ruta):
+        """Mueve el archivo a su ruta definitiva en el almacenamiento (rename)"""
+        destino = default_storage.path(ruta)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        file_move_safe(self.ruta_temporal, destino, allow_overwrite=True)
+        if settings.FILE_UPLOAD_PERMISSIONS is not None:
+            os.chmod(destino, settings.FILE_UPLOAD_PERMISSIONS)
+
+    def descartar(self):
+        try:
+            os.remove(self.ruta_temporal)
+        except FileNotFoundError:
+            pass
+
+
+def preparar_contenido(archivo):
+    """
+    Escribe el archivo subido en el área de preparación, fuera de la
+    transacción. Si ya está en disco (temporal de la carga o archivo
+    ensamblado) se mueve en lugar de copiarse.
+    """
+    os.makedirs(settings.ARCHIVOS_PREPARACION_DIR, exist_ok=True)
+    sha256 = getattr(archivo, 'sha256', None) or calcular_sha256(archivo)
+    descriptor, ruta_temporal = tempfile.mkstemp(dir=settings.ARCHIVOS_PREPARACION_DIR, suffix='.tmp')
+    try:
+        if hasattr(archivo, 'temporary_file_path'):
+            os.close(descriptor)
+            file_move_safe(archivo.temporary_file_path(), ruta_temporal, allow_overwrite=True)
+        else:
+            with os.fdopen(descriptor, 'wb') as destino:
+                archivo.seek(0)
+                for parte in archivo.chunks(TAMAÑO_LECTURA):
+                    destino.write(parte)
+    except BaseException:
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+        raise
+    return ContenidoPreparado(archivo.name, ruta_temporal, sha256, archivo.size)
+
+
+def registrar_preparado(preparado):
+    """
+    Como registrar_contenido, para un archivo ya preparado: dentro de la
+    transacción solo se bloquean e insertan filas. El archivo se promueve
+    (o se descarta, si el contenido ya existía) con transaction.on_commit.
+    """
+    with transaction.atomic():
+        contenido = ContenidoArchivo.objects.select_for_update().filter(sha256=preparado.sha256).first()
+        if contenido is not None:
+            logger.info("Contenido ya almacenado, se reutiliza: %s", contenido.ruta)
+            transaction.on_commit(preparado.descartar, robust=True)
+        else:
+            ruta = ruta_contenido(preparado.sha256, preparado.extension)
+            try:
+                with transaction.atomic():
+                    contenido = ContenidoArchivo.objects.create(
+                        sha256=preparado.sha256, ruta=ruta, tamaño=preparado.tamaño
+                    )
+                transaction.on_commit(lambda: preparado.promover(ruta), robust=True)
+            except IntegrityError:
+                # Otro proceso registró el mismo contenido al mismo tiempo
+                contenido = ContenidoArchivo.objects.select_for_update().get(sha256=preparado.sha256)
+                transaction.on_commit(preparado.descartar, robust=True)
+
+        contenido.referencias += 1
+        contenido.save(update_fields=['referencias'])
+    return contenido
+
+
+def registrar_preparados(preparados):
+    """
+    registrar_preparado() para un lote: los contenidos existentes se bloquean
+    en una sola consulta, los nuevos se insertan con bulk_create y al
+    confirmarse la transacción los archivos se promueven en paralelo.
+    Devuelve los ContenidoArchivo en el orden de `preparados`.
+    """
+    por_sha256 = {}
+    for preparado in preparados:
+        por_sha256.setdefault(preparado.sha256, []).append(preparado)
+
+    with transaction.atomic():
+        # Orden fijo de bloqueo: dos lotes con contenidos en común no se bloquean mutuamente
+        existentes = {
+            contenido.sha256: contenido
+            for contenido in ContenidoArchivo.objects.select_for_update()
+            .filter(sha256__in=por_sha256).order_by('sha256')
+        }
+        nuevos = [
+            ContenidoArchivo(
+                sha256=sha256, ruta=ruta_contenido(sha256, grupo[0].extension),
+                tamaño=grupo[0].tamaño, referencias=len(grupo),
+            )
+            for sha256, grupo in por_sha256.items() if sha256 not in existentes
+        ]
+        try:
+            with transaction.atomic():
+                ContenidoArchivo.objects.bulk_create(nuevos)
+        except IntegrityError:
+            # Otro proceso registró alguno de estos contenidos al mismo tiempo
+            return [registrar_preparado(preparado) for preparado in preparados]
+
+        for contenido in existentes.values():
+            logger.info("Contenido ya almacenado, se reutiliza: %s", contenido.ruta)
+            contenido.referencias += len(por_sha256[contenido.sha256])
+        ContenidoArchivo.objects.bulk_update(existentes.values(), ['referencias'])
+
+        # Cada contenido nuevo se promueve desde su primer archivo; las copias sobran
+        promociones = [(por_sha256[contenido.sha256][0], contenido.ruta) for contenido in nuevos]
+        descartes = [
+            preparado for grupo in por_sha256.values() for preparado in grupo
+            if preparado.sha256 in existentes or preparado is not grupo[0]
+        ]
+        transaction.on_commit(lambda: _promover_lote(promociones, descartes), robust=True)
+
+    contenidos = {**existentes, **{contenido.sha256: contenido for contenido in nuevos}}
+    return [contenidos[preparado.sha256] for preparado in preparados]
+
+
+def _promover_lote(promociones, descartes):
+    with ThreadPoolExecutor(max_workers=settings.ARCHIVOS_CARGA_HILOS) as pool:
+        futuros = [pool.submit(preparado.promover, ruta) for preparado, ruta in promociones]
+        futuros += [pool.submit(preparado.descartar) for preparado in descartes]
+    for futuro in futuros:
+        futuro.result()  # El primer error llega al registro de on_commit(robust=True)
+
+
+def limpiar_preparacion(horas):
+    """Elimina archivos del área de preparación más antiguos que `horas` (cargas interrumpidas)"""
+    limite = time.time() - horas * 3600
+    total = 0
+    try:
+        nombres = os.listdir(settings.ARCHIVOS_PREPARACION_DIR)
+    except FileNotFoundError:
+        return total
+    for nombre in nombres:
+        ruta = os.path.join(settings.ARCHIVOS_PREPARACION_DIR, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+                total += 1
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def liberar_contenido(contenido_id):
+    """Resta una referencia; sin referencias se eliminan la fila y el archivo físico"""
+    with transaction.atomic():
+        contenido = ContenidoArchivo.objects.select_for_update().filter(pk=contenido_id).first()
+        if contenido is None:
+            return
+        if contenido.referencias > 1:
+            contenido.referencias -= 1
+            contenido.save(update_fields=['referencias'])
+            return
+        ruta = contenido.ruta
+        contenido.delete()
+        # El archivo se borra solo si la transacción se confirma
+        transaction.on_commit(lambda: _eliminar_si_huerfano(ruta))
+        logger.info("Contenido sin referencias eliminado: %s", ruta)
+
+
+def _eliminar_si_huerfano(ruta):
+    """
+    Borra el archivo de un contenido eliminado (on_commit de liberar_contenido).
+
+    Entre la baja y este callback otra carga puede registrar el mismo contenido
+    (misma ruta) y promover su archivo: primero se aparta el archivo con un
+    rename y solo se borra si ninguna fila usa la ruta; si alguna la usa, se
+    devuelve a su lugar (mismo SHA-256, mismos bytes que una promoción).
+    """
+    destino = default_storage.path(ruta)
+    apartado = f'{destino}.{uuid.uuid4().hex}.borrar'
+    try:
+        os.replace(destino, apartado)
+    except FileNotFoundError:
+        return
+    if ContenidoArchivo.objects.filter(ruta=ruta).exists():
+        os.replace(apartado, destino)
+    else:
+        os.remove(apartado)
@@ -0,0 +1,100 @@
+"""
+Contexto de autorización por usuario.
+
+AutorizacionMiddleware deja en request.autorizacion el perfil del usuario y
+los IDs de las fracciones de su tipo, resueltos una sola vez por solicitud.
+Las vistas y formularios comprueban permisos con puede_fraccion() y
+puede_archivo() (con archivo.fraccion_id, sin cargar la fracción) en lugar
+de consultar request.user.perfilusuario y archivo.fraccion en cada paso.
+
+El perfil se lee de la base de datos en cada solicitud (una consulta): no
+se guarda entre solicitudes porque la caché por defecto es local a cada
+proceso y un cambio de tipo de usuario o un perfil eliminado no llegaría a
+los demás workers. Las fracciones salen del catálogo en memoria
+(catalogo.py), cuya versión vive en la base de datos.
+"""
+from django.utils.functional import LazyObject
+
+from .catalogo import catalogo
+from .models import PerfilUsuario
+
+
+class ContextoAutorizacion:
+    """Perfil del usuario y fracciones de su tipo ({id: activa})"""
+
+    def __init__(self, perfil=None, fracciones=None):
+        self.perfil = perfil
+        self.fracciones = fracciones or {}
+
+    @property
+    def tiene_perfil(self):
+        return self.perfil is not None
+
+    @property
+    def tipo_usuario(self):
+        return self.perfil.tipo_usuario if self.perfil else None
+
+    @property
+    def fracciones_ids(self):
+        return set(self.fracciones)
+
+    @property
+    def fracciones_activas_ids(self):
+        return {fraccion_id for fraccion_id, activa in self.fracciones.items() if activa}
+
+    def fracciones_activas(self):
+        """Fracciones activas del usuario, del catálogo en memoria (solo lectura)"""
+        if not self.perfil:
+            return []
+        return catalogo.por_tipo_usuario(self.perfil.tipo_usuario)
+
+    def puede_fraccion(self, fraccion_id):
+        try:
+            return int(fraccion_id) in self.fracciones
+        except (TypeError, ValueError):
+            return False
+
+    def puede_archivo(self, archivo):
+        return self.puede_fraccion(archivo.fraccion_id)
+
+
+def _perfil(usuario):
+    """PerfilUsuario del usuario (o None)"""
+    return PerfilUsuario.objects.filter(user_id=usuario.pk).first()
+
+
+def obtener(usuario):
+    """
+    Contexto de autorización de `usuario`, una vez por instancia (solicitud).
+
+    También deja el perfil en la instancia, así usuario.perfilusuario (por
+    ejemplo en las plantillas) no vuelve a consultar.
+    """
+    if isinstance(usuario, LazyObject):
+        # request.user: se trabaja sobre la instancia real
+        usuario.is_authenticated
+        usuario = usuario._wrapped
+
+    contexto = getattr(usuario, '_contexto_autorizacion', None)
+    if contexto is not None:
+        return contexto
+
+    if not usuario.is_authenticated:
+        contexto = ContextoAutorizacion()
+    else:
+        perfil = _perfil(usuario)
+        fracciones = {}
+        if perfil is not None:
+            fracciones = {
+                fraccion.id: fraccion.activa
+                for fraccion in catalogo.por_tipo_usuario(perfil.tipo_usuario, solo_activas=False)
+            }
+        contexto = ContextoAutorizacion(perfil, fracciones)
+        if perfil is not None:
+            usuario.perfilusuario = perfil
+        else:
+            # Sin perfil: usuario.perfilusuario lanza DoesNotExist sin consultar
+            type(usuario).perfilusuario.related.set_cached_value(usuario, None)
+    usuario._contexto_autorizacion = contexto
+    return contexto
+
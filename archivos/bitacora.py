@@ -0,0 +1,241 @@
+"""
+Bitácora de accesos asíncrona y por lotes.
+
+Las vistas de visualización y descarga ya no insertan en HistorialAcceso
+dentro de la solicitud: encolan el evento en memoria y un hilo de fondo lo
+escribe con bulk_create en lotes (por tamaño o por tiempo). La cola es
+acotada; cuando se llena se aplica la política ARCHIVOS_BITACORA_DESBORDE:
+
+- 'descartar': el evento se pierde y se contabiliza como descartado.
+- 'sincrono': el evento se escribe en la misma solicitud (comportamiento
+  anterior) y se contabiliza como retrasado.
+
+Cada ARCHIVOS_BITACORA_REPORTE segundos, si hubo actividad, el hilo
+escribe los contadores del proceso (estadisticas) en el log con nivel INFO.
+Al terminar el proceso (atexit) se vacía lo pendiente.
+"""
+import atexit
+import ipaddress
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class BitacoraAccesos:
+    """Cola en memoria de eventos de acceso con escritura por lotes"""
+
+    def __init__(self, tamaño_lote=200, intervalo=2.0, capacidad=10000, desborde='descartar', reporte=300.0):
+        self.tamaño_lote = tamaño_lote
+        self.intervalo = intervalo
+        self.capacidad = capacidad
+        self.desborde = desborde
+        self.reporte = reporte
+        self._lock = threading.Lock()
+        self._reiniciar()
+
+    def _reiniciar(self):
+        # Se llama también después de un fork (gunicorn --preload): el hilo
+        # del proceso padre no existe en el hijo.
+        self._pid = os.getpid()
+        self._cola = queue.Queue(maxsize=self.capacidad)
+        self._hilo = None
+        self._detener = threading.Event()
+        self.encolados = 0
+        self.registrados = 0
+        self.descartados = 0
+        self.retrasados = 0
+        self.errores = 0
+        self.lotes = 0
+        self.max_espera = 0.0
+        self._ultimo_reporte = (time.monotonic(), None)
+
+    def _asegurar_hilo(self):
+        if self._pid != os.getpid():
+            self._reiniciar()
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(
+                    target=self._ciclo, name='bitacora-accesos', daemon=True
+                )
+                self._hilo.start()
+
+    def registrar(self, **campos):
+        """Encola un evento con los campos de HistorialAcceso."""
+        campos.setdefault('fecha_acceso', timezone.now())
+        self._asegurar_hilo()
+        try:
+            self._cola.put_nowait((time.monotonic(), campos))
+            self.encolados += 1
+        except queue.Full:
+            if self.desborde == 'sincrono':
+                self.retrasados += 1
+                self._escribir([campos])
+            else:
+                self.descartados += 1
+                if self.descartados == 1 or self.descartados % 1000 == 0:
+                    logger.warning(
+                        'Bitácora de accesos llena (%s eventos): %s descartados',
+                        self.capacidad, self.descartados,
+                    )
+
+    def _tomar_lote(self):
+        """Espera hasta completar un lote o hasta que venza el intervalo."""
+        lote = []
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.tamaño_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _ciclo(self):
+        while not self._detener.is_set():
+            lote = self._tomar_lote()
+            if lote:
+                # El hilo mantiene su propia conexión; respetar CONN_MAX_AGE
+                close_old_connections()
+                self._procesar(lote)
+            self._reportar()
+
+    def _reportar(self):
+        """Escribe los contadores en el log cada `reporte` segundos, si cambiaron."""
+        momento, anteriores = self._ultimo_reporte
+        if not self.reporte or time.monotonic() - momento < self.reporte:
+            return
+        actuales = self.estadisticas()
+        if actuales != anteriores:
+            logger.info('Bitácora de accesos (proceso %s): %s', self._pid, actuales)
+        self._ultimo_reporte = (time.monotonic(), actuales)
+
+    def _procesar(self, lote):
+        ahora = time.monotonic()
+        espera = max(ahora - encolado for encolado, _ in lote)
+        self.max_espera = max(self.max_espera, espera)
+        # Eventos que tardaron más de dos intervalos en escribirse
+        self.retrasados += sum(1 for encolado, _ in lote if ahora - encolado > 2 * self.intervalo)
+        self._escribir([campos for _, campos in lote])
+
+    def _escribir(self, eventos):
+        from .models import HistorialAcceso
+
+        try:
+            # atomic: un error no deja inutilizable la transacción del llamador (modo 'sincrono')
+            with transaction.atomic():
+                HistorialAcceso.objects.bulk_create(
+                    [HistorialAcceso(**campos) for campos in eventos],
+                    batch_size=self.tamaño_lote,
+                )
+            self.registrados += len(eventos)
+            self.lotes += 1
+            return
+        except Exception as e:
+            if len(eventos) == 1:
+                self.errores += 1
+                logger.error('Error escribiendo un acceso en la bitácora: %s (%s)', e, eventos[0])
+                return
+            logger.warning('Error escribiendo un lote de %s accesos, se reintenta uno por uno: %s', len(eventos), e)
+
+        # Un evento inválido no debe tirar los demás del lote
+        for campos in eventos:
+            try:
+                with transaction.atomic():
+                    HistorialAcceso.objects.create(**campos)
+                self.registrados += 1
+            except Exception as e:
+                self.errores += 1
+                logger.error('Error escribiendo un acceso en la bitácora: %s (%s)', e, campos)
+
+    def vaciar(self):
+        """Escribe de inmediato todo lo pendiente (apagado del worker)."""
+        if self._pid != os.getpid():
+            return
+        pendientes = []
+        while True:
+            try:
+                pendientes.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+        for inicio in range(0, len(pendientes), self.tamaño_lote):
+            self._procesar(pendientes[inicio:inicio + self.tamaño_lote])
+
+    def detener(self):
+        self._detener.set()
+        self.vaciar()
+        if self.descartados or self.retrasados or self.errores:
+            logger.warning('Bitácora de accesos al cerrar: %s', self.estadisticas())
+
+    def estadisticas(self):
+        """Contadores del proceso actual."""
+        return {
+            'encolados': self.encolados,
+            'registrados': self.registrados,
+            'pendientes': self._cola.qsize(),
+            'descartados': self.descartados,
+            'retrasados': self.retrasados,
+            'errores': self.errores,
+            'lotes': self.lotes,
+            'max_espera_segundos': round(self.max_espera, 3),
+        }
+
+
+bitacora = BitacoraAccesos(
+    tamaño_lote=settings.ARCHIVOS_BITACORA_LOTE,
+    intervalo=settings.ARCHIVOS_BITACORA_INTERVALO,
+    capacidad=settings.ARCHIVOS_BITACORA_CAPACIDAD,
+    desborde=settings.ARCHIVOS_BITACORA_DESBORDE,
+    reporte=settings.ARCHIVOS_BITACORA_REPORTE,
+)
+atexit.register(bitacora.detener)
+
+
+def _ip_valida(valor):
+    try:
+        return str(ipaddress.ip_address((valor or '').strip()))
+    except ValueError:
+        return None
+
+
+def ip_cliente(request):
+    """
+    IP del cliente: la primera de X-Forwarded-For si es una dirección válida
+    (el cliente puede enviar cualquier cosa), si no REMOTE_ADDR.
+    """
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    ip = _ip_valida(x_forwarded_for.split(',')[0]) if x_forwarded_for else None
+    return ip or _ip_valida(request.META.get('REMOTE_ADDR')) or '0.0.0.0'
+
+
+def registrar_acceso(archivo, request, usuario=None, es_acceso_publico=False):
+    """
+    Registra un acceso a un archivo.
+
+    Con ARCHIVOS_BITACORA_ASINCRONA=False el registro se inserta en la misma
+    solicitud (útil en pruebas y en comandos de administración).
+    """
+    campos = {
+        'archivo_id': archivo.pk,
+        'usuario_id': usuario.pk if usuario is not None else None,
+        'ip_address': ip_cliente(request),
+        'es_acceso_publico': es_acceso_publico,
+        'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+    }
+
+    if settings.ARCHIVOS_BITACORA_ASINCRONA:
+        bitacora.registrar(**campos)
+    else:
+        from .models import HistorialAcceso
+        HistorialAcceso.objects.create(**campos)
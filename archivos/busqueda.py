@@ -0,0 +1,81 @@
+"""
+Búsqueda de archivos del listado.
+
+En PostgreSQL cada Archivo mantiene `vector_busqueda` (tsvector con la
+configuración spanish_unaccent: raíces en español y sin acentos) con el
+nombre del archivo (peso A) y el número y nombre de su fracción (peso B).
+Un trigger lo actualiza al insertar o modificar el archivo y al renombrar la
+fracción (migración 0009), así que cualquier forma de guardar,
+incluido bulk_create, lo deja al día. La coincidencia usa el índice GIN del
+vector y, para errores de escritura en nombres de archivo, el índice
+gin_trgm_ops de nombre_original (pg_trgm); el rango combina ts_rank y la
+similitud de trigramas.
+
+El texto de los documentos (PDF, DOCX y XLSX) lo extrae en segundo plano
+el comando extraer_contenido a TextoContenido, con su propio vector e
+índice GIN (migración 0010); las coincidencias en el contenido pesan menos
+en el rango que las del nombre.
+
+En otros motores (SQLite en desarrollo y pruebas) se usa el filtro
+icontains original, también sobre el texto extraído, y el orden por fecha.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Coalesce
+
+from .models import TextoContenido
+
+CONFIGURACION = 'spanish_unaccent'
+PESO_CONTENIDO = 0.5  # factor del rango por coincidencias en el texto del documento
+
+
+def disponible():
+    return connection.vendor == 'postgresql'
+
+
+def _consulta(texto):
+    return SearchQuery(texto, config=CONFIGURACION, search_type='websearch')
+
+
+def filtrar(queryset, texto):
+    """Archivos que coinciden con `texto` (sin ordenar por relevancia)"""
+    texto = (texto or '').strip()
+    if not texto:
+        return queryset
+    if not disponible():
+        return queryset.filter(
+            Q(nombre_original__icontains=texto) |
+            Q(fraccion__nombre__icontains=texto) |
+            Q(fraccion__numero__icontains=texto) |
+            Q(contenido__texto__texto__icontains=texto)
+        )
+    consulta = _consulta(texto)
+    return queryset.filter(
+        Q(vector_busqueda=consulta) |
+        Q(nombre_original__trigram_word_similar=texto) |
+        Q(fraccion__numero__iexact=texto) |
+        # Subconsulta sobre el índice GIN del texto, sin unir las tablas antes de filtrar
+        Q(contenido_id__in=TextoContenido.objects.filter(vector=consulta).values('contenido_id'))
+    )
+
+
+def anotar_rango(queryset, texto):
+    """
+    Agrega `rango` (relevancia) a un queryset ya filtrado con filtrar().
+    Devuelve (queryset, campo de orden): 'rango' en PostgreSQL, 'created_at'
+    si no hay búsqueda o en otros motores.
+    """
+    texto = (texto or '').strip()
+    if not texto or not disponible():
+        return queryset, 'created_at'
+    consulta = _consulta(texto)
+    return queryset.annotate(
+        rango=SearchRank(F('vector_busqueda'), consulta)
+        + TrigramWordSimilarity(texto, 'nombre_original')
+        # Sin texto extraído el vector es NULL y ts_rank también
+        + Coalesce(
+            SearchRank(F('contenido__texto__vector'), consulta) * PESO_CONTENIDO,
+            Value(0.0), output_field=FloatField(),
+        )
+    ), 'rango'
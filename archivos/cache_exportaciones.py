@@ -0,0 +1,155 @@
+"""
+Caché en disco de las exportaciones generadas.
+
+La clave combina los filtros normalizados, el tipo de usuario, el formato y
+una huella de los datos (máximo updated_at y número de filas de Archivo que
+cumplen los filtros, más la versión del catálogo de fracciones). Cualquier
+carga, edición o baja, y cualquier cambio en una fracción (nombre,
+asignación), cambia la huella, así que la entrada anterior deja de usarse
+sin invalidarla explícitamente. Lo
+que el archivo incluye además de los datos va en `extra` (en los libros de
+Excel: el usuario y el día, que aparecen en el bloque de información).
+
+Las entradas viven en ARCHIVOS_EXPORTACIONES_CACHE_DIR; cada acierto
+actualiza el mtime del archivo y, al guardar una nueva, se eliminan las de
+mtime más antiguo hasta quedar bajo ARCHIVOS_EXPORTACIONES_CACHE_MAXIMO
+(LRU aproximado sin depender de atime).
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .catalogo import NOMBRE as CATALOGO_FRACCIONES
+from .models import VersionCatalogo
+
+logger = logging.getLogger(__name__)
+
+# Parámetros GET que determinan el contenido del listado y su valor por omisión
+FILTROS_LISTADO = {
+    'estado': 'vigente',
+    'fraccion': '',
+    'año': '',
+    'tipo_periodo': '',
+    'periodo_especifico': '',
+    'busqueda': '',
+    'hojas': '',  # 'fraccion': una hoja por fracción
+}
+
+
+def filtros_normalizados(parametros):
+    """Filtros del listado con valores por omisión y sin espacios sobrantes"""
+    return {
+        nombre: (parametros.get(nombre) or defecto).strip()
+        for nombre, defecto in FILTROS_LISTADO.items()
+    }
+
+
+def huella(queryset):
+    """
+    (máximo updated_at, total de filas, versión del catálogo): cambia con
+    cualquier alta, edición o baja y con los cambios en las fracciones, que
+    no tocan updated_at de Archivo. El total sirve además como conteo del
+    queryset.
+    """
+    datos = queryset.order_by().aggregate(ultima=Max('updated_at'), total=Count('id'))
+    ultima = datos['ultima'].isoformat() if datos['ultima'] else ''
+    version_catalogo = VersionCatalogo.objects.filter(
+        nombre=CATALOGO_FRACCIONES
+    ).values_list('version', flat=True).first() or 0
+    return ultima, datos['total'], version_catalogo
+
+
+def clave(formato, tipo_usuario, filtros, huella_datos, extra=''):
+    contenido = json.dumps(
+        [formato, tipo_usuario, filtros, huella_datos, extra],
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def _directorio():
+    return settings.ARCHIVOS_EXPORTACIONES_CACHE_DIR
+
+
+def _ruta(clave_cache, extension):
+    return os.path.join(_directorio(), f'{clave_cache}.{extension}')
+
+
+def obtener(clave_cache, extension):
+    """Archivo abierto de la entrada o None; un acierto la marca como usada recientemente"""
+    ruta = _ruta(clave_cache, extension)
+    try:
+        archivo = open(ruta, 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(ruta)
+    except OSError:
+        pass  # la entrada pudo ser desalojada; el archivo abierto sigue siendo válido
+    return archivo
+
+
+def guardar(clave_cache, extension, generar):
+    """
+    Genera la entrada con `generar(archivo)` y la publica con rename atómico.
+
+    Devuelve (archivo abierto, valor devuelto por generar). Si dos
+    solicitudes generan la misma entrada a la vez, la última reemplaza a la
+    primera con el mismo contenido.
+    """
+    os.makedirs(_directorio(), exist_ok=True)
+    temporal = tempfile.NamedTemporaryFile(dir=_directorio(), suffix='.tmp', delete=False)
+    try:
+        with temporal:
+            resultado = generar(temporal)
+        ruta = _ruta(clave_cache, extension)
+        os.replace(temporal.name, ruta)
+    except BaseException:
+        if os.path.exists(temporal.name):
+            os.remove(temporal.name)
+        raise
+
+    archivo = open(ruta, 'rb')
+    desalojar(excepto=ruta)
+    return archivo, resultado
+
+
+def desalojar(maximo=None, excepto=None):
+    """Elimina las entradas menos usadas hasta que el total quede bajo `maximo` bytes"""
+    if maximo is None:
+        maximo = settings.ARCHIVOS_EXPORTACIONES_CACHE_MAXIMO
+
+    entradas = []
+    total = 0
+    try:
+        with os.scandir(_directorio()) as iterador:
+            for entrada in iterador:
+                if not entrada.is_file() or entrada.name.endswith('.tmp'):
+                    continue
+                info = entrada.stat()
+                entradas.append((info.st_mtime, info.st_size, entrada.path))
+                total += info.st_size
+    except FileNotFoundError:
+        return 0
+
+    eliminadas = 0
+    for _, tamaño, ruta in sorted(entradas):
+        if total <= maximo:
+            break
+        if ruta == excepto:
+            continue
+        try:
+            # En Linux los archivos abiertos (descargas en curso) siguen legibles
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        total -= tamaño
+        eliminadas += 1
+    if eliminadas:
+        logger.info("Caché de exportaciones: %s entrada(s) desalojada(s)", eliminadas)
+    return eliminadas
@@ -0,0 +1,438 @@
+"""
+Carga de archivos y publicación de versiones.
+
+publicar_version concentra el versionado que antes vivía en
+CargarArchivoView.form_valid: lo usan el formulario tradicional y las
+cargas por bloques. La versión sale del contador del periodo
+(ContadorVersion), bloqueado durante la publicación, en lugar de calcularse
+con Max('version') sobre el historial.
+
+Carga por bloques (reanudable): cada bloque se escribe como un archivo
+independiente en ARCHIVOS_CARGAS_DIR/<sesion>/ (temporal + rename), así que
+el estado de una sesión es lo que hay en disco y una carga interrumpida se
+reanuda enviando solo los bloques faltantes. Al completar, los bloques se
+concatenan en disco y el resultado se mueve (sin copiarlo) al área de
+preparación y de ahí a MEDIA_ROOT; ningún paso mantiene el archivo completo
+en memoria. Completar reclama antes las sesiones (activa -> completando con
+un UPDATE condicional): un doble envío o un reintento no ensambla ni
+publica dos veces.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .almacen import preparar_contenido, registrar_preparados
+from .manejadores import EXTENSIONES_PERMITIDAS, TAMAÑO_MAXIMO, detectar_tipo, verificar_contenido
+from .models import Archivo, ContadorVersion, SesionCarga
+
+logger = logging.getLogger(__name__)
+
+TAMAÑO_LECTURA = 64 * 1024
+
+
+def validar_archivo_subido(nombre, tamaño):
+    """Validaciones de tamaño y extensión comunes a todas las cargas"""
+    if tamaño > TAMAÑO_MAXIMO:
+        raise ValidationError(f'Archivo "{nombre}" muy grande: {tamaño/1024/1024:.1f} MB')
+
+    if tamaño == 0:
+        raise ValidationError(f'Archivo "{nombre}" está vacío')
+
+    if not any(nombre.lower().endswith(ext) for ext in EXTENSIONES_PERMITIDAS):
+        raise ValidationError(f'Archivo "{nombre}" tiene formato no permitido')
+
+
+def bloquear_periodo(fraccion_id, año, periodo_especifico):
+    """
+    Contador de versiones del periodo, bloqueado hasta el fin de la transacción.
+
+    Otra transacción que bloquee el mismo periodo espera a que esta termine,
+    así que la asignación de versiones y el cambio de vigencia quedan
+    ordenados. Debe llamarse dentro de transaction.atomic().
+    """
+    periodo = {'fraccion_id': fraccion_id, 'año': año, 'periodo_especifico': periodo_especifico}
+    try:
+        return ContadorVersion.objects.select_for_update().get(**periodo)
+    except ContadorVersion.DoesNotExist:
+        pass
+
+    # Primera carga del periodo: el contador parte de las versiones que ya
+    # existan (por ejemplo, creadas desde el admin)
+    ultima = Archivo.objects.filter(**periodo).aggregate(maxima=Max('version'))['maxima'] or 0
+    try:
+        with transaction.atomic():
+            ContadorVersion.objects.create(ultima_version=ultima, **periodo)
+    except IntegrityError:
+        pass  # Otra carga creó el contador al mismo tiempo
+    return ContadorVersion.objects.select_for_update().get(**periodo)
+
+
+def siguiente_version(fraccion_id, año, periodo_especifico):
+    """Reserva la siguiente versión del periodo (dentro de una transacción)"""
+    contador = bloquear_periodo(fraccion_id, año, periodo_especifico)
+    contador.ultima_version += 1
+    contador.save(update_fields=['ultima_version', 'updated_at'])
+    return contador.ultima_version
+
+
+def _preparar(archivo_file):
+    """Valida tamaño, extensión y firma del archivo y lo escribe en el área de preparación"""
+    validar_archivo_subido(archivo_file.name, archivo_file.size)
+    archivo_file.seek(0)
+    motivo = verificar_contenido(archivo_file.name, archivo_file.read(16))
+    archivo_file.seek(0)
+    if motivo:
+        raise ValidationError(motivo)
+    return preparar_contenido(archivo_file)
+
+
+def preparar_archivos(archivos_subidos):
+    """
+    Valida los archivos y los escribe en el área de preparación (fase 1,
+    fuera de la transacción), varios a la vez en ARCHIVOS_CARGA_HILOS hilos:
+    la lectura, el SHA-256 y la escritura liberan el GIL. Si alguno falla se
+    descartan todos y se lanza ValidationError con un mensaje por archivo.
+    Devuelve la lista de ContenidoPreparado en el mismo orden.
+    """
+    logger.info("Preparando %s archivo(s)", len(archivos_subidos))
+    with ThreadPoolExecutor(max_workers=settings.ARCHIVOS_CARGA_HILOS) as pool:
+        futuros = [pool.submit(_preparar, archivo_file) for archivo_file in archivos_subidos]
+
+    preparados = []
+    archivos_con_error = []
+    for archivo_file, futuro in zip(archivos_subidos, futuros):
+        try:
+            preparados.append(futuro.result())
+        except ValidationError as e:
+            logger.info("Error validando %s: %s", archivo_file.name, e)
+            archivos_con_error.append(f"{archivo_file.name}: {e}")
+        except Exception:
+            logger.exception("Error inesperado con %s", archivo_file.name)
+            archivos_con_error.append(f"{archivo_file.name}: Error inesperado")
+
+    if archivos_con_error:
+        descartar_preparados(preparados)
+        raise ValidationError(archivos_con_error)
+    return preparados
+
+
+def descartar_preparados(preparados):
+    for preparado in preparados:
+        preparado.descartar()
+
+
+def crear_archivos_preparados(preparados, **campos):
+    """
+    Filas de Archivo para los archivos preparados, todas con los mismos
+    `campos` (dentro de la transacción, sin escribir a disco), insertadas
+    con Archivo.objects.crear_en_lote.
+    """
+    if not preparados:
+        return []
+    contenidos = registrar_preparados(preparados)
+    return Archivo.objects.crear_en_lote(
+        Archivo(
+            archivo=contenido.ruta,
+            contenido=contenido,
+            nombre_original=preparado.nombre,
+            tamaño=preparado.tamaño,
+            **campos
+        )
+        for preparado, contenido in zip(preparados, contenidos)
+    )
+
+
+def publicar_version(fraccion, usuario, tipo_periodo, año, periodo_especifico, archivos_subidos,
+                     origen_importacion=''):
+    """
+    Crea una nueva versión vigente con todos los archivos recibidos.
+
+    En dos fases: los archivos se validan y se escriben en el área de
+    preparación antes de abrir la transacción; la transacción solo reserva la
+    versión, cambia la vigencia e inserta las filas en lote, y los archivos
+    se mueven a su lugar al confirmarse (almacen.registrar_preparados). Así
+    el periodo queda bloqueado milisegundos y no segundos por archivo.
+
+    Si algún archivo falla se lanza ValidationError con un mensaje por
+    archivo y no se guarda ningún registro (ni se consume la versión); los
+    archivos preparados se eliminan. Las cargas simultáneas del mismo
+    periodo se ordenan con el bloqueo del contador (bloquear_periodo).
+    `origen_importacion` es la carpeta de origen cuando la versión viene de
+    importar_archivos (ver importacion.ya_importada).
+    Devuelve (nueva_version, archivos_creados).
+    """
+    # 🔥 PASO 1: Escribir los archivos fuera de la transacción
+    preparados = preparar_archivos(archivos_subidos)
+
+    try:
+        with transaction.atomic():
+            # 🔥 PASO 2: Reservar la versión (bloquea el periodo hasta el commit)
+            nueva_version = siguiente_version(fraccion.id, año, periodo_especifico)
+            logger.info("Nueva versión asignada: %s", nueva_version)
+
+            # ⚡ MARCAR COMO NO VIGENTES ANTES DE CREAR NUEVOS
+            # (update() no aplica auto_now: updated_at se fija aquí para que
+            # la huella de la caché de exportaciones cambie)
+            cantidad_marcados = Archivo.objects.filter(
+                fraccion=fraccion,
+                año=año,
+                periodo_especifico=periodo_especifico,
+                vigente=True  # ← SOLO los que están vigentes
+            ).update(vigente=False, updated_at=timezone.now())
+            logger.info("%s archivos marcados como no vigentes", cantidad_marcados)
+
+            # 🔥 PASO 3: CREAR TODOS LOS REGISTROS NUEVOS COMO VIGENTES
+            archivos_creados = crear_archivos_preparados(
+                preparados,
+                fraccion=fraccion,
+                usuario=usuario,
+                tipo_periodo=tipo_periodo,
+                año=año,
+                periodo_especifico=periodo_especifico,
+                vigente=True,  # ✅ TODOS VIGENTES
+                version=nueva_version,  # ✅ MISMA VERSIÓN PARA TODOS
+                origen_importacion=origen_importacion,
+            )
+    except BaseException:
+        # Rollback: los callbacks de on_commit no se ejecutan
+        descartar_preparados(preparados)
+        raise
+
+    logger.info("%s archivos creados como vigentes (versión %s)", len(archivos_creados), nueva_version)
+    return nueva_version, archivos_creados
+
+
+# ---------------------------------------------------------------------------
+# Cargas por bloques
+# ---------------------------------------------------------------------------
+
+class ArchivoEnsamblado(File):
+    """Archivo ya escrito en disco: preparar_contenido lo mueve en lugar de copiarlo"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def directorio_sesion(sesion):
+    return os.path.join(settings.ARCHIVOS_CARGAS_DIR, str(sesion.pk))
+
+
+def _ruta_bloque(sesion, indice):
+    return os.path.join(directorio_sesion(sesion), f'{indice:06d}.part')
+
+
+def bloques_recibidos(sesion):
+    """Bloques completos en disco: {indice: tamaño}"""
+    recibidos = {}
+    try:
+        nombres = os.listdir(directorio_sesion(sesion))
+    except FileNotFoundError:
+        return recibidos
+    for nombre in nombres:
+        if nombre.endswith('.part'):
+            ruta = os.path.join(directorio_sesion(sesion), nombre)
+            recibidos[int(nombre[:-5])] = os.path.getsize(ruta)
+    return recibidos
+
+
+def bloques_faltantes(sesion):
+    recibidos = bloques_recibidos(sesion)
+    return [
+        indice for indice in range(sesion.total_bloques)
+        if recibidos.get(indice) != sesion.tamaño_esperado(indice)
+    ]
+
+
+def guardar_bloque(sesion, indice, flujo, sha256_esperado=''):
+    """
+    Escribe un bloque leyendo el flujo de la solicitud por partes.
+
+    El bloque se valida por tamaño y, si el cliente lo envía, por SHA-256;
+    solo entonces reemplaza (rename atómico) al bloque anterior con el
+    mismo índice, de modo que reenviar un bloque es seguro.
+    Devuelve el SHA-256 del bloque.
+    """
+    if not 0 <= indice < sesion.total_bloques:
+        raise ValidationError(f'Bloque {indice} fuera de rango (0-{sesion.total_bloques - 1})')
+
+    esperado = sesion.tamaño_esperado(indice)
+    directorio = directorio_sesion(sesion)
+    os.makedirs(directorio, exist_ok=True)
+
+    digest = hashlib.sha256()
+    escritos = 0
+    temporal = tempfile.NamedTemporaryFile(dir=directorio, suffix='.tmp', delete=False)
+    try:
+        with temporal:
+            while True:
+                datos = flujo.read(TAMAÑO_LECTURA)
+                if not datos:
+                    break
+                if indice == 0 and escritos == 0:
+                    # Rechazo temprano: el primer bloque trae la firma del formato
+                    motivo = verificar_contenido(sesion.nombre_original, datos)
+                    if motivo:
+                        raise ValidationError(motivo)
+                escritos += len(datos)
+                if escritos > esperado:
+                    raise ValidationError(f'Bloque {indice} excede el tamaño esperado ({esperado} bytes)')
+                digest.update(datos)
+                temporal.write(datos)
+
+        if escritos != esperado:
+            raise ValidationError(f'Bloque {indice} incompleto: {escritos} de {esperado} bytes')
+
+        calculado = digest.hexdigest()
+        if sha256_esperado and sha256_esperado.lower() != calculado:
+            raise ValidationError(f'Bloque {indice}: la suma SHA-256 no coincide')
+
+        os.replace(temporal.name, _ruta_bloque(sesion, indice))
+    except BaseException:
+        if os.path.exists(temporal.name):
+            os.remove(temporal.name)
+        raise
+
+    SesionCarga.objects.filter(pk=sesion.pk).update(updated_at=timezone.now())
+    return calculado
+
+
+def ensamblar(sesion):
+    """
+    Concatena los bloques en un solo archivo y verifica tipo y SHA-256.
+
+    Devuelve (ruta, sha256, tipo_detectado).
+    """
+    faltantes = bloques_faltantes(sesion)
+    if faltantes:
+        raise ValidationError(
+            f'Archivo "{sesion.nombre_original}" incompleto: faltan {len(faltantes)} bloque(s)'
+        )
+
+    # El tipo real se verifica con el primer bloque, antes de concatenar
+    with open(_ruta_bloque(sesion, 0), 'rb') as bloque:
+        cabecera = bloque.read(16)
+    motivo = verificar_contenido(sesion.nombre_original, cabecera)
+    if motivo:
+        raise ValidationError(motivo)
+
+    ruta = os.path.join(directorio_sesion(sesion), 'ensamblado')
+    digest = hashlib.sha256()
+    with open(ruta, 'wb') as destino:
+        for indice in range(sesion.total_bloques):
+            with open(_ruta_bloque(sesion, indice), 'rb') as bloque:
+                while True:
+                    datos = bloque.read(TAMAÑO_LECTURA)
+                    if not datos:
+                        break
+                    digest.update(datos)
+                    destino.write(datos)
+
+    if sesion.sha256 and sesion.sha256.lower() != digest.hexdigest():
+        os.remove(ruta)
+        raise ValidationError(f'Archivo "{sesion.nombre_original}": la suma SHA-256 no coincide')
+    return ruta, digest.hexdigest(), detectar_tipo(cabecera)
+
+
+def completar_cargas(sesiones, usuario):
+    """
+    Ensambla las sesiones y las publica como una sola versión.
+
+    Todas las sesiones deben pertenecer al mismo periodo. Si la publicación
+    falla los bloques se conservan para reintentar.
+    Devuelve (nueva_version, archivos_creados).
+    """
+    if not sesiones:
+        raise ValidationError('No se recibió ninguna sesión de carga.')
+
+    periodos = {(s.fraccion_id, s.tipo_periodo, s.año, s.periodo_especifico) for s in sesiones}
+    if len(periodos) > 1:
+        raise ValidationError('Todas las cargas deben pertenecer a la misma fracción y periodo.')
+
+    nombres = [s.nombre_original for s in sesiones]
+    if len(nombres) != len(set(nombres)):
+        raise ValidationError('No puedes subir dos archivos con el mismo nombre en la misma operación.')
+
+    _reclamar(sesiones)
+    archivos = []
+    try:
+        for sesion in sesiones:
+            ruta, sha256, tipo = ensamblar(sesion)
+            archivo = ArchivoEnsamblado(open(ruta, 'rb'), name=sesion.nombre_original)
+            # Mismos atributos que agrega ManejadorCargaVerificada
+            archivo.sha256 = sha256
+            archivo.tipo_detectado = tipo
+            archivos.append(archivo)
+
+        primera = sesiones[0]
+        nueva_version, archivos_creados = publicar_version(
+            primera.fraccion, usuario, primera.tipo_periodo, primera.año,
+            primera.periodo_especifico, archivos,
+        )
+    except BaseException:
+        # Los bloques se conservan: la sesión vuelve a quedar disponible para reintentar
+        SesionCarga.objects.filter(
+            pk__in=[sesion.pk for sesion in sesiones], estado='completando'
+        ).update(estado='activa', updated_at=timezone.now())
+        for sesion in sesiones:
+            sesion.estado = 'activa'
+        raise
+    finally:
+        for archivo in archivos:
+            archivo.close()
+
+    for sesion, archivo in zip(sesiones, archivos_creados):
+        sesion.estado = 'completada'
+        sesion.archivo = archivo
+        sesion.save(update_fields=['estado', 'archivo', 'updated_at'])
+        shutil.rmtree(directorio_sesion(sesion), ignore_errors=True)
+
+    return nueva_version, archivos_creados
+
+
+def _reclamar(sesiones):
+    """
+    Pasa las sesiones de activa a completando, todas o ninguna. El UPDATE
+    condicional es atómico: de dos solicitudes simultáneas solo una las
+    reclama y la otra recibe ValidationError.
+    """
+    with transaction.atomic():
+        reclamadas = SesionCarga.objects.filter(
+            pk__in=[sesion.pk for sesion in sesiones], estado='activa'
+        ).update(estado='completando', updated_at=timezone.now())
+        if reclamadas != len(sesiones):
+            raise ValidationError('Alguna sesión ya se está completando o ya fue completada.')
+    for sesion in sesiones:
+        sesion.estado = 'completando'
+
+
+def cancelar_carga(sesion):
+    sesion.estado = 'cancelada'
+    sesion.save(update_fields=['estado', 'updated_at'])
+    shutil.rmtree(directorio_sesion(sesion), ignore_errors=True)
+
+
+def limpiar_cargas_vencidas(horas=None):
+    """
+    Cancela las sesiones activas sin bloques nuevos en las últimas `horas`
+    (y las que quedaron completando porque el proceso terminó a la mitad)
+    """
+    if horas is None:
+        horas = settings.ARCHIVOS_CARGA_VIGENCIA_HORAS
+    limite = timezone.now() - timedelta(hours=horas)
+    vencidas = SesionCarga.objects.filter(estado__in=['activa', 'completando'], updated_at__lt=limite)
+    total = 0
+    for sesion in vencidas.iterator():
+        cancelar_carga(sesion)
+        total += 1
+    return total
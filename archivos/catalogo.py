@@ -0,0 +1,84 @@
+"""
+Catálogo de fracciones en memoria del proceso.
+
+Fraccion es una tabla pequeña y casi fija (la carga cargar_fracciones) que
+se consulta en casi todas las páginas. `catalogo` la lee completa una vez
+por proceso y responde por id, por número y por tipo de usuario sin ir a la
+base de datos.
+
+Para que todos los workers vean los cambios, la versión del catálogo vive
+en la base de datos (VersionCatalogo), no en la caché de Django: con
+LocMemCache cada proceso tendría la suya. Al guardar o eliminar una
+Fraccion (signals.py) se incrementa la versión; cada proceso la consulta a
+lo sumo una vez cada ARCHIVOS_CATALOGO_REVISION_SEGUNDOS y recarga la tabla
+si cambió. El proceso que hizo el cambio recarga de inmediato.
+Las instancias se comparten entre solicitudes e hilos: son de solo lectura
+(copy.copy() antes de agregarles atributos).
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Fraccion, VersionCatalogo
+
+NOMBRE = 'fracciones'
+
+
+class CatalogoFracciones:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._revisado = None  # time.monotonic() de la última consulta de la versión
+        self._datos = ({}, {})  # (por id, por número); se reemplaza completo al recargar
+
+    def _vigente(self):
+        """(por id, por número), recargados si otro proceso cambió la versión"""
+        revisado = self._revisado
+        if revisado is None or time.monotonic() - revisado >= settings.ARCHIVOS_CATALOGO_REVISION_SEGUNDOS:
+            with self._lock:
+                if self._revisado is revisado:
+                    version = VersionCatalogo.objects.filter(nombre=NOMBRE).values_list('version', flat=True).first() or 0
+                    if version != self._version:
+                        fracciones = list(Fraccion.objects.all())
+                        self._datos = (
+                            {fraccion.id: fraccion for fraccion in fracciones},
+                            {fraccion.numero: fraccion for fraccion in fracciones},
+                        )
+                        self._version = version
+                    self._revisado = time.monotonic()
+        return self._datos
+
+    def todas(self):
+        """Todas las fracciones, en el orden del modelo (por número)"""
+        return list(self._vigente()[0].values())
+
+    def por_id(self, fraccion_id):
+        try:
+            return self._vigente()[0].get(int(fraccion_id))
+        except (TypeError, ValueError):
+            return None
+
+    def por_numero(self, numero):
+        return self._vigente()[1].get(numero)
+
+    def por_tipo_usuario(self, tipo_usuario, solo_activas=True):
+        return [
+            fraccion for fraccion in self._vigente()[0].values()
+            if fraccion.tipo_usuario_asignado == tipo_usuario and (fraccion.activa or not solo_activas)
+        ]
+
+    def invalidar(self):
+        """Nueva versión: este proceso recarga ya y los demás en su siguiente revisión"""
+        if not VersionCatalogo.objects.filter(nombre=NOMBRE).update(
+            version=F('version') + 1, updated_at=timezone.now()
+        ):
+            VersionCatalogo.objects.get_or_create(nombre=NOMBRE, defaults={'version': 1})
+        with self._lock:
+            self._version = None
+            self._revisado = None
+
+
+catalogo = CatalogoFracciones()
@@ -0,0 +1,98 @@
+"""
+Consolidación incremental de HistorialAcceso en AccesoDiario.
+
+Solo se procesan los registros con id mayor a la marca guardada en
+MarcaConsolidacion, por bloques de ids, de modo que el costo de cada
+ejecución depende de los accesos nuevos y no del tamaño del historial.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import AccesoDiario, HistorialAcceso, MarcaConsolidacion
+
+MARCA_HISTORIAL = 'historial_acceso'
+
+
+def _tope_consolidable(margen, desde_id):
+    """
+    Último id que se puede consolidar sin riesgo.
+
+    Se deja fuera lo más reciente (margen) para no adelantar la marca sobre
+    inserciones por lotes que todavía no se confirman. Solo revisa los ids
+    posteriores a la marca.
+    """
+    limite = timezone.now() - margen
+    return HistorialAcceso.objects.filter(
+        id__gt=desde_id, fecha_acceso__lt=limite
+    ).aggregate(tope=Max('id'))['tope']
+
+
+def _aplicar_bloque(desde, hasta):
+    """Suma los accesos con id en (desde, hasta] a los totales diarios."""
+    filas = (
+        HistorialAcceso.objects.filter(id__gt=desde, id__lte=hasta)
+        .annotate(fecha=TruncDate('fecha_acceso'))
+        .values('archivo_id', 'fecha', 'es_acceso_publico')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    incrementos = {
+        (fila['archivo_id'], fila['fecha'], fila['es_acceso_publico']): fila['total']
+        for fila in filas
+    }
+    if not incrementos:
+        return 0
+
+    existentes = AccesoDiario.objects.select_for_update().filter(
+        archivo_id__in={clave[0] for clave in incrementos},
+        fecha__in={clave[1] for clave in incrementos},
+    )
+    por_actualizar = []
+    for acceso in existentes:
+        clave = (acceso.archivo_id, acceso.fecha, acceso.es_acceso_publico)
+        if clave in incrementos:
+            acceso.total += incrementos.pop(clave)
+            por_actualizar.append(acceso)
+
+    AccesoDiario.objects.bulk_update(por_actualizar, ['total'], batch_size=500)
+    AccesoDiario.objects.bulk_create(
+        [
+            AccesoDiario(archivo_id=archivo_id, fecha=fecha, es_acceso_publico=publico, total=total)
+            for (archivo_id, fecha, publico), total in incrementos.items()
+        ],
+        batch_size=500,
+    )
+    return len(por_actualizar) + len(incrementos)
+
+
+def consolidar_accesos(margen=timedelta(minutes=5), tamaño_bloque=50000):
+    """
+    Procesa los accesos nuevos desde la última marca.
+
+    Cada bloque se aplica en su propia transacción junto con el avance de la
+    marca, así que una ejecución interrumpida se puede reanudar sin contar
+    dos veces. Devuelve un resumen con los ids procesados.
+    """
+    marca, _ = MarcaConsolidacion.objects.get_or_create(nombre=MARCA_HISTORIAL)
+    tope = _tope_consolidable(margen, marca.ultimo_id)
+
+    resumen = {'desde': None, 'hasta': None, 'bloques': 0, 'filas_diarias': 0}
+    while tope is not None:
+        with transaction.atomic():
+            # Bloquea la marca: evita dos consolidaciones simultáneas
+            marca = MarcaConsolidacion.objects.select_for_update().get(nombre=MARCA_HISTORIAL)
+            if resumen['desde'] is None:
+                resumen['desde'] = marca.ultimo_id
+            if marca.ultimo_id >= tope:
+                break
+            hasta = min(marca.ultimo_id + tamaño_bloque, tope)
+            resumen['filas_diarias'] += _aplicar_bloque(marca.ultimo_id, hasta)
+            marca.ultimo_id = hasta
+            marca.save(update_fields=['ultimo_id', 'updated_at'])
+            resumen['hasta'] = hasta
+            resumen['bloques'] += 1
+    return resumen
@@ -0,0 +1,312 @@
+"""
+Entrega de archivos almacenados en MEDIA_ROOT.
+
+Centraliza la lógica que comparten las vistas de visualización y descarga
+(públicas y privadas): validadores HTTP (ETag / Last-Modified) con respuestas
+304, soporte para solicitudes parciales (Range / If-Range), respuestas 206 con
+uno o varios rangos y el encabezado Accept-Ranges.
+
+La transferencia de bytes depende de settings.ARCHIVOS_ENTREGA:
+
+- 'django': el worker transmite el archivo (desarrollo, sin proxy).
+- 'nginx': Django solo autoriza y registra; nginx envía el archivo desde una
+  location interna mediante X-Accel-Redirect.
+- 'sendfile': igual que 'nginx' pero con X-Sendfile (Apache / lighttpd).
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import get_random_string
+from django.utils.http import (
+    content_disposition_header, http_date, parse_http_date_safe, quote_etag,
+)
+
+# Tamaño de lectura al enviar rangos (64 KB, igual que FileResponse)
+TAMAÑO_BLOQUE = 64 * 1024
+
+# Máximo de rangos aceptados en una sola solicitud (evita abusos)
+MAX_RANGOS = 16
+
+RANGO_RE = re.compile(r'^(\d*)-(\d*)$')
+
+
+def parsear_rangos(encabezado, tamaño):
+    """
+    Interpreta un encabezado Range ('bytes=0-99,200-,-500').
+
+    Devuelve una lista ordenada de tuplas (inicio, fin) inclusivas, ya
+    combinadas cuando se traslapan. Devuelve None si el encabezado no es
+    válido (en ese caso se debe ignorar y servir el archivo completo) y una
+    lista vacía si ningún rango es satisfacible (416).
+    """
+    if not encabezado:
+        return None
+
+    unidad, _, especificacion = encabezado.partition('=')
+    if unidad.strip().lower() != 'bytes' or not especificacion.strip():
+        return None
+
+    partes = [p.strip() for p in especificacion.split(',') if p.strip()]
+    if not partes or len(partes) > MAX_RANGOS:
+        return None
+
+    rangos = []
+    for parte in partes:
+        match = RANGO_RE.match(parte.replace(' ', ''))
+        if not match:
+            return None
+        inicio, fin = match.groups()
+
+        if inicio == '' and fin == '':
+            return None
+
+        if inicio == '':
+            # Sufijo: los últimos N bytes
+            longitud = int(fin)
+            if longitud == 0 or tamaño == 0:
+                # Un archivo vacío no tiene ningún byte que servir
+                continue
+            rangos.append((max(tamaño - longitud, 0), tamaño - 1))
+            continue
+
+        inicio = int(inicio)
+        if fin != '' and int(fin) < inicio:
+            return None
+        if inicio >= tamaño:
+            continue
+        fin = int(fin) if fin != '' else tamaño - 1
+        rangos.append((inicio, min(fin, tamaño - 1)))
+
+    # Combinar rangos traslapados o contiguos
+    rangos.sort()
+    combinados = []
+    for inicio, fin in rangos:
+        if combinados and inicio <= combinados[-1][1] + 1:
+            combinados[-1] = (combinados[-1][0], max(combinados[-1][1], fin))
+        else:
+            combinados.append((inicio, fin))
+    return combinados
+
+
+def validadores_archivo(archivo):
+    """
+    Calcula el ETag fuerte y la fecha Last-Modified de un Archivo.
+
+    Solo usa metadatos guardados en la base de datos (id, nombre en disco,
+    tamaño y updated_at), de modo que se pueden evaluar sin tocar el disco.
+    Cualquier reemplazo del archivo cambia updated_at y por lo tanto el ETag.
+    """
+    updated_at = archivo.updated_at.timestamp() if archivo.updated_at else 0
+    huella = f"{archivo.pk}:{archivo.archivo.name}:{archivo.tamaño}:{updated_at:.6f}"
+    etag = quote_etag(hashlib.sha1(huella.encode('utf-8')).hexdigest())
+    # HTTP solo maneja segundos; se trunca para que If-Modified-Since coincida
+    return etag, int(updated_at) or None
+
+
+def _cache_control(response, publico):
+    # El cliente puede guardar copia pero debe revalidar siempre (el archivo
+    # puede reemplazarse desde EditarVersionView)
+    if publico:
+        patch_cache_control(response, public=True, no_cache=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+
+
+def respuesta_no_modificada(request, archivo, publico=False):
+    """
+    Evalúa If-None-Match / If-Modified-Since (y If-Match / If-Unmodified-Since).
+
+    Devuelve una respuesta 304 (o 412) sin abrir el archivo cuando la copia del
+    cliente sigue vigente, o None si hay que servir el contenido.
+    """
+    etag, last_modified = validadores_archivo(archivo)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        return None
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    _cache_control(response, publico)
+    return response
+
+
+def solicita_continuacion(request):
+    """
+    Indica si la solicitud pide un rango que no inicia en el byte 0.
+
+    Los visores de PDF y los gestores de descargas generan muchas solicitudes
+    parciales para un mismo acceso; solo la primera debe registrarse en el
+    historial.
+    """
+    encabezado = request.META.get('HTTP_RANGE', '')
+    unidad, _, especificacion = encabezado.partition('=')
+    if unidad.strip().lower() != 'bytes':
+        return False
+    primera = especificacion.split(',')[0].strip()
+    return bool(primera) and not primera.startswith('0-')
+
+
+def _if_range_coincide(request, etag, last_modified):
+    """Evalúa If-Range: el rango solo aplica si el validador sigue vigente."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Solo se aceptan ETags fuertes (RFC 9110, sección 13.1.5)
+        return etag is not None and not if_range.startswith('W/') and if_range == etag
+
+    fecha = parse_http_date_safe(if_range)
+    return fecha is not None and last_modified is not None and int(last_modified) == fecha
+
+
+def _leer_rango(archivo, inicio, fin):
+    """Generador que lee los bytes [inicio, fin] del archivo abierto."""
+    archivo.seek(inicio)
+    restante = fin - inicio + 1
+    while restante > 0:
+        bloque = archivo.read(min(TAMAÑO_BLOQUE, restante))
+        if not bloque:
+            break
+        restante -= len(bloque)
+        yield bloque
+
+
+def _contenido_rango_simple(file_path, inicio, fin):
+    with open(file_path, 'rb') as archivo:
+        yield from _leer_rango(archivo, inicio, fin)
+
+
+def _partes_multirango(rangos, tamaño, content_type, boundary):
+    """Encabezados de cada parte de una respuesta multipart/byteranges."""
+    for inicio, fin in rangos:
+        yield inicio, fin, (
+            f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {inicio}-{fin}/{tamaño}\r\n'
+            '\r\n'
+        ).encode('latin-1')
+
+
+def _contenido_multirango(file_path, rangos, tamaño, content_type, boundary):
+    with open(file_path, 'rb') as archivo:
+        for inicio, fin, encabezado in _partes_multirango(rangos, tamaño, content_type, boundary):
+            yield encabezado
+            yield from _leer_rango(archivo, inicio, fin)
+            yield b'\r\n'
+        yield f'--{boundary}--\r\n'.encode('latin-1')
+
+
+def _respuesta_delegada(modo, file_path, content_type, as_attachment, filename):
+    """
+    Respuesta vacía que delega la transferencia al servidor web.
+
+    El servidor web atiende Range, Content-Length y el envío del archivo;
+    Django solo fija el tipo de contenido y el nombre de descarga.
+    """
+    response = HttpResponse(content_type=content_type)
+    if modo == 'nginx':
+        relativa = os.path.relpath(file_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        prefijo = settings.ARCHIVOS_ENTREGA_URL_INTERNA.rstrip('/')
+        response['X-Accel-Redirect'] = quote(f"{prefijo}/{relativa}")
+    else:
+        response['X-Sendfile'] = os.fspath(file_path)
+
+    disposition = content_disposition_header(as_attachment, filename or os.path.basename(file_path))
+    if disposition and (as_attachment or filename):
+        response['Content-Disposition'] = disposition
+    return response
+
+
+def servir_archivo(request, file_path, content_type=None, as_attachment=False,
+                   filename=None, archivo=None, publico=False):
+    """
+    Sirve un archivo del disco respetando Range / If-Range.
+
+    Si se recibe el Archivo correspondiente, la respuesta lleva sus
+    validadores (ETag / Last-Modified) para que las siguientes visitas puedan
+    resolverse con respuesta_no_modificada().
+
+    - Sin Range (o con If-Range desactualizado): 200 con el archivo completo.
+    - Un rango: 206 con Content-Range.
+    - Varios rangos: 206 multipart/byteranges.
+    - Ningún rango satisfacible: 416 con Content-Range: bytes */tamaño.
+
+    En modo 'nginx' o 'sendfile' los rangos los resuelve el servidor web.
+    """
+    if content_type is None:
+        content_type, _ = mimetypes.guess_type(file_path)
+    content_type = content_type or 'application/octet-stream'
+
+    modo = getattr(settings, 'ARCHIVOS_ENTREGA', 'django')
+    if modo in ('nginx', 'sendfile'):
+        response = _respuesta_delegada(modo, file_path, content_type, as_attachment, filename)
+        if archivo is not None:
+            etag, last_modified = validadores_archivo(archivo)
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+        _cache_control(response, publico)
+        return response
+
+    stat = os.stat(file_path)
+    tamaño = stat.st_size
+    etag, last_modified = None, stat.st_mtime
+    if archivo is not None:
+        etag, last_modified = validadores_archivo(archivo)
+        last_modified = last_modified or stat.st_mtime
+
+    rangos = None
+    if request.method in ('GET', 'HEAD') and _if_range_coincide(request, etag, last_modified):
+        rangos = parsear_rangos(request.META.get('HTTP_RANGE'), tamaño)
+
+    if rangos is None:
+        response = FileResponse(
+            open(file_path, 'rb'),
+            content_type=content_type,
+            as_attachment=as_attachment,
+            filename=filename or '',
+        )
+    elif not rangos:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{tamaño}'
+    elif len(rangos) == 1:
+        inicio, fin = rangos[0]
+        response = StreamingHttpResponse(
+            _contenido_rango_simple(file_path, inicio, fin),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Range'] = f'bytes {inicio}-{fin}/{tamaño}'
+        response['Content-Length'] = str(fin - inicio + 1)
+    else:
+        boundary = get_random_string(24)
+        longitud = sum(
+            len(encabezado) + (fin - inicio + 1) + 2
+            for inicio, fin, encabezado in _partes_multirango(rangos, tamaño, content_type, boundary)
+        ) + len(f'--{boundary}--\r\n')
+        response = StreamingHttpResponse(
+            _contenido_multirango(file_path, rangos, tamaño, content_type, boundary),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+        )
+        response['Content-Length'] = str(longitud)
+
+    if response.status_code == 206 and (as_attachment or filename):
+        disposition = content_disposition_header(as_attachment, filename or os.path.basename(file_path))
+        if disposition:
+            response['Content-Disposition'] = disposition
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(last_modified)
+    if etag:
+        response['ETag'] = etag
+    _cache_control(response, publico)
+    return response
@@ -0,0 +1,618 @@
+"""
+Motor de exportación del listado de archivos.
+
+El XLSX se genera con openpyxl en modo write-only: las filas se escriben al
+disco conforme llegan del cursor del servidor (queryset.iterator) y los
+estilos son NamedStyle compartidos, así que la memoria no crece con el
+número de filas. El libro se guarda en un archivo temporal que la vista
+envía con FileResponse por partes.
+
+El modo "una hoja por fracción" escribe cada hoja en un proceso distinto
+(cada uno con su propio libro temporal) y después une las partes a nivel
+del paquete XLSX: las hojas usan cadenas en línea y todos los libros
+registran los estilos en el mismo orden, así que el XML de cada hoja se
+copia tal cual al libro final.
+
+CSV y JSON Lines se generan como flujo (StreamingHttpResponse): cada fila
+sale del cursor y se envía de inmediato, opcionalmente comprimida con gzip
+sobre la marcha, sin acumular el resultado en el worker.
+"""
+import csv
+import json
+import shutil
+import tempfile
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+
+import django
+from django.db import connections
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from . import busqueda
+from .catalogo import catalogo
+from .models import TIPO_PERIODO_CHOICES, Archivo, PerfilUsuario
+
+# Campos que necesita cualquier formato de exportación del listado
+CAMPOS_LISTADO = (
+    'id',
+    'fraccion__numero',
+    'fraccion__nombre',
+    'año',
+    'tipo_periodo',
+    'periodo_especifico',
+    'nombre_original',
+    'version',
+    'vigente',
+    'created_at',
+)
+TAMAÑO_CURSOR = 2000
+
+ENCABEZADOS_XLSX = [
+    'Número',
+    'Fracción',
+    'Año',
+    'Tipo Periodo',
+    'Archivo',
+    'Fecha Carga',
+    'Enlace Público'
+]
+ANCHOS_XLSX = [
+    12,  # Número
+    45,  # Fracción
+    10,  # Año
+    15,  # Tipo Periodo
+    40,  # Archivo
+    18,  # Fecha Carga
+    55   # Enlace Público
+]
+TIPOS_PERIODO = dict(TIPO_PERIODO_CHOICES)
+# Orden en que cada libro registra sus estilos (ver _fijar_estilos)
+NOMBRES_ESTILOS = ('encabezado', 'fraccion', 'vigente', 'historico', 'titulo_reporte', 'etiqueta')
+
+
+def filtrar_listado(tipo_usuario, parametros):
+    """
+    Archivos de las fracciones del tipo de usuario con los filtros del listado.
+
+    `parametros` es request.GET o los filtros guardados de un trabajo de
+    exportación; sin estado se muestran solo los vigentes.
+    """
+    queryset = Archivo.objects.filter(
+        fraccion__tipo_usuario_asignado=tipo_usuario
+    ).select_related('fraccion', 'usuario').order_by('-created_at')
+
+    # FILTRO POR ESTADO (VIGENTE/HISTÓRICO/TODOS)
+    estado = parametros.get('estado') or 'vigente'
+    if estado == 'vigente':
+        queryset = queryset.filter(vigente=True)
+    elif estado == 'historico':
+        queryset = queryset.filter(vigente=False)
+    # Si estado == 'todos', no filtramos por vigente
+
+    if parametros.get('fraccion'):
+        queryset = queryset.filter(fraccion_id=parametros.get('fraccion'))
+    if parametros.get('año'):
+        queryset = queryset.filter(año=parametros.get('año'))
+    if parametros.get('tipo_periodo'):
+        queryset = queryset.filter(tipo_periodo=parametros.get('tipo_periodo'))
+    if parametros.get('periodo_especifico'):
+        queryset = queryset.filter(periodo_especifico=parametros.get('periodo_especifico'))
+
+    return busqueda.filtrar(queryset, parametros.get('busqueda'))
+
+
+def _fraccion_filtrada(parametros):
+    return catalogo.por_id(parametros.get('fraccion'))
+
+
+def informacion_reporte(usuario, parametros):
+    """Etiquetas del bloque de información (el total lo agrega el exportador)"""
+    try:
+        tipo_usuario = usuario.perfilusuario.get_tipo_usuario_display()
+    except PerfilUsuario.DoesNotExist:
+        tipo_usuario = "Usuario"
+    info_data = [
+        ("Reporte generado por:", f"{usuario.get_full_name() or usuario.username}"),
+        ("Fecha de generación:", timezone.now().strftime("%d/%m/%Y %H:%M")),
+        ("Tipo de usuario:", tipo_usuario),
+    ]
+    filtros_info = []
+    if parametros.get('fraccion'):
+        fraccion = _fraccion_filtrada(parametros)
+        if fraccion:
+            filtros_info.append(f"Fracción: {fraccion.numero} - {fraccion.nombre}")
+    if parametros.get('año'):
+        filtros_info.append(f"Año: {parametros.get('año')}")
+    if parametros.get('tipo_periodo'):
+        filtros_info.append(f"Tipo Periodo: {parametros.get('tipo_periodo').capitalize()}")
+    if parametros.get('periodo_especifico'):
+        filtros_info.append(f"Periodo Específico: {parametros.get('periodo_especifico')}")
+    if parametros.get('estado'):
+        filtros_info.append(f"Estado: {parametros.get('estado').capitalize()}")
+    if parametros.get('busqueda'):
+        filtros_info.append(f"Búsqueda: {parametros.get('busqueda')}")
+    if filtros_info:
+        info_data.append(("Filtros aplicados:", " | ".join(filtros_info)))
+    return info_data
+
+
+def nombre_exportacion(parametros, total=None):
+    """Nombre base del archivo exportado (sin extensión); total=None si aún no se conoce"""
+    fecha_actual = timezone.now().strftime("%Y%m%d_%H%M")
+    filtro_str = ""
+    if parametros.get('año'):
+        filtro_str += f"_{parametros.get('año')}"
+    if parametros.get('fraccion'):
+        fraccion = _fraccion_filtrada(parametros)
+        if fraccion:
+            filtro_str += f"_Frac{fraccion.numero}"
+    elif total is None or total > 0:
+        filtro_str += "_TodasFracciones"
+    if parametros.get('hojas') == 'fraccion':
+        filtro_str += "_PorFraccion"
+    return f"Archivos_Articulo65{filtro_str}_{fecha_actual}"
+
+
+def filas_listado(queryset):
+    """
+    Filas del listado como diccionarios, ordenadas por fracción y leídas con
+    cursor del servidor (en PostgreSQL, un cursor con nombre).
+    """
+    return queryset.order_by(
+        'fraccion__numero',
+        'año',
+        'periodo_especifico',
+        '-created_at'
+    ).values(*CAMPOS_LISTADO).iterator(chunk_size=TAMAÑO_CURSOR)
+
+
+def _registrar_estilos(wb):
+    """Estilos con nombre: cada celda guarda una referencia, no una copia"""
+    borde = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+    centrado = Alignment(horizontal="center", vertical="center")
+    estilos = [
+        NamedStyle(
+            name='encabezado',
+            font=Font(bold=True, color="FFFFFF", size=12),
+            fill=PatternFill(start_color="366092", end_color="366092", fill_type="solid"),
+            alignment=centrado,
+            border=borde,
+        ),
+        NamedStyle(
+            name='fraccion',
+            font=Font(bold=True, color="FFFFFF", size=11),
+            fill=PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid"),
+            alignment=centrado,
+            border=borde,
+        ),
+        NamedStyle(
+            name='vigente',
+            fill=PatternFill(start_color="E8F5E8", end_color="E8F5E8", fill_type="solid"),
+            border=borde,
+        ),
+        NamedStyle(
+            name='historico',
+            fill=PatternFill(start_color="F5F5F5", end_color="F5F5F5", fill_type="solid"),
+            border=borde,
+        ),
+        NamedStyle(
+            name='titulo_reporte',
+            font=Font(bold=True, size=11),
+            fill=PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid"),
+        ),
+        NamedStyle(name='etiqueta', font=Font(bold=True)),
+    ]
+    for estilo in estilos:
+        wb.add_named_style(estilo)
+
+
+def _celda(ws, valor, estilo=None):
+    celda = WriteOnlyCell(ws, value=valor)
+    if estilo:
+        celda.style = estilo
+    return celda
+
+
+def _fijar_estilos(ws):
+    """
+    Registra los estilos del libro en orden fijo.
+
+    openpyxl numera los estilos de celda según el orden en que se usan por
+    primera vez; fijarlo hace que libros generados por separado tengan el
+    mismo styles.xml y sus hojas se puedan combinar.
+    """
+    for nombre in NOMBRES_ESTILOS:
+        _celda(ws, None, nombre).style_id
+
+
+def escribir_hoja_listado(wb, titulo, filas, enlace_publico):
+    """
+    Escribe una hoja con los archivos agrupados por fracción.
+
+    `enlace_publico` recibe el id del archivo y devuelve su URL pública.
+    Devuelve (ws, fila_actual, total, por_fraccion); los totales se cuentan
+    en la misma pasada.
+    """
+    ws = wb.create_sheet(title=titulo)
+    _fijar_estilos(ws)
+    # En modo write-only los anchos se definen antes de la primera fila
+    for col, ancho in enumerate(ANCHOS_XLSX, 1):
+        ws.column_dimensions[get_column_letter(col)].width = ancho
+
+    ws.append([_celda(ws, encabezado, 'encabezado') for encabezado in ENCABEZADOS_XLSX])
+    fila_actual = 2
+
+    total = 0
+    por_fraccion = OrderedDict()
+    fraccion_actual = None
+    for fila in filas:
+        numero = fila['fraccion__numero']
+        if numero != fraccion_actual:
+            if fraccion_actual is not None:
+                ws.append([])
+                fila_actual += 1
+            ws.merged_cells.add(f'A{fila_actual}:G{fila_actual}')
+            ws.append(
+                [_celda(ws, f"FRACCIÓN {numero} - {fila['fraccion__nombre']}", 'fraccion')]
+                + [_celda(ws, None, 'fraccion') for _ in range(len(ENCABEZADOS_XLSX) - 1)]
+            )
+            fila_actual += 1
+            fraccion_actual = numero
+            por_fraccion[numero] = 0
+
+        estilo = 'vigente' if fila['vigente'] else 'historico'
+        ws.append([
+            _celda(ws, valor, estilo) for valor in (
+                numero,
+                fila['fraccion__nombre'],
+                fila['año'],
+                TIPOS_PERIODO.get(fila['tipo_periodo'], fila['tipo_periodo']),
+                fila['nombre_original'],
+                fila['created_at'].strftime("%d/%m/%Y %H:%M"),
+                enlace_publico(fila['id']),
+            )
+        ])
+        fila_actual += 1
+        total += 1
+        por_fraccion[numero] += 1
+
+    return ws, fila_actual, total, por_fraccion
+
+
+def escribir_informacion_reporte(ws, fila_actual, informacion, por_fraccion):
+    """Bloque de información del reporte y, si hay varias, archivos por fracción"""
+    for _ in range(3):
+        ws.append([])
+    fila_actual += 3
+    ws.merged_cells.add(f'A{fila_actual}:C{fila_actual}')
+    ws.append([_celda(ws, "INFORMACIÓN DEL REPORTE", 'titulo_reporte')])
+
+    for etiqueta, valor in informacion:
+        ws.append([_celda(ws, etiqueta, 'etiqueta'), str(valor)])
+
+    if len(por_fraccion) > 1:
+        ws.append([])
+        ws.append([_celda(ws, "ARCHIVOS POR FRACCIÓN:", 'etiqueta')])
+        for numero, total in por_fraccion.items():
+            ws.append([f"Fracción {numero}:", f"{total} archivo(s)"])
+
+
+def exportar_listado_xlsx(destino, filas, enlace_publico, informacion):
+    """
+    Genera el XLSX del listado en `destino` (ruta o archivo binario).
+
+    `informacion` es la lista de (etiqueta, valor) del bloque del reporte;
+    el total de archivos se inserta después de las tres primeras entradas,
+    como en el reporte original. Devuelve el total de filas exportadas.
+    """
+    wb = Workbook(write_only=True)
+    _registrar_estilos(wb)
+    ws, fila_actual, total, por_fraccion = escribir_hoja_listado(
+        wb, "Archivos Artículo 65", filas, enlace_publico
+    )
+    informacion = list(informacion)
+    informacion.insert(3, ("Total de archivos:", total))
+    escribir_informacion_reporte(ws, fila_actual, informacion, por_fraccion)
+    wb.save(destino)
+    return total
+
+
+# ---------------------------------------------------------------------------
+# Libro con una hoja por fracción (en paralelo)
+# ---------------------------------------------------------------------------
+
+ENCABEZADOS_RESUMEN = ['Número', 'Fracción', 'Archivos', 'Vigentes', 'Históricos']
+ANCHOS_RESUMEN = [12, 60, 12, 12, 12]
+
+
+def _titulo_hoja(numero, usados):
+    """Nombre de hoja válido para Excel (máximo 31 caracteres, sin []:*?/\\) y único"""
+    titulo = f"Fracción {numero}"
+    for caracter in '[]:*?/\\':
+        titulo = titulo.replace(caracter, '-')
+    titulo = titulo[:31]
+    base, n = titulo, 2
+    while titulo.lower() in usados:
+        sufijo = f" ({n})"
+        titulo = base[:31 - len(sufijo)] + sufijo
+        n += 1
+    usados.add(titulo.lower())
+    return titulo
+
+
+def _iniciar_proceso():
+    # Con "spawn"/"forkserver" el proceso hijo arranca sin Django configurado
+    django.setup()
+
+
+def _escribir_hoja_fraccion(tarea):
+    """
+    Escribe la hoja de una fracción en un libro propio y devuelve
+    (fraccion_id, ruta, total). Se ejecuta en un proceso del pool.
+    """
+    tipo_usuario, parametros, fraccion_id, base_url, directorio = tarea
+    queryset = filtrar_listado(tipo_usuario, parametros).filter(fraccion_id=fraccion_id)
+
+    wb = Workbook(write_only=True)
+    _registrar_estilos(wb)
+    _, _, total, _ = escribir_hoja_listado(
+        wb, "Hoja", filas_listado(queryset),
+        lambda archivo_id: f"{base_url}/publico/archivo/{archivo_id}/",
+    )
+    with tempfile.NamedTemporaryFile(dir=directorio, suffix='.xlsx', delete=False) as parte:
+        wb.save(parte)
+    return fraccion_id, parte.name, total
+
+
+def _escribir_resumen(wb, resumen, titulos, informacion):
+    ws = wb.create_sheet(title="Resumen")
+    _fijar_estilos(ws)
+    for col, ancho in enumerate(ANCHOS_RESUMEN, 1):
+        ws.column_dimensions[get_column_letter(col)].width = ancho
+    ws.append([_celda(ws, encabezado, 'encabezado') for encabezado in ENCABEZADOS_RESUMEN])
+
+    for fila in resumen:
+        ws.append([
+            fila['fraccion__numero'],
+            fila['fraccion__nombre'],
+            fila['total'],
+            fila['vigentes'],
+            fila['total'] - fila['vigentes'],
+        ])
+
+    for _ in range(2):
+        ws.append([])
+    ws.append([_celda(ws, "INFORMACIÓN DEL REPORTE", 'titulo_reporte')])
+    for etiqueta, valor in informacion:
+        ws.append([_celda(ws, etiqueta, 'etiqueta'), str(valor)])
+
+    # Hojas vacías que se reemplazan por las generadas en el pool
+    for fila in resumen:
+        wb.create_sheet(title=titulos[fila['fraccion_id']])
+
+
+def _combinar_partes(base, partes, destino):
+    """
+    Copia el libro `base` a `destino` sustituyendo cada hoja vacía por la
+    hoja del libro parcial correspondiente ({nombre de la parte: ruta}).
+    """
+    with zipfile.ZipFile(base) as libro, zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) as salida:
+        estilos = libro.read('xl/styles.xml')
+        for info in libro.infolist():
+            ruta_parte = partes.get(info.filename)
+            if ruta_parte is None:
+                with libro.open(info) as origen, salida.open(info.filename, 'w') as copia:
+                    shutil.copyfileobj(origen, copia)
+                continue
+            with zipfile.ZipFile(ruta_parte) as parte:
+                if parte.read('xl/styles.xml') != estilos:
+                    raise ValueError(f"Los estilos de {info.filename} no coinciden con los del libro")
+                with parte.open('xl/worksheets/sheet1.xml') as origen, \
+                        salida.open(info.filename, 'w', force_zip64=True) as copia:
+                    shutil.copyfileobj(origen, copia)
+
+
+def exportar_por_fraccion_xlsx(destino, tipo_usuario, parametros, base_url, informacion,
+                               procesos=1, al_avanzar=None):
+    """
+    Genera en `destino` un libro con una hoja de resumen y una hoja por
+    fracción. Con procesos > 1 las hojas se escriben en un ProcessPoolExecutor.
+
+    `al_avanzar(procesadas)` se llama al terminar cada hoja. Devuelve el
+    total de filas exportadas.
+    """
+    resumen = list(
+        filtrar_listado(tipo_usuario, parametros)
+        .order_by('fraccion__numero')
+        .values('fraccion_id', 'fraccion__numero', 'fraccion__nombre')
+        .annotate(total=Count('id'), vigentes=Count('id', filter=Q(vigente=True)))
+    )
+    usados = {'resumen'}
+    titulos = {fila['fraccion_id']: _titulo_hoja(fila['fraccion__numero'], usados) for fila in resumen}
+    total = sum(fila['total'] for fila in resumen)
+    informacion = list(informacion)
+    informacion.insert(3, ("Total de archivos:", total))
+
+    with tempfile.TemporaryDirectory() as directorio:
+        tareas = [
+            # Diccionario simple (request.GET no se envía entre procesos)
+            (tipo_usuario, {nombre: parametros.get(nombre) for nombre in parametros},
+             fila['fraccion_id'], base_url, directorio)
+            for fila in resumen
+        ]
+        rutas = {}
+        procesadas = 0
+        if procesos > 1 and len(tareas) > 1:
+            # Los procesos hijos no deben heredar conexiones abiertas
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_proceso) as pool:
+                pendientes = [pool.submit(_escribir_hoja_fraccion, tarea) for tarea in tareas]
+                for futuro in as_completed(pendientes):
+                    fraccion_id, ruta, filas = futuro.result()
+                    rutas[fraccion_id] = ruta
+                    procesadas += filas
+                    if al_avanzar:
+                        al_avanzar(procesadas)
+        else:
+            for tarea in tareas:
+                fraccion_id, ruta, filas = _escribir_hoja_fraccion(tarea)
+                rutas[fraccion_id] = ruta
+                procesadas += filas
+                if al_avanzar:
+                    al_avanzar(procesadas)
+
+        wb = Workbook(write_only=True)
+        _registrar_estilos(wb)
+        _escribir_resumen(wb, resumen, titulos, informacion)
+        base = f"{directorio}/libro.xlsx"
+        wb.save(base)
+
+        # La hoja de resumen es sheet1.xml; las fracciones siguen en orden
+        partes = {
+            f"xl/worksheets/sheet{indice}.xml": rutas[fila['fraccion_id']]
+            for indice, fila in enumerate(resumen, 2)
+        }
+        _combinar_partes(base, partes, destino)
+    return total
+
+
+# ---------------------------------------------------------------------------
+# CSV / JSON Lines en flujo
+# ---------------------------------------------------------------------------
+
+FORMATOS_FLUJO = {
+    'csv': ('csv', 'text/csv; charset=utf-8'),
+    'jsonl': ('jsonl', 'application/x-ndjson'),
+}
+TAMAÑO_BLOQUE_FLUJO = 64 * 1024
+
+# Columnas de salida -> campo de values()
+COLUMNAS_LISTADO = [
+    ('id', 'id'),
+    ('fraccion', 'fraccion__numero'),
+    ('fraccion_nombre', 'fraccion__nombre'),
+    ('año', 'año'),
+    ('tipo_periodo', 'tipo_periodo'),
+    ('periodo_especifico', 'periodo_especifico'),
+    ('nombre_original', 'nombre_original'),
+    ('version', 'version'),
+    ('vigente', 'vigente'),
+    ('fecha_carga', 'created_at'),
+    ('enlace_publico', 'enlace_publico'),
+]
+COLUMNAS_HISTORIAL = [
+    ('id', 'id'),
+    ('fecha_acceso', 'fecha_acceso'),
+    ('archivo_id', 'archivo_id'),
+    ('fraccion', 'archivo__fraccion__numero'),
+    ('archivo', 'archivo__nombre_original'),
+    ('usuario', 'usuario__username'),
+    ('ip_address', 'ip_address'),
+    ('es_acceso_publico', 'es_acceso_publico'),
+    ('user_agent', 'user_agent'),
+]
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en lugar de guardarla"""
+
+    def write(self, valor):
+        return valor
+
+
+def _valor(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return valor
+
+
+def _lineas_csv(filas, columnas):
+    escritor = csv.writer(_Eco())
+    # BOM para que Excel reconozca UTF-8 (acentos y ñ)
+    yield '\ufeff' + escritor.writerow([nombre for nombre, _ in columnas])
+    for fila in filas:
+        yield escritor.writerow([_valor(fila[campo]) for _, campo in columnas])
+
+
+def _lineas_jsonl(filas, columnas):
+    for fila in filas:
+        yield json.dumps(
+            {nombre: _valor(fila[campo]) for nombre, campo in columnas},
+            ensure_ascii=False,
+        ) + '\n'
+
+
+def _agrupar(lineas):
+    """Junta las líneas en bloques de ~64 KB para no emitir miles de escrituras pequeñas"""
+    bloque = []
+    tamaño = 0
+    for linea in lineas:
+        datos = linea.encode('utf-8')
+        bloque.append(datos)
+        tamaño += len(datos)
+        if tamaño >= TAMAÑO_BLOQUE_FLUJO:
+            yield b''.join(bloque)
+            bloque = []
+            tamaño = 0
+    if bloque:
+        yield b''.join(bloque)
+
+
+def _gzip(bloques):
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+    for bloque in bloques:
+        comprimido = compresor.compress(bloque)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+
+def flujo_exportacion(filas, columnas, formato, comprimir=False):
+    """Bytes del archivo exportado, generados conforme se leen las filas"""
+    lineas = _lineas_csv(filas, columnas) if formato == 'csv' else _lineas_jsonl(filas, columnas)
+    bloques = _agrupar(lineas)
+    return _gzip(bloques) if comprimir else bloques
+
+
+def respuesta_flujo(filas, columnas, formato, nombre_base, comprimir=False):
+    """StreamingHttpResponse para descargar `filas` como CSV o JSONL (opcionalmente .gz)"""
+    extension, content_type = FORMATOS_FLUJO[formato]
+    nombre = f'{nombre_base}.{extension}'
+    if comprimir:
+        nombre += '.gz'
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(
+        flujo_exportacion(filas, columnas, formato, comprimir),
+        content_type=content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return response
+
+
+def con_enlace_publico(filas, enlace_publico):
+    """Agrega a cada fila del listado su URL pública"""
+    for fila in filas:
+        fila['enlace_publico'] = enlace_publico(fila['id'])
+        yield fila
+
+
+def filas_historial(queryset):
+    """Accesos en orden de id, leídos con cursor del servidor"""
+    return queryset.order_by('id').values(
+        *[campo for _, campo in COLUMNAS_HISTORIAL]
+    ).iterator(chunk_size=5000)
@@ -0,0 +1,416 @@
+"""
+Extracción del texto de los documentos para la búsqueda por contenido.
+
+El comando extraer_contenido toma los ContenidoArchivo que aún no tienen
+TextoContenido (contenidos nuevos: altas y reemplazos; un archivo idéntico
+vuelto a subir reutiliza el texto ya extraído), lee el documento y guarda el
+texto normalizado con el número de páginas u hojas. En PostgreSQL un trigger
+mantiene el tsvector de ese texto (migración 0010) y la búsqueda del listado
+lo consulta por su índice GIN, sin abrir archivos al buscar.
+
+Formatos:
+- DOCX: se recorre el XML del paquete (word/document.xml, encabezados, pies
+  y notas) con ElementTree; las páginas salen de docProps/app.xml.
+- XLSX: openpyxl en modo solo lectura, todas las hojas.
+- PDF: lector mínimo sin dependencias: descomprime los flujos FlateDecode y
+  toma las cadenas de los operadores Tj/TJ/'/". Cubre los PDF con fuentes
+  simples (WinAnsi), que es lo que generan Word y Excel; los escaneados
+  quedan como "sin texto" y los cifrados como no soportados. La
+  descompresión se hace por trozos y con un tope por documento
+  (ARCHIVOS_EXTRACCION_MAX_DESCOMPRIMIDO): un flujo pequeño que se expande
+  a gigabytes (bomba de descompresión) se corta ahí.
+- DOC y XLS (formato binario anterior) no se procesan.
+
+Como en las exportaciones, la tabla es la cola: cada contenido se reserva
+creando su TextoContenido en estado en_proceso, así que pueden correr varios
+procesos del comando a la vez.
+"""
+import logging
+import re
+import zipfile
+import zlib
+from datetime import timedelta
+from xml.etree import ElementTree
+
+import openpyxl
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import facetas
+from .models import ContenidoArchivo, TextoContenido
+
+logger = logging.getLogger(__name__)
+
+NS_WORD = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+NS_PROPIEDADES = '{http://schemas.openxmlformats.org/officeDocument/2006/extended-properties}'
+PARTES_DOCX = re.compile(r'word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$')
+
+CONTROL = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+ESPACIOS = re.compile(r'\s+')
+
+
+class FormatoNoSoportado(Exception):
+    pass
+
+
+def normalizar(texto):
+    """Sin caracteres de control, espacios colapsados y recortado al máximo configurado"""
+    texto = ESPACIOS.sub(' ', CONTROL.sub(' ', texto)).strip()
+    return texto[:settings.ARCHIVOS_EXTRACCION_MAX_CARACTERES]
+
+
+class _Acumulador:
+    """Junta fragmentos de texto hasta el máximo de caracteres configurado"""
+
+    def __init__(self):
+        self.partes = []
+        self.total = 0
+        self.maximo = settings.ARCHIVOS_EXTRACCION_MAX_CARACTERES
+
+    @property
+    def lleno(self):
+        return self.total >= self.maximo
+
+    def agregar(self, texto):
+        self.partes.append(texto)
+        self.total += len(texto)
+
+    def texto(self):
+        return normalizar(''.join(self.partes))
+
+
+# ---------------------------------------------------------------- DOCX
+
+def extraer_docx(archivo):
+    """(texto, páginas) de un DOCX; páginas es None si Word no las registró"""
+    acumulador = _Acumulador()
+    with zipfile.ZipFile(archivo) as paquete:
+        nombres = sorted(
+            (n for n in paquete.namelist() if PARTES_DOCX.match(n)),
+            key=lambda n: (n != 'word/document.xml', n),
+        )
+        for nombre in nombres:
+            with paquete.open(nombre) as xml:
+                for _, elemento in ElementTree.iterparse(xml):
+                    if elemento.tag == f'{NS_WORD}t' and elemento.text:
+                        acumulador.agregar(elemento.text)
+                    elif elemento.tag in (f'{NS_WORD}tab', f'{NS_WORD}br', f'{NS_WORD}p'):
+                        acumulador.agregar(' ')
+                        if elemento.tag == f'{NS_WORD}p':
+                            elemento.clear()
+                    if acumulador.lleno:
+                        break
+            if acumulador.lleno:
+                break
+        return acumulador.texto(), _paginas_docx(paquete)
+
+
+def _paginas_docx(paquete):
+    try:
+        with paquete.open('docProps/app.xml') as xml:
+            paginas = ElementTree.parse(xml).find(f'{NS_PROPIEDADES}Pages')
+    except (KeyError, ElementTree.ParseError):
+        return None
+    if paginas is None or not (paginas.text or '').strip().isdigit():
+        return None
+    return int(paginas.text)
+
+
+# ---------------------------------------------------------------- XLSX
+
+def extraer_xlsx(archivo):
+    """(texto, hojas) de un XLSX con los valores de todas sus celdas"""
+    acumulador = _Acumulador()
+    libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        for hoja in libro.worksheets:
+            acumulador.agregar(f'{hoja.title} ')
+            for fila in hoja.iter_rows(values_only=True):
+                for valor in fila:
+                    if valor is not None and valor != '':
+                        acumulador.agregar(f'{valor} ')
+                if acumulador.lleno:
+                    break
+            if acumulador.lleno:
+                break
+        return acumulador.texto(), len(libro.sheetnames)
+    finally:
+        libro.close()
+
+
+# ---------------------------------------------------------------- PDF
+
+INICIO_FLUJO = re.compile(rb'>>\s*stream\r?\n')
+PAGINA = re.compile(rb'/Type\s*/Page(?![A-Za-z])')
+FILTROS_ENCADENADOS = re.compile(rb'/Filter\s*\[[^\]]*/\w+\s*/\w+')
+TOKEN = re.compile(rb'/[^\s()<>\[\]{}/%]*|[^\s()<>\[\]{}/%]+|.', re.S)
+OPERADORES_TEXTO = {b'Tj', b'TJ', b"'", b'"'}
+SALTOS_TEXTO = {b'Td', b'TD', b'T*', b'ET'}
+ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+TROZO_COMPRIMIDO = 64 * 1024
+
+
+def extraer_pdf(archivo):
+    """(texto, páginas) de un PDF"""
+    datos = archivo.read()
+    if not datos.startswith(b'%PDF'):
+        raise FormatoNoSoportado('El archivo no es un PDF válido')
+    if b'/Encrypt' in datos:
+        raise FormatoNoSoportado('PDF cifrado')
+
+    acumulador = _Acumulador()
+    paginas = len(PAGINA.findall(datos))
+    for diccionario, flujo in _flujos(datos):
+        if b'/ObjStm' in diccionario:
+            # Objetos comprimidos (PDF 1.5+): ahí pueden estar las páginas
+            paginas += len(PAGINA.findall(flujo))
+        elif b'BT' in flujo and not acumulador.lleno:
+            _texto_flujo(flujo, acumulador)
+    return acumulador.texto(), paginas or None
+
+
+def _descomprimir(flujo, limite):
+    """
+    Flujo FlateDecode descomprimido, a lo sumo `limite` bytes. La entrada se
+    pasa por trozos y cada llamada lleva max_length, así que la memoria no
+    depende de la tasa de compresión.
+    """
+    descompresor = zlib.decompressobj()
+    partes = []
+    total = 0
+    vista = memoryview(flujo)
+    for inicio in range(0, len(vista), TROZO_COMPRIMIDO):
+        pendiente = vista[inicio:inicio + TROZO_COMPRIMIDO]
+        while pendiente and total < limite:
+            parte = descompresor.decompress(pendiente, limite - total)
+            partes.append(parte)
+            total += len(parte)
+            pendiente = descompresor.unconsumed_tail
+        if total >= limite or descompresor.eof:
+            break
+    return b''.join(partes)
+
+
+def _flujos(datos):
+    """
+    (diccionario, contenido descomprimido) de cada flujo del PDF, hasta
+    agotar ARCHIVOS_EXTRACCION_MAX_DESCOMPRIMIDO bytes descomprimidos.
+    """
+    presupuesto = settings.ARCHIVOS_EXTRACCION_MAX_DESCOMPRIMIDO
+    posicion = 0
+    while True:
+        coincidencia = INICIO_FLUJO.search(datos, posicion)
+        if coincidencia is None:
+            return
+        inicio = coincidencia.end()
+        fin = datos.find(b'endstream', inicio)
+        if fin == -1:
+            return
+        posicion = fin + len(b'endstream')
+        # El diccionario va entre "N 0 obj" y "stream"
+        desde = max(0, coincidencia.start() - 4096)
+        obj = datos.rfind(b'obj', desde, coincidencia.start())
+        diccionario = datos[desde if obj == -1 else obj:coincidencia.start()]
+        flujo = datos[inicio:fin]
+        if b'/Filter' in diccionario:
+            if b'/FlateDecode' not in diccionario or FILTROS_ENCADENADOS.search(diccionario):
+                # Otros filtros (imágenes DCT, LZW, cadenas de filtros): sin texto útil
+                continue
+            if presupuesto <= 0:
+                logger.warning('PDF con más de %s bytes descomprimidos: se omite el resto',
+                               settings.ARCHIVOS_EXTRACCION_MAX_DESCOMPRIMIDO)
+                return
+            try:
+                flujo = _descomprimir(flujo, presupuesto)
+            except zlib.error:
+                continue
+            presupuesto -= len(flujo)
+        yield diccionario, flujo
+
+
+def _texto_flujo(flujo, acumulador):
+    """Agrega las cadenas mostradas por los operadores de texto del flujo"""
+    operandos = []
+    for tipo, valor in _tokens(flujo):
+        if tipo == 'cadena':
+            operandos.append(valor)
+        elif tipo == 'ajuste':
+            # Desplazamiento grande dentro de TJ: separación entre palabras
+            if valor < -200:
+                operandos.append(' ')
+        elif tipo == 'operador':
+            if valor in OPERADORES_TEXTO:
+                acumulador.agregar(''.join(operandos))
+                if valor in (b"'", b'"'):
+                    acumulador.agregar(' ')
+            elif valor in SALTOS_TEXTO:
+                acumulador.agregar(' ')
+            operandos = []
+            if acumulador.lleno:
+                return
+
+
+def _tokens(flujo):
+    """Cadenas, ajustes numéricos dentro de [...] y operadores de un flujo de contenido"""
+    i = 0
+    largo = len(flujo)
+    en_arreglo = False
+    while i < largo:
+        c = flujo[i:i + 1]
+        if c in b' \t\r\n\f\x00':
+            i += 1
+        elif c == b'%':
+            fin = flujo.find(b'\n', i)
+            i = largo if fin == -1 else fin + 1
+        elif c == b'(':
+            cadena, i = _cadena_literal(flujo, i + 1)
+            yield 'cadena', _decodificar(cadena)
+        elif c == b'<' and flujo[i + 1:i + 2] != b'<':
+            fin = flujo.find(b'>', i)
+            fin = largo if fin == -1 else fin
+            hexadecimal = re.sub(rb'[^0-9A-Fa-f]', b'', flujo[i + 1:fin])
+            if len(hexadecimal) % 2:
+                hexadecimal += b'0'
+            yield 'cadena', _decodificar(bytes.fromhex(hexadecimal.decode()))
+            i = fin + 1
+        elif c == b'[':
+            en_arreglo = True
+            i += 1
+        elif c == b']':
+            en_arreglo = False
+            i += 1
+        else:
+            coincidencia = TOKEN.match(flujo, i)
+            token = coincidencia.group()
+            i = coincidencia.end()
+            if token[:1] == b'/' or token in (b'{', b'}', b'>', b'>>', b'<<'):
+                continue
+            try:
+                numero = float(token)
+            except ValueError:
+                yield 'operador', token
+                continue
+            if en_arreglo:
+                yield 'ajuste', numero
+
+
+def _cadena_literal(flujo, i):
+    """Bytes de la cadena (...) que empieza en i, con paréntesis anidados y escapes"""
+    resultado = bytearray()
+    nivel = 1
+    largo = len(flujo)
+    while i < largo:
+        c = flujo[i:i + 1]
+        if c == b'\\':
+            siguiente = flujo[i + 1:i + 2]
+            if siguiente in ESCAPES:
+                resultado += ESCAPES[siguiente]
+                i += 2
+            elif siguiente and siguiente in b'01234567':
+                octal = re.match(rb'[0-7]{1,3}', flujo[i + 1:i + 4]).group()
+                resultado.append(int(octal, 8) & 0xFF)
+                i += 1 + len(octal)
+            elif siguiente in (b'\r', b'\n'):
+                i += 2  # continuación de línea
+            else:
+                resultado += siguiente
+                i += 2
+            continue
+        if c == b'(':
+            nivel += 1
+        elif c == b')':
+            nivel -= 1
+            if nivel == 0:
+                return bytes(resultado), i + 1
+        resultado += c
+        i += 1
+    return bytes(resultado), i
+
+
+def _decodificar(cadena):
+    if cadena.startswith(b'\xfe\xff'):
+        return cadena[2:].decode('utf-16-be', errors='ignore')
+    if b'\x00' in cadena:
+        # Identificadores de glifo de dos bytes (fuentes CID): sin tabla
+        # ToUnicode no se pueden traducir a texto
+        return ''
+    return cadena.decode('cp1252', errors='ignore')
+
+
+# ---------------------------------------------------------------- Cola
+
+EXTRACTORES = {
+    '.pdf': extraer_pdf,
+    '.docx': extraer_docx,
+    '.xlsx': extraer_xlsx,
+}
+
+
+def pendientes():
+    """Contenidos en uso que aún no tienen texto extraído"""
+    return ContenidoArchivo.objects.filter(texto__isnull=True, referencias__gt=0)
+
+
+def tomar_siguiente():
+    """Reserva el contenido pendiente más antiguo y lo devuelve (o None)"""
+    with transaction.atomic():
+        contenido = (
+            pendientes().select_for_update(skip_locked=True, of=('self',))
+            .order_by('created_at')
+            .first()
+        )
+        if contenido is None:
+            return None
+        try:
+            with transaction.atomic():
+                TextoContenido.objects.create(contenido=contenido)
+        except IntegrityError:
+            # Otro proceso lo reservó entre la consulta y el alta
+            return tomar_siguiente()
+    return contenido
+
+
+def extraer(contenido):
+    """Devuelve (formato, texto, páginas) del archivo del contenido"""
+    formato = contenido.ruta.rsplit('.', 1)[-1].lower() if '.' in contenido.ruta else ''
+    extractor = EXTRACTORES.get(f'.{formato}')
+    if extractor is None:
+        raise FormatoNoSoportado(f'Formato no soportado: {formato or "sin extensión"}')
+    with default_storage.open(contenido.ruta, 'rb') as archivo:
+        try:
+            texto, paginas = extractor(archivo)
+        except zipfile.BadZipFile:
+            raise FormatoNoSoportado('El archivo no es un documento de Office válido')
+    return formato, texto, paginas
+
+
+def procesar(contenido):
+    """Extrae el texto del contenido reservado; los errores quedan en su TextoContenido"""
+    campos = {'error': '', 'texto': '', 'paginas': None, 'updated_at': timezone.now()}
+    try:
+        campos['formato'], campos['texto'], campos['paginas'] = extraer(contenido)
+        campos['estado'] = 'extraido' if campos['texto'] else 'sin_texto'
+    except FormatoNoSoportado as e:
+        campos.update(estado='no_soportado', error=str(e))
+    except Exception as e:
+        logger.exception("Falló la extracción del contenido %s", contenido.pk)
+        campos.update(estado='error', error=str(e))
+    # update(): si el contenido se eliminó mientras tanto no hay nada que guardar
+    TextoContenido.objects.filter(pk=contenido.pk).update(**campos)
+    if campos['texto']:
+        # La búsqueda por contenido puede cambiar los conteos de los filtros
+        facetas.invalidar()
+    return campos
+
+
+def reanudar_interrumpidos(minutos=30):
+    """Devuelve a la cola los contenidos reservados por un proceso que se detuvo"""
+    limite = timezone.now() - timedelta(minutes=minutos)
+    return TextoContenido.objects.filter(estado='en_proceso', updated_at__lt=limite).delete()[0]
+
+
+def reintentar_errores():
+    """Devuelve a la cola los contenidos cuya extracción falló"""
+    return TextoContenido.objects.filter(estado='error').delete()[0]
@@ -0,0 +1,164 @@
+"""
+Conteos por faceta de los filtros del listado (fracción, año, tipo de
+periodo y estado).
+
+Cada faceta cuenta con todos los filtros actuales menos el suyo, para que
+las demás opciones del mismo filtro sigan mostrando cuántos archivos
+tendrían. En PostgreSQL las cuatro facetas salen de una sola consulta con
+GROUPING SETS: una agrupación por faceta y un COUNT(*) FILTER (WHERE ...)
+con los filtros de las otras. En otros motores (SQLite) se hace una consulta
+agrupada por faceta.
+
+Los conteos se guardan en la caché de Django por tipo de usuario, filtros y
+generación de datos. La generación es un sello en la caché que cambia al
+guardar o eliminar un Archivo (signals.py) y al extraer el texto de un
+documento; con una caché compartida la invalidación es inmediata en todos
+los procesos y con LocMemCache cada proceso la ve al expirar sus entradas
+(ARCHIVOS_FACETAS_CACHE_SEGUNDOS).
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+
+from . import exportaciones
+
+# Parámetro del listado -> columna de Archivo
+FACETAS = {
+    'fraccion': 'fraccion_id',
+    'año': 'año',
+    'tipo_periodo': 'tipo_periodo',
+    'estado': 'vigente',
+}
+CLAVE_GENERACION = 'archivos:facetas:generacion'
+
+
+def generacion():
+    return cache.get_or_set(CLAVE_GENERACION, time.time_ns, timeout=None)
+
+
+def invalidar():
+    """Nueva generación de datos: los conteos guardados dejan de usarse"""
+    try:
+        cache.incr(CLAVE_GENERACION)
+    except ValueError:
+        # Sin sello (caché reiniciada): uno que no coincida con ninguno anterior
+        cache.set(CLAVE_GENERACION, time.time_ns(), timeout=None)
+
+
+def _filtros(parametros):
+    """Valores de columna de las facetas filtradas ({columna: valor})"""
+    filtros = {}
+    for nombre in ('fraccion', 'año'):
+        try:
+            filtros[FACETAS[nombre]] = int(parametros.get(nombre))
+        except (TypeError, ValueError):
+            pass
+    if parametros.get('tipo_periodo'):
+        filtros['tipo_periodo'] = parametros.get('tipo_periodo')
+    estado = parametros.get('estado') or 'vigente'
+    if estado in ('vigente', 'historico'):
+        filtros['vigente'] = estado == 'vigente'
+    return filtros
+
+
+def _base(tipo_usuario, parametros):
+    """Archivos con los filtros que no son facetas (periodo específico y búsqueda)"""
+    return exportaciones.filtrar_listado(tipo_usuario, {
+        'estado': 'todos',
+        'periodo_especifico': parametros.get('periodo_especifico'),
+        'busqueda': parametros.get('busqueda'),
+    }).order_by()
+
+
+def _conteos_grouping_sets(base, filtros):
+    columnas = list(FACETAS.values())
+    subconsulta, parametros_base = base.values(*columnas).query.sql_with_params()
+
+    # Los COUNT(*) FILTER van antes que la subconsulta en el SQL: sus
+    # parámetros también van primero
+    parametros = []
+    conteos = []
+    for columna in columnas:
+        condiciones = []
+        for otra, valor in filtros.items():
+            if otra != columna:
+                condiciones.append(f'{connection.ops.quote_name(otra)} = %s')
+                parametros.append(valor)
+        condicion = ' AND '.join(condiciones) or 'TRUE'
+        conteos.append(f'COUNT(*) FILTER (WHERE {condicion})')
+
+    nombres = ', '.join(connection.ops.quote_name(c) for c in columnas)
+    conjuntos = ', '.join(f'({connection.ops.quote_name(c)})' for c in columnas)
+    sql = (
+        f'SELECT {nombres}, GROUPING({nombres}), {", ".join(conteos)} '
+        f'FROM ({subconsulta}) AS base GROUP BY GROUPING SETS ({conjuntos})'
+    )
+
+    resultado = {columna: {} for columna in columnas}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros + list(parametros_base))
+        for fila in cursor.fetchall():
+            valores, agrupacion, totales = fila[:len(columnas)], fila[len(columnas)], fila[len(columnas) + 1:]
+            # GROUPING() pone en 0 el bit de la columna agrupada (la primera es el bit más alto)
+            for i, columna in enumerate(columnas):
+                if not agrupacion & (1 << (len(columnas) - 1 - i)):
+                    resultado[columna][valores[i]] = totales[i]
+    return resultado
+
+
+def _conteos_por_faceta(base, filtros):
+    resultado = {}
+    for columna in FACETAS.values():
+        otros = {otra: valor for otra, valor in filtros.items() if otra != columna}
+        resultado[columna] = dict(
+            base.filter(**otros).values(columna).annotate(total=Count('id')).values_list(columna, 'total')
+        )
+    return resultado
+
+
+def calcular(tipo_usuario, parametros):
+    """
+    Conteos de cada faceta para los filtros actuales:
+    {'fraccion': {id: n}, 'año': {año: n}, 'tipo_periodo': {tipo: n},
+     'estado': {'vigente': n, 'historico': n, 'todos': n}}.
+    """
+    base = _base(tipo_usuario, parametros)
+    filtros = _filtros(parametros)
+    if connection.vendor == 'postgresql':
+        por_columna = _conteos_grouping_sets(base, filtros)
+    else:
+        por_columna = _conteos_por_faceta(base, filtros)
+
+    vigentes = por_columna['vigente']
+    return {
+        'fraccion': por_columna['fraccion_id'],
+        'año': por_columna['año'],
+        'tipo_periodo': por_columna['tipo_periodo'],
+        'estado': {
+            'vigente': vigentes.get(True, 0),
+            'historico': vigentes.get(False, 0),
+            'todos': sum(vigentes.values()),
+        },
+    }
+
+
+def obtener(tipo_usuario, parametros):
+    """Conteos de calcular(), desde la caché cuando los datos no han cambiado"""
+    filtros = {
+        nombre: parametros.get(nombre) or ''
+        for nombre in ('fraccion', 'año', 'tipo_periodo', 'estado', 'periodo_especifico', 'busqueda')
+    }
+    filtros['estado'] = filtros['estado'] or 'vigente'
+    huella = hashlib.sha256(json.dumps([tipo_usuario, filtros], sort_keys=True).encode()).hexdigest()
+    clave = f'archivos:facetas:{generacion()}:{huella}'
+
+    conteos = cache.get(clave)
+    if conteos is None:
+        conteos = calcular(tipo_usuario, parametros)
+        cache.set(clave, conteos, settings.ARCHIVOS_FACETAS_CACHE_SEGUNDOS)
+    return conteos
@@ -1,7 +1,9 @@
 from django import forms
 from django.core.exceptions import ValidationError
 from datetime import datetime  # ← NUEVA IMPORTACIÓN
-from .models import Archivo, Fraccion, PerfilUsuario
+from .models import Archivo, Fraccion, PerfilUsuario, SesionCarga
+from .autorizacion import obtener as obtener_autorizacion
+from .cargas import validar_archivo_subido
 
 
 class MultipleFileInput(forms.ClearableFileInput):
@@ -81,6 +83,8 @@ class ArchivoForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
+        # Motivos de los archivos descartados por ManejadorCargaVerificada
+        self.archivos_rechazados = kwargs.pop('archivos_rechazados', [])
         super().__init__(*args, **kwargs)
         
         print(f"=== DEBUG FORMS INIT ===")
@@ -101,19 +105,20 @@ class ArchivoForm(forms.ModelForm):
         # Filtrar fracciones según el tipo de usuario
         if user:
             try:
-                perfil = user.perfilusuario
+                # Perfil y fracciones ya resueltos para la solicitud (archivos/autorizacion.py)
+                autorizacion = obtener_autorizacion(user)
+                perfil = autorizacion.perfil
+                if perfil is None:
+                    raise PerfilUsuario.DoesNotExist
                 print(f"Perfil encontrado: {perfil.tipo_usuario}")
                 
-                fracciones_disponibles = Fraccion.objects.filter(
-                    tipo_usuario_asignado=perfil.tipo_usuario,
-                    activa=True
-                )
-                print(f"Fracciones disponibles: {fracciones_disponibles.count()}")
+                fracciones_disponibles = Fraccion.objects.filter(id__in=autorizacion.fracciones_activas_ids)
+                print(f"Fracciones disponibles: {len(autorizacion.fracciones_activas_ids)}")
                 
                 self.fields['fraccion'].queryset = fracciones_disponibles
                 
                 # Si no hay fracciones, mostrar mensaje útil
-                if not fracciones_disponibles.exists():
+                if not autorizacion.fracciones_activas_ids:
                     self.fields['fraccion'].widget.attrs['disabled'] = True
                     self.fields['fraccion'].help_text = f"No hay fracciones asignadas para el tipo de usuario: {perfil.get_tipo_usuario_display()}"
                 
@@ -227,6 +232,9 @@ class ArchivoForm(forms.ModelForm):
         print(f"Datos limpios recibidos: {cleaned_data}")
 
         self._validate_required_fields(cleaned_data)
+        # Si el manejador de carga descartó algún archivo, la carga completa se detiene
+        for motivo in self.archivos_rechazados:
+            self.add_error('archivo', motivo)
         # Ya no es necesaria la validación manual de periodo_especifico
         # self._validate_periodo_especifico(cleaned_data)
         self._validate_archivo_vigente(cleaned_data)
@@ -341,14 +349,13 @@ class ArchivoZipForm(forms.Form):
         # Filtrar fracciones según el tipo de usuario
         if user:
             try:
-                perfil = user.perfilusuario
-                fracciones_disponibles = Fraccion.objects.filter(
-                    tipo_usuario_asignado=perfil.tipo_usuario,
-                    activa=True
-                )
-                self.fields['fraccion'].queryset = fracciones_disponibles
+                autorizacion = obtener_autorizacion(user)
+                perfil = autorizacion.perfil
+                if perfil is None:
+                    raise PerfilUsuario.DoesNotExist
+                self.fields['fraccion'].queryset = Fraccion.objects.filter(id__in=autorizacion.fracciones_activas_ids)
                 
-                if not fracciones_disponibles.exists():
+                if not autorizacion.fracciones_activas_ids:
                     self.fields['fraccion'].widget.attrs['disabled'] = True
                     self.fields['fraccion'].help_text = f"No hay fracciones asignadas para: {perfil.get_tipo_usuario_display()}"
                 
@@ -407,4 +414,41 @@ class ArchivoZipForm(forms.Form):
             if periodo_especifico in ['T1', 'T2', 'T3', 'T4', 'S1', 'S2', 'A', 'ANUAL']:  # ← CAMBIO
                 cleaned_data['periodo_especifico'] = periodo_especifico
         
-        return cleaned_data
\ No newline at end of file
+        return cleaned_data
+
+
+class SesionCargaForm(forms.ModelForm):
+    """Datos para iniciar una carga por bloques (un archivo por sesión)"""
+
+    class Meta:
+        model = SesionCarga
+        fields = ['fraccion', 'tipo_periodo', 'año', 'periodo_especifico', 'nombre_original', 'tamaño', 'sha256']
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+
+        # Mismas fracciones que ofrece ArchivoForm al usuario
+        if user is not None:
+            self.fields['fraccion'].queryset = Fraccion.objects.filter(
+                id__in=obtener_autorizacion(user).fracciones_activas_ids
+            )
+        else:
+            self.fields['fraccion'].queryset = Fraccion.objects.none()
+
+    def clean_año(self):
+        año = self.cleaned_data.get('año')
+        if año and (año < 2020 or año > 2030):
+            raise ValidationError('El año debe estar entre 2020 y 2030.')
+        return año
+
+    def clean(self):
+        cleaned_data = super().clean()
+        nombre = cleaned_data.get('nombre_original')
+        tamaño = cleaned_data.get('tamaño')
+        if nombre and tamaño is not None:
+            try:
+                validar_archivo_subido(nombre, tamaño)
+            except ValidationError as e:
+                self.add_error('nombre_original', e)
+        return cleaned_data
@@ -0,0 +1,253 @@
+"""
+Importación masiva de archivos históricos desde un árbol de carpetas.
+
+Estructura esperada (la usa el comando importar_archivos):
+
+    <raiz>/<fracción>/<año>/<periodo>/archivo.pdf
+    <raiz>/<fracción>/<año>/<periodo>/<versión>/archivo.pdf
+
+<fracción> es el número (I, II, XXIX...), <periodo> uno de A, T1-T4, S1-S2
+(de él sale el tipo de periodo). Los archivos de la carpeta del periodo son
+una versión; si tiene subcarpetas, cada una es una versión, en orden natural
+(v1, v2, ..., v10), y la última queda vigente.
+
+Cada versión es una unidad: sus archivos se validan y se les calcula el
+SHA-256 en un ProcessPoolExecutor (lectura completa, el trabajo caro) y
+después se publica con cargas.publicar_version, que asigna la versión con el
+contador del periodo y guarda las filas con Archivo.objects.crear_en_lote.
+Cada versión guarda la carpeta de la que salió (Archivo.origen_importacion)
+y una carpeta ya importada se omite, así que repetir la importación no
+duplica nada; el archivo de control (checkpoint) evita además volver a leer
+las versiones ya terminadas.
+
+Publicar una versión la deja vigente, así que los periodos que ya tienen
+cargas desde la web no se tocan (su versión vigente quedaría oculta por una
+histórica) salvo que el comando reciba --reemplazar.
+"""
+import hashlib
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import connections
+
+from .cargas import publicar_version, validar_archivo_subido
+from .catalogo import catalogo
+from .manejadores import verificar_contenido
+from .models import AÑO_MAXIMO, AÑO_MINIMO, Archivo
+
+PERIODOS = {
+    'A': 'anual',
+    'T1': 'trimestral', 'T2': 'trimestral', 'T3': 'trimestral', 'T4': 'trimestral',
+    'S1': 'semestral', 'S2': 'semestral',
+}
+TAMAÑO_LECTURA = 1024 * 1024
+
+
+class Unidad:
+    """Una versión a importar: carpeta, periodo y rutas de sus archivos"""
+
+    def __init__(self, relativa, fraccion, año, periodo_especifico, rutas):
+        self.relativa = relativa
+        self.fraccion = fraccion
+        self.año = año
+        self.periodo_especifico = periodo_especifico
+        self.tipo_periodo = PERIODOS[periodo_especifico]
+        self.rutas = rutas
+
+
+def _orden_natural(nombre):
+    return [int(parte) if parte.isdigit() else parte.lower() for parte in re.split(r'(\d+)', nombre)]
+
+
+def _visibles(directorio):
+    return sorted(
+        (entrada for entrada in os.scandir(directorio) if not entrada.name.startswith('.')),
+        key=lambda entrada: _orden_natural(entrada.name),
+    )
+
+
+def recorrer(raiz, al_omitir):
+    """
+    Genera las Unidad del árbol en orden (fracción, año, periodo, versión).
+    Las carpetas que no corresponden a la estructura se informan con
+    al_omitir(ruta relativa, motivo).
+    """
+    for carpeta_fraccion in _visibles(raiz):
+        if not carpeta_fraccion.is_dir():
+            continue
+        fraccion = catalogo.por_numero(carpeta_fraccion.name) or catalogo.por_numero(carpeta_fraccion.name.upper())
+        if fraccion is None:
+            al_omitir(carpeta_fraccion.name, 'la fracción no existe')
+            continue
+
+        for carpeta_año in _visibles(carpeta_fraccion.path):
+            if not carpeta_año.is_dir():
+                continue
+            relativa_año = os.path.relpath(carpeta_año.path, raiz)
+            if not carpeta_año.name.isdigit():
+                al_omitir(relativa_año, 'el año no es un número')
+                continue
+            if not AÑO_MINIMO <= int(carpeta_año.name) <= AÑO_MAXIMO:
+                # Archivo.clean lo rechazaría después de leer y calcular el hash de todo
+                al_omitir(relativa_año, f'el año debe estar entre {AÑO_MINIMO} y {AÑO_MAXIMO}')
+                continue
+
+            for carpeta_periodo in _visibles(carpeta_año.path):
+                if not carpeta_periodo.is_dir():
+                    continue
+                relativa_periodo = os.path.relpath(carpeta_periodo.path, raiz)
+                periodo = carpeta_periodo.name.upper()
+                if periodo not in PERIODOS:
+                    al_omitir(relativa_periodo, f'periodo no reconocido (use {", ".join(PERIODOS)})')
+                    continue
+
+                entradas = _visibles(carpeta_periodo.path)
+                versiones = [entrada for entrada in entradas if entrada.is_dir()]
+                sueltos = [entrada.path for entrada in entradas if entrada.is_file()]
+                if versiones and sueltos:
+                    al_omitir(relativa_periodo, f'{len(sueltos)} archivo(s) fuera de las carpetas de versión')
+                if not versiones:
+                    if sueltos:
+                        yield Unidad(relativa_periodo, fraccion, int(carpeta_año.name), periodo, sueltos)
+                    continue
+                for carpeta_version in versiones:
+                    rutas = [entrada.path for entrada in _visibles(carpeta_version.path) if entrada.is_file()]
+                    if rutas:
+                        yield Unidad(
+                            os.path.relpath(carpeta_version.path, raiz),
+                            fraccion, int(carpeta_año.name), periodo, rutas,
+                        )
+
+
+def _iniciar_proceso():
+    # Con "spawn"/"forkserver" el proceso hijo arranca sin Django configurado
+    django.setup()
+
+
+def analizar(rutas):
+    """
+    Valida y calcula el SHA-256 de los archivos de una unidad (en un proceso
+    del pool). Devuelve [(ruta, tamaño, sha256, motivo)]; motivo vacío si el
+    archivo es válido.
+    """
+    resultados = []
+    for ruta in rutas:
+        nombre = os.path.basename(ruta)
+        try:
+            tamaño = os.path.getsize(ruta)
+            validar_archivo_subido(nombre, tamaño)
+            digest = hashlib.sha256()
+            with open(ruta, 'rb') as archivo:
+                cabecera = archivo.read(16)
+                digest.update(cabecera)
+                for parte in iter(lambda: archivo.read(TAMAÑO_LECTURA), b''):
+                    digest.update(parte)
+            motivo = verificar_contenido(nombre, cabecera)
+            if motivo:
+                raise ValidationError(motivo)
+            resultados.append((ruta, tamaño, digest.hexdigest(), ''))
+        except ValidationError as e:
+            resultados.append((ruta, 0, '', '; '.join(e.messages)))
+        except OSError as e:
+            resultados.append((ruta, 0, '', f'no se pudo leer: {e}'))
+    return resultados
+
+
+def analizar_en_paralelo(unidades, procesos):
+    """
+    Genera (unidad, resultados de analizar) en el orden de `unidades`, con
+    hasta `procesos` procesos trabajando y un número acotado de unidades
+    adelantadas (la memoria no crece con el tamaño del árbol).
+    """
+    if procesos <= 1:
+        for unidad in unidades:
+            yield unidad, analizar(unidad.rutas)
+        return
+
+    # Los procesos hijos no deben heredar conexiones abiertas
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_proceso) as pool:
+        # Con "fork" los procesos nacen en el primer submit: que sea antes de
+        # que recorrer() vuelva a abrir la conexión a la base de datos
+        pool.submit(int).result()
+        en_curso = deque()
+        for unidad in unidades:
+            en_curso.append((unidad, pool.submit(analizar, unidad.rutas)))
+            if len(en_curso) >= procesos * 4:
+                unidad_lista, futuro = en_curso.popleft()
+                yield unidad_lista, futuro.result()
+        while en_curso:
+            unidad_lista, futuro = en_curso.popleft()
+            yield unidad_lista, futuro.result()
+
+
+def ya_importada(unidad):
+    """
+    True si la carpeta de la unidad ya se importó en su periodo: cada versión
+    publicada guarda su carpeta de origen (Archivo.origen_importacion), así
+    que una versión posterior con los mismos archivos sí se importa.
+    """
+    return Archivo.objects.filter(
+        fraccion=unidad.fraccion, año=unidad.año, periodo_especifico=unidad.periodo_especifico,
+        origen_importacion=unidad.relativa,
+    ).exists()
+
+
+def tiene_cargas_web(unidad):
+    """True si el periodo tiene versiones que no salieron de una importación"""
+    return Archivo.objects.filter(
+        fraccion=unidad.fraccion, año=unidad.año, periodo_especifico=unidad.periodo_especifico,
+        origen_importacion='',
+    ).exists()
+
+
+def publicar(unidad, validos, usuario):
+    """Publica los archivos válidos de la unidad como una versión nueva del periodo"""
+    archivos = []
+    try:
+        for ruta, _, sha256, _ in validos:
+            archivo = File(open(ruta, 'rb'), name=os.path.basename(ruta))
+            archivo.sha256 = sha256  # Ya calculado en analizar(): no se vuelve a leer
+            archivos.append(archivo)
+        return publicar_version(
+            unidad.fraccion, usuario, unidad.tipo_periodo, unidad.año,
+            unidad.periodo_especifico, archivos, origen_importacion=unidad.relativa,
+        )
+    finally:
+        for archivo in archivos:
+            archivo.close()
+
+
+class Checkpoint:
+    """Versiones ya terminadas (rutas relativas), guardadas en un JSON con escritura atómica"""
+
+    def __init__(self, ruta, raiz):
+        self.ruta = ruta
+        self.raiz = os.path.abspath(raiz)
+        self.completadas = set()
+        if ruta and os.path.exists(ruta):
+            with open(ruta, encoding='utf-8') as archivo:
+                datos = json.load(archivo)
+            if datos.get('raiz') != self.raiz:
+                raise ValueError(f'El checkpoint {ruta} corresponde a otra carpeta: {datos.get("raiz")}')
+            self.completadas = set(datos.get('completadas', []))
+
+    def __contains__(self, relativa):
+        return relativa in self.completadas
+
+    def marcar(self, relativa):
+        self.completadas.add(relativa)
+
+    def guardar(self):
+        if not self.ruta:
+            return
+        temporal = f'{self.ruta}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump({'raiz': self.raiz, 'completadas': sorted(self.completadas)}, archivo)
+        os.replace(temporal, self.ruta)
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from archivos.consolidacion import consolidar_accesos
+
+
+class Command(BaseCommand):
+    help = 'Consolida los accesos nuevos de HistorialAcceso en totales diarios (AccesoDiario)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--margen-minutos', type=int, default=5,
+            help='Minutos más recientes que se dejan para la siguiente ejecución (por defecto: 5)'
+        )
+        parser.add_argument(
+            '--bloque', type=int, default=50000,
+            help='Cantidad de ids de HistorialAcceso por transacción (por defecto: 50000)'
+        )
+
+    def handle(self, *args, **options):
+        resumen = consolidar_accesos(
+            margen=timedelta(minutes=options['margen_minutos']),
+            tamaño_bloque=options['bloque'],
+        )
+
+        if not resumen['bloques']:
+            self.stdout.write('ℹ️ No hay accesos nuevos para consolidar')
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ Accesos consolidados: ids {resumen['desde'] + 1} a {resumen['hasta']} "
+                f"en {resumen['bloques']} bloque(s), {resumen['filas_diarias']} fila(s) diarias actualizadas"
+            )
+        )
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from archivos.almacen import DIRECTORIO, TAMAÑO_LECTURA, ruta_contenido
+from archivos.models import Archivo, ContenidoArchivo
+
+
+def _sha256_ruta(ruta):
+    digest = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for parte in iter(lambda: archivo.read(TAMAÑO_LECTURA), b''):
+            digest.update(parte)
+    return digest.hexdigest()
+
+
+def _eliminar(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass  # Otra ejecución (o una fila con la misma ruta) ya lo eliminó
+
+
+class Command(BaseCommand):
+    help = (
+        'Migra los archivos existentes al almacén por contenido (SHA-256): '
+        'los archivos idénticos quedan como una sola copia en disco'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--simular', action='store_true',
+            help='Solo calcula cuánto espacio se recuperaría'
+        )
+        parser.add_argument(
+            '--huerfanos', action='store_true',
+            help='Elimina además los archivos de blobs/ sin registro (cargas revertidas) con más de una hora'
+        )
+
+    def handle(self, *args, **options):
+        simular = options['simular']
+        pendientes = Archivo.objects.filter(contenido__isnull=True).exclude(archivo='').order_by('pk')
+        self.stdout.write(f'🔍 Archivos sin contenido asignado: {pendientes.count()}')
+
+        migrados = duplicados = faltantes = 0
+        bytes_recuperados = 0
+        vistos = {}  # sha256 -> ruta (solo en simulación)
+
+        for archivo in pendientes.iterator(chunk_size=200):
+            ruta_actual = os.path.join(settings.MEDIA_ROOT, archivo.archivo.name)
+            if not os.path.exists(ruta_actual):
+                faltantes += 1
+                self.stdout.write(self.style.WARNING(f'⚠️ Archivo físico no encontrado: {archivo.archivo.name}'))
+                continue
+
+            sha256 = _sha256_ruta(ruta_actual)
+            tamaño = os.path.getsize(ruta_actual)
+
+            if simular:
+                if sha256 in vistos or ContenidoArchivo.objects.filter(sha256=sha256).exists():
+                    duplicados += 1
+                    bytes_recuperados += tamaño
+                vistos.setdefault(sha256, archivo.archivo.name)
+                migrados += 1
+                continue
+
+            if self._migrar(archivo, ruta_actual, sha256, tamaño):
+                duplicados += 1
+                bytes_recuperados += tamaño
+            migrados += 1
+
+        if options['huerfanos'] and not simular:
+            self._eliminar_huerfanos()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {"Simulación: " if simular else ""}{migrados} archivo(s) procesados, '
+            f'{duplicados} duplicado(s), {bytes_recuperados / 1024 / 1024:.1f} MB recuperados'
+        ))
+        if faltantes:
+            self.stdout.write(self.style.WARNING(f'⚠️ {faltantes} archivo(s) sin físico, no se migraron'))
+
+    def _migrar(self, archivo, ruta_actual, sha256, tamaño):
+        """Asigna el contenido a la fila; devuelve True si era un duplicado"""
+        with transaction.atomic():
+            contenido = ContenidoArchivo.objects.select_for_update().filter(sha256=sha256).first()
+            duplicado = contenido is not None
+            if contenido is None:
+                extension = os.path.splitext(archivo.archivo.name)[1]
+                ruta = ruta_contenido(sha256, extension)
+                destino = os.path.join(settings.MEDIA_ROOT, ruta)
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                # Un blob que ya existe (migración interrumpida) solo se reutiliza si está íntegro
+                if os.path.exists(destino) and _sha256_ruta(destino) != sha256:
+                    self.stdout.write(self.style.WARNING(f'⚠️ Blob con otro contenido, se reemplaza: {ruta}'))
+                    os.remove(destino)
+                if not os.path.exists(destino):
+                    # Enlace duro: no copia bytes y el original sigue válido si algo falla
+                    try:
+                        os.link(ruta_actual, destino)
+                    except OSError:
+                        with open(ruta_actual, 'rb') as origen:
+                            default_storage.save(ruta, origen)
+                contenido = ContenidoArchivo.objects.create(sha256=sha256, ruta=ruta, tamaño=tamaño)
+
+            ContenidoArchivo.objects.filter(pk=contenido.pk).update(referencias=contenido.referencias + 1)
+            Archivo.objects.filter(pk=archivo.pk).update(archivo=contenido.ruta, contenido=contenido)
+
+            # La ruta anterior se elimina si ninguna otra fila la usa
+            nombre_anterior = archivo.archivo.name
+            if not Archivo.objects.filter(archivo=nombre_anterior).exists():
+                transaction.on_commit(lambda: _eliminar(ruta_actual))
+
+        self.stdout.write(f'{"♻️" if duplicado else "📦"} {nombre_anterior} -> {contenido.ruta}')
+        return duplicado
+
+    def _eliminar_huerfanos(self):
+        en_uso = set(ContenidoArchivo.objects.values_list('ruta', flat=True))
+        raiz = os.path.join(settings.MEDIA_ROOT, DIRECTORIO)
+        limite = time.time() - 3600
+        eliminados = 0
+        for directorio, _, nombres in os.walk(raiz):
+            for nombre in nombres:
+                ruta = os.path.join(directorio, nombre)
+                relativa = os.path.relpath(ruta, settings.MEDIA_ROOT).replace(os.sep, '/')
+                if relativa not in en_uso and os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+                    eliminados += 1
+        self.stdout.write(f'🧹 Archivos huérfanos eliminados: {eliminados}')
+
+        # Corrige contadores que no coinciden con las filas de Archivo
+        corregidos = 0
+        for contenido in ContenidoArchivo.objects.annotate(usos=Count('archivos')):
+            if not contenido.usos:
+                default_storage.delete(contenido.ruta)
+                contenido.delete()
+                corregidos += 1
+            elif contenido.referencias != contenido.usos:
+                ContenidoArchivo.objects.filter(pk=contenido.pk).update(referencias=contenido.usos)
+                corregidos += 1
+        if corregidos:
+            self.stdout.write(self.style.WARNING(f'⚠️ Referencias corregidas: {corregidos}'))
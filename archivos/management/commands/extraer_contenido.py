@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from archivos.extraccion import pendientes, procesar, reanudar_interrumpidos, reintentar_errores, tomar_siguiente
+
+
+class Command(BaseCommand):
+    help = 'Extrae el texto de los documentos nuevos o reemplazados para la búsqueda por contenido'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help='Procesa los contenidos pendientes y termina (para cron)'
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=10.0,
+            help='Segundos de espera cuando no hay contenidos pendientes (por defecto: 10)'
+        )
+        parser.add_argument(
+            '--reintentar', action='store_true',
+            help='Vuelve a intentar los contenidos cuya extracción falló'
+        )
+
+    def handle(self, *args, **options):
+        reanudados = reanudar_interrumpidos()
+        if reanudados:
+            self.stdout.write(f'🔁 Extracciones interrumpidas devueltas a la cola: {reanudados}')
+        if options['reintentar']:
+            self.stdout.write(f'🔁 Extracciones con error devueltas a la cola: {reintentar_errores()}')
+
+        self.stdout.write(f'📄 Contenidos pendientes: {pendientes().count()}')
+        resumen = {}
+        try:
+            while True:
+                contenido = tomar_siguiente()
+                if contenido is None:
+                    if options['una_vez']:
+                        break
+                    close_old_connections()
+                    time.sleep(options['intervalo'])
+                    continue
+
+                resultado = procesar(contenido)
+                resumen[resultado['estado']] = resumen.get(resultado['estado'], 0) + 1
+                if resultado['estado'] == 'error':
+                    self.stdout.write(self.style.ERROR(f'❌ {contenido.ruta}: {resultado["error"]}'))
+                elif options['verbosity'] > 1:
+                    self.stdout.write(
+                        f'✅ {contenido.ruta}: {len(resultado["texto"])} caracteres, '
+                        f'{resultado["paginas"] or "?"} páginas/hojas ({resultado["estado"]})'
+                    )
+        except KeyboardInterrupt:
+            pass
+
+        detalle = ', '.join(f'{estado}: {total}' for estado, total in sorted(resumen.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f'🏁 Contenidos procesados: {sum(resumen.values())}' + (f' ({detalle})' if detalle else '')
+        ))
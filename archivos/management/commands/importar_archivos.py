@@ -0,0 +1,148 @@
+import os
+import time
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from archivos.importacion import (
+    Checkpoint, analizar_en_paralelo, publicar, recorrer, tiene_cargas_web, ya_importada,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa archivos históricos desde carpetas <fracción>/<año>/<periodo>/[<versión>/] '
+        '(ver archivos/importacion.py)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('raiz', help='Carpeta raíz con una subcarpeta por fracción')
+        parser.add_argument(
+            '--usuario', required=True,
+            help='Usuario al que se atribuyen las cargas importadas'
+        )
+        parser.add_argument(
+            '--procesos', type=int, default=os.cpu_count() or 1,
+            help='Procesos que validan y calculan el SHA-256 (por defecto: uno por CPU)'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Archivo de control para reanudar (por defecto: importacion-<carpeta>.json en el directorio actual)'
+        )
+        parser.add_argument(
+            '--cada', type=int, default=50,
+            help='Versiones importadas entre escrituras del checkpoint (por defecto: 50)'
+        )
+        parser.add_argument(
+            '--reporte', type=float, default=15.0,
+            help='Segundos entre reportes de avance (por defecto: 15)'
+        )
+        parser.add_argument(
+            '--reemplazar', action='store_true',
+            help='Importa también en periodos con cargas desde la web; la versión importada queda vigente'
+        )
+        parser.add_argument(
+            '--simular', action='store_true',
+            help='Solo recorre, valida y calcula los SHA-256, sin guardar nada'
+        )
+
+    def handle(self, *args, **options):
+        raiz = options['raiz']
+        if not os.path.isdir(raiz):
+            raise CommandError(f'No existe la carpeta {raiz}')
+        try:
+            usuario = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f'No existe el usuario {options["usuario"]}')
+
+        ruta_checkpoint = None
+        if not options['simular']:
+            ruta_checkpoint = options['checkpoint'] or f'importacion-{os.path.basename(os.path.abspath(raiz))}.json'
+        try:
+            checkpoint = Checkpoint(ruta_checkpoint, raiz)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if checkpoint.completadas:
+            self.stdout.write(f'🔁 Reanudando: {len(checkpoint.completadas)} versión(es) ya terminadas en {ruta_checkpoint}')
+
+        self.totales = dict.fromkeys(
+            ['versiones', 'omitidas', 'vacias', 'con_cargas', 'archivos', 'bytes', 'rechazados', 'errores'], 0
+        )
+        self.inicio = time.monotonic()
+        ultimo_reporte = self.inicio
+        sin_guardar = 0
+
+        def al_omitir(relativa, motivo):
+            self.stdout.write(self.style.WARNING(f'⚠️ {relativa}: {motivo}'))
+
+        unidades = (
+            unidad for unidad in recorrer(raiz, al_omitir)
+            if unidad.relativa not in checkpoint
+        )
+        try:
+            for unidad, resultados in analizar_en_paralelo(unidades, options['procesos']):
+                validos = [resultado for resultado in resultados if not resultado[3]]
+                for ruta, _, _, motivo in resultados:
+                    if motivo:
+                        self.totales['rechazados'] += 1
+                        self.stdout.write(self.style.WARNING(f'⚠️ {os.path.relpath(ruta, raiz)}: {motivo}'))
+
+                if options['simular']:
+                    self._contar(validos)
+                elif not validos:
+                    self.totales['vacias'] += 1
+                elif ya_importada(unidad):
+                    self.totales['omitidas'] += 1
+                elif not options['reemplazar'] and tiene_cargas_web(unidad):
+                    # Sin marcar en el checkpoint: se importa al repetir con --reemplazar
+                    self.totales['con_cargas'] += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'⚠️ {unidad.relativa}: el periodo ya tiene cargas desde la web (use --reemplazar)'
+                    ))
+                    continue
+                else:
+                    try:
+                        version, _ = publicar(unidad, validos, usuario)
+                        self._contar(validos)
+                        if options['verbosity'] > 1:
+                            self.stdout.write(f'✅ {unidad.relativa}: v{version}, {len(validos)} archivo(s)')
+                    except ValidationError as e:
+                        self.totales['errores'] += 1
+                        self.stdout.write(self.style.ERROR(f'❌ {unidad.relativa}: {"; ".join(e.messages)}'))
+                        continue
+
+                checkpoint.marcar(unidad.relativa)
+                sin_guardar += 1
+                if sin_guardar >= options['cada']:
+                    checkpoint.guardar()
+                    sin_guardar = 0
+                if time.monotonic() - ultimo_reporte >= options['reporte']:
+                    self.stdout.write(self._avance())
+                    ultimo_reporte = time.monotonic()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('⏸️ Importación interrumpida; se reanuda con el mismo comando'))
+        finally:
+            checkpoint.guardar()
+
+        self.stdout.write(self.style.SUCCESS(f'🏁 {self._avance()}'))
+        self.stdout.write(
+            f'   Versiones omitidas por estar ya importadas: {self.totales["omitidas"]}, '
+            f'sin archivos válidos: {self.totales["vacias"]}, '
+            f'en periodos con cargas desde la web: {self.totales["con_cargas"]}, '
+            f'archivos rechazados: {self.totales["rechazados"]}, versiones con error: {self.totales["errores"]}'
+        )
+
+    def _contar(self, validos):
+        self.totales['versiones'] += 1
+        self.totales['archivos'] += len(validos)
+        self.totales['bytes'] += sum(tamaño for _, tamaño, _, _ in validos)
+
+    def _avance(self):
+        segundos = max(time.monotonic() - self.inicio, 0.001)
+        megabytes = self.totales['bytes'] / 1024 / 1024
+        return (
+            f'📊 {self.totales["versiones"]} versión(es), {self.totales["archivos"]} archivo(s), '
+            f'{megabytes:.1f} MB en {segundos:.0f} s '
+            f'({self.totales["archivos"] / segundos:.1f} archivos/s, {megabytes / segundos:.1f} MB/s)'
+        )
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from archivos.almacen import limpiar_preparacion
+from archivos.cargas import limpiar_cargas_vencidas
+
+
+class Command(BaseCommand):
+    help = 'Cancela las cargas por bloques abandonadas y elimina sus bloques y los archivos en preparación que quedaron de cargas interrumpidas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--horas', type=int, default=settings.ARCHIVOS_CARGA_VIGENCIA_HORAS,
+            help='Horas sin recibir bloques para considerar una carga abandonada'
+        )
+
+    def handle(self, *args, **options):
+        preparados = limpiar_preparacion(options['horas'])
+        if preparados:
+            self.stdout.write(f'🧹 Archivos en preparación eliminados: {preparados}')
+
+        total = limpiar_cargas_vencidas(options['horas'])
+        if not total:
+            self.stdout.write('ℹ️ No hay cargas abandonadas')
+            return
+        self.stdout.write(self.style.SUCCESS(f'🧹 Cargas canceladas: {total}'))
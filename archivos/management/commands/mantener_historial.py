@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from archivos import particiones
+
+
+class Command(BaseCommand):
+    help = (
+        'Mantenimiento de HistorialAcceso: particiones mensuales (PostgreSQL), '
+        'retención y archivo comprimido de los meses vencidos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convertir', action='store_true',
+            help='Convierte la tabla actual en tabla particionada por mes (una sola vez, solo PostgreSQL)'
+        )
+        parser.add_argument(
+            '--meses-adelante', type=int, default=3,
+            help='Particiones a crear por adelantado (por defecto: 3); los meses con registros '
+                 'en la partición DEFAULT reciben la suya y los registros se mueven a ella'
+        )
+        parser.add_argument(
+            '--retencion-meses', type=int, default=settings.ARCHIVOS_HISTORIAL_RETENCION_MESES,
+            help='Meses completos que se conservan en la base de datos'
+        )
+        parser.add_argument(
+            '--destino', default=settings.ARCHIVOS_HISTORIAL_RESPALDOS,
+            help='Directorio donde se guardan los meses archivados'
+        )
+        parser.add_argument(
+            '--formato', choices=['jsonl', 'csv'], default='jsonl',
+            help='Formato de los archivos comprimidos (por defecto: jsonl)'
+        )
+        parser.add_argument(
+            '--simular', action='store_true',
+            help='Solo muestra los meses que se archivarían'
+        )
+        parser.add_argument(
+            '--restaurar', metavar='ARCHIVO',
+            help='Vuelve a cargar un mes archivado (.jsonl.gz o .csv.gz)'
+        )
+
+    def handle(self, *args, **options):
+        if options['restaurar']:
+            restaurados, omitidos = particiones.restaurar_exportacion(options['restaurar'])
+            self.stdout.write(self.style.SUCCESS(f'✅ Registros restaurados: {restaurados}'))
+            if omitidos:
+                self.stdout.write(self.style.WARNING(f'⚠️ Omitidos (archivo eliminado): {omitidos}'))
+            return
+
+        if options['convertir']:
+            if not particiones.es_postgresql():
+                raise CommandError('El particionado solo está disponible en PostgreSQL.')
+            if particiones.esta_particionada():
+                self.stdout.write('ℹ️ La tabla ya está particionada')
+            else:
+                self.stdout.write('🔄 Convirtiendo HistorialAcceso a tabla particionada...')
+                particiones.convertir_a_particionada(meses_adelante=options['meses_adelante'])
+                self.stdout.write(self.style.SUCCESS('✅ Tabla particionada por mes'))
+
+        if particiones.esta_particionada():
+            creadas = particiones.asegurar_particiones(meses_adelante=options['meses_adelante'])
+            for año, mes, movidos in creadas:
+                self.stdout.write(f'📁 Partición creada: {año}-{mes:02d}')
+                if movidos:
+                    self.stdout.write(f'   {movidos} registros movidos desde la partición DEFAULT')
+
+        if options['retencion_meses'] <= 0:
+            return
+
+        if options['simular']:
+            vencidos = particiones.meses_vencidos(options['retencion_meses'])
+            if not vencidos:
+                self.stdout.write('ℹ️ No hay meses fuera de la ventana de retención')
+            for año, mes in vencidos:
+                self.stdout.write(f'🗄️ Se archivaría: {año}-{mes:02d}')
+            return
+
+        resultados = particiones.aplicar_retencion(
+            options['retencion_meses'], options['destino'], options['formato']
+        )
+        for resultado in resultados:
+            año, mes = resultado['mes']
+            if resultado['estado'] == 'archivado':
+                self.stdout.write(self.style.SUCCESS(
+                    f"🗄️ {año}-{mes:02d}: {resultado['filas']} registros archivados en {resultado['ruta']}"
+                ))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f'⚠️ {año}-{mes:02d}: hay accesos sin consolidar, no se eliminó'
+                ))
+        if not resultados:
+            self.stdout.write('ℹ️ No hay meses fuera de la ventana de retención')
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from archivos.trabajos import depurar_vencidos, procesar_trabajo, reanudar_interrumpidos, tomar_siguiente
+
+
+class Command(BaseCommand):
+    help = 'Procesa las exportaciones en segundo plano (worker local, sin broker externo)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help='Procesa los trabajos pendientes y termina (para cron)'
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=2.0,
+            help='Segundos de espera cuando no hay trabajos pendientes (por defecto: 2)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('👷 Worker de exportaciones iniciado')
+        procesados = 0
+        ultima_depuracion = 0
+        try:
+            while True:
+                if time.monotonic() - ultima_depuracion > 300:
+                    # También los de otros workers que se detuvieron (sin latido)
+                    reanudados = reanudar_interrumpidos()
+                    if reanudados:
+                        self.stdout.write(f'🔁 Trabajos interrumpidos devueltos a la cola: {reanudados}')
+                    vencidos = depurar_vencidos()
+                    if vencidos:
+                        self.stdout.write(f'🧹 Exportaciones vencidas eliminadas: {vencidos}')
+                    ultima_depuracion = time.monotonic()
+
+                trabajo = tomar_siguiente()
+                if trabajo is None:
+                    if options['una_vez']:
+                        break
+                    close_old_connections()
+                    time.sleep(options['intervalo'])
+                    continue
+
+                trabajo = procesar_trabajo(trabajo)
+                procesados += 1
+                if trabajo.estado == 'completado':
+                    self.stdout.write(self.style.SUCCESS(f'✅ {trabajo.nombre_archivo}: {trabajo.total} filas'))
+                else:
+                    self.stdout.write(self.style.ERROR(f'❌ Exportación {trabajo.pk}: {trabajo.error}'))
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'🏁 Exportaciones procesadas: {procesados}'))
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from archivos.verificacion import pendientes, reiniciar, verificar_lote
+
+
+class Command(BaseCommand):
+    help = 'Verifica en disco los archivos almacenados (existencia, tamaño, SHA-256 y tipo)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help='Verifica los contenidos pendientes y termina (para cron)'
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=60.0,
+            help='Segundos de espera cuando no hay contenidos pendientes (por defecto: 60)'
+        )
+        parser.add_argument(
+            '--lote', type=int, default=200,
+            help='Contenidos verificados por lote (por defecto: 200)'
+        )
+        parser.add_argument(
+            '--reintentar', action='store_true',
+            help='Vuelve a verificar los contenidos que fallaron'
+        )
+        parser.add_argument(
+            '--todos', action='store_true',
+            help='Vuelve a verificar todos los contenidos'
+        )
+
+    def handle(self, *args, **options):
+        if options['todos'] or options['reintentar']:
+            reiniciados = reiniciar(solo_fallidos=not options['todos'])
+            self.stdout.write(f'🔁 Contenidos devueltos a la cola: {reiniciados}')
+
+        self.stdout.write(f'🔍 Contenidos pendientes: {pendientes().count()}')
+        integros = 0
+        fallidos = 0
+        try:
+            while True:
+                resultados = verificar_lote(options['lote'])
+                if not resultados:
+                    if options['una_vez']:
+                        break
+                    close_old_connections()
+                    time.sleep(options['intervalo'])
+                    continue
+
+                for contenido, motivo in resultados:
+                    if motivo:
+                        fallidos += 1
+                        self.stdout.write(self.style.ERROR(f'❌ {contenido.ruta}: {motivo}'))
+                    else:
+                        integros += 1
+        except KeyboardInterrupt:
+            pass
+
+        resumen = f'🏁 Contenidos verificados: {integros + fallidos} (íntegros: {integros}, con error: {fallidos})'
+        if fallidos:
+            self.stdout.write(self.style.WARNING(resumen))
+        else:
+            self.stdout.write(self.style.SUCCESS(resumen))
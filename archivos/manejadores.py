@@ -0,0 +1,107 @@
+"""
+Manejador de carga que verifica los archivos mientras se reciben.
+
+Sustituye a MemoryFileUploadHandler/TemporaryFileUploadHandler: cada bloque
+se escribe directo al archivo temporal y en la misma pasada se calcula el
+SHA-256, se cuenta el tamaño y se identifica el tipo real por sus primeros
+bytes. Un archivo con extensión no permitida, contenido que no corresponde
+a su extensión o que supera el límite se descarta en cuanto se detecta: no
+se sigue escribiendo a disco y el motivo queda en request.archivos_rechazados
+para que la vista lo muestre.
+"""
+import hashlib
+import logging
+import os
+
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+
+logger = logging.getLogger(__name__)
+
+TAMAÑO_MAXIMO = 104857600  # 100 MB
+EXTENSIONES_PERMITIDAS = ['.pdf', '.doc', '.docx', '.xls', '.xlsx']
+
+# Firmas (magic bytes) de los formatos aceptados
+FIRMAS = [
+    (b'%PDF-', 'pdf'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole2'),  # DOC / XLS (Office 97-2003)
+    (b'PK\x03\x04', 'ooxml'),  # DOCX / XLSX (contenedor zip)
+]
+TIPO_POR_EXTENSION = {
+    '.pdf': 'pdf',
+    '.doc': 'ole2',
+    '.xls': 'ole2',
+    '.docx': 'ooxml',
+    '.xlsx': 'ooxml',
+}
+
+
+def detectar_tipo(cabecera):
+    """Tipo real del archivo según sus primeros bytes, o None si no se reconoce"""
+    for firma, tipo in FIRMAS:
+        if cabecera.startswith(firma):
+            return tipo
+    return None
+
+
+def verificar_contenido(nombre, cabecera):
+    """Devuelve el motivo de rechazo si el contenido no corresponde a la extensión"""
+    esperado = TIPO_POR_EXTENSION.get(os.path.splitext(nombre)[1].lower())
+    if esperado is None:
+        return f'Archivo "{nombre}" tiene formato no permitido'
+    if detectar_tipo(cabecera) != esperado:
+        return f'El contenido de "{nombre}" no corresponde a un archivo {os.path.splitext(nombre)[1].upper()[1:]}'
+    return None
+
+
+def archivos_rechazados(request):
+    """Motivos de los archivos descartados por ManejadorCargaVerificada"""
+    return getattr(request, 'archivos_rechazados', [])
+
+
+class ManejadorCargaVerificada(TemporaryFileUploadHandler):
+    """Escribe a disco, calcula SHA-256 y valida tipo y tamaño en una sola pasada"""
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        self.nombre = file_name
+        self.digest = hashlib.sha256()
+        self.tipo = None
+        # El temporal se crea antes de validar: al rechazar, el parser cierra
+        # handler.file y no debe ser el archivo anterior ya completado
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if not any(file_name.lower().endswith(ext) for ext in EXTENSIONES_PERMITIDAS):
+            self._rechazar(f'Archivo "{file_name}" tiene formato no permitido')
+        if content_length and content_length > TAMAÑO_MAXIMO:
+            self._rechazar(f'Archivo "{file_name}" muy grande: {content_length/1024/1024:.1f} MB')
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0:
+            motivo = verificar_contenido(self.nombre, raw_data)
+            if motivo:
+                self._rechazar(motivo)
+            self.tipo = detectar_tipo(raw_data)
+        if start + len(raw_data) > TAMAÑO_MAXIMO:
+            self._rechazar(f'Archivo "{self.nombre}" supera el límite de {TAMAÑO_MAXIMO // (1024 * 1024)} MB')
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if file_size == 0:
+            self.file.close()
+            self._registrar(f'Archivo "{self.nombre}" está vacío')
+            return None
+        archivo = super().file_complete(file_size)
+        archivo.sha256 = self.digest.hexdigest()
+        archivo.tipo_detectado = self.tipo
+        return archivo
+
+    def _registrar(self, motivo):
+        logger.info("Carga rechazada: %s", motivo)
+        if not hasattr(self.request, 'archivos_rechazados'):
+            self.request.archivos_rechazados = []
+        self.request.archivos_rechazados.append(motivo)
+
+    def _rechazar(self, motivo):
+        # SkipFile: el parser cierra (y borra) el temporal y descarta el
+        # resto de este archivo sin escribirlo; los demás campos continúan
+        self._registrar(motivo)
+        raise SkipFile(motivo)
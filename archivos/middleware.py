@@ -1,8 +1,25 @@
 from django.http import FileResponse, Http404
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 import os
 import mimetypes
 
+from .autorizacion import obtener as obtener_autorizacion
+
+
+class AutorizacionMiddleware:
+    """
+    request.autorizacion: perfil y fracciones permitidas del usuario
+    (archivos/autorizacion.py). Se resuelve al primer uso, una vez por
+    solicitud; las páginas públicas no lo pagan.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.autorizacion = SimpleLazyObject(lambda: obtener_autorizacion(request.user))
+        return self.get_response(request)
+
 class StaticFilesMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
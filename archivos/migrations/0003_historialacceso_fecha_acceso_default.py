@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0002_archivo_editada_alter_archivo_archivo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historialacceso',
+            name='fecha_acceso',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Fecha de Acceso'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0003_historialacceso_fecha_acceso_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaConsolidacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True, verbose_name='Nombre')),
+                ('ultimo_id', models.BigIntegerField(default=0, verbose_name='Último ID procesado')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Última Ejecución')),
+            ],
+            options={
+                'verbose_name': 'Marca de Consolidación',
+                'verbose_name_plural': 'Marcas de Consolidación',
+            },
+        ),
+        migrations.CreateModel(
+            name='AccesoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('es_acceso_publico', models.BooleanField(default=False, verbose_name='Acceso Público')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Total de Accesos')),
+                ('archivo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='archivos.archivo', verbose_name='Archivo')),
+            ],
+            options={
+                'verbose_name': 'Acceso Diario',
+                'verbose_name_plural': 'Accesos Diarios',
+                'ordering': ['-fecha'],
+                'indexes': [models.Index(fields=['fecha'], name='archivos_ac_fecha_cd483b_idx')],
+                'constraints': [models.UniqueConstraint(fields=('archivo', 'fecha', 'es_acceso_publico'), name='acceso_diario_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:43
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0004_accesodiario_marcaconsolidacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SesionCarga',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('tipo_periodo', models.CharField(choices=[('anual', 'Anual'), ('trimestral', 'Trimestral'), ('semestral', 'Semestral')], max_length=15, verbose_name='Tipo de Periodo')),
+                ('año', models.IntegerField(verbose_name='Año')),
+                ('periodo_especifico', models.CharField(max_length=20, verbose_name='Periodo Específico')),
+                ('nombre_original', models.CharField(max_length=255, verbose_name='Nombre Original')),
+                ('tamaño', models.BigIntegerField(verbose_name='Tamaño (bytes)')),
+                ('tamaño_bloque', models.PositiveIntegerField(verbose_name='Tamaño de Bloque (bytes)')),
+                ('sha256', models.CharField(blank=True, max_length=64, verbose_name='SHA-256 del archivo completo')),
+                ('estado', models.CharField(choices=[('activa', 'Activa'), ('completada', 'Completada'), ('cancelada', 'Cancelada')], default='activa', max_length=15, verbose_name='Estado')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('archivo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='archivos.archivo', verbose_name='Archivo generado')),
+                ('fraccion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='archivos.fraccion', verbose_name='Fracción')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Sesión de Carga',
+                'verbose_name_plural': 'Sesiones de Carga',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['estado', 'updated_at'], name='archivos_se_estado_674a15_idx')],
+            },
+        ),
+    ]
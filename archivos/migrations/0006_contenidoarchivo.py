@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0005_sesioncarga'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContenidoArchivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('ruta', models.CharField(max_length=500, verbose_name='Ruta en MEDIA_ROOT')),
+                ('tamaño', models.BigIntegerField(verbose_name='Tamaño (bytes)')),
+                ('referencias', models.PositiveIntegerField(default=0, verbose_name='Referencias')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Contenido de Archivo',
+                'verbose_name_plural': 'Contenidos de Archivo',
+            },
+        ),
+        migrations.AddField(
+            model_name='archivo',
+            name='contenido',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='archivos', to='archivos.contenidoarchivo', verbose_name='Contenido'),
+        ),
+    ]
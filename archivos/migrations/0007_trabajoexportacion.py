@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:56
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0006_contenidoarchivo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoExportacion',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('parametros', models.JSONField(default=dict, verbose_name='Filtros del listado')),
+                ('base_url', models.CharField(max_length=200, verbose_name='URL base de los enlaces públicos')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completado', 'Completado'), ('error', 'Error'), ('vencido', 'Vencido')], default='pendiente', max_length=15, verbose_name='Estado')),
+                ('procesadas', models.PositiveIntegerField(default=0, verbose_name='Filas procesadas')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Filas totales')),
+                ('ruta', models.CharField(blank=True, max_length=500, verbose_name='Archivo generado')),
+                ('nombre_archivo', models.CharField(blank=True, max_length=255, verbose_name='Nombre de descarga')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('expira_at', models.DateTimeField(blank=True, null=True, verbose_name='Disponible hasta')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Trabajo de Exportación',
+                'verbose_name_plural': 'Trabajos de Exportación',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['estado', 'created_at'], name='archivos_tr_estado_034256_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0007_trabajoexportacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='archivo',
+            name='archivos_ar_created_ce3ec6_idx',
+        ),
+        migrations.AddIndex(
+            model_name='archivo',
+            index=models.Index(fields=['created_at', 'id'], name='archivos_ar_created_a6ae93_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivo',
+            index=models.Index(fields=['fraccion', 'created_at', 'id'], name='archivos_ar_fraccio_478220_idx'),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:04
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension, UnaccentExtension
+from django.db import migrations
+
+# Solo PostgreSQL: configuración de texto en español sin acentos, trigger que
+# mantiene archivos_archivo.vector_busqueda e índices GIN (tsvector y trigramas)
+SQL_BUSQUEDA = """
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'spanish_unaccent') THEN
+        CREATE TEXT SEARCH CONFIGURATION spanish_unaccent (COPY = spanish);
+        ALTER TEXT SEARCH CONFIGURATION spanish_unaccent
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+    END IF;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION archivos_archivo_vector_busqueda() RETURNS trigger AS $$
+BEGIN
+    NEW.vector_busqueda :=
+        setweight(to_tsvector('spanish_unaccent', coalesce(NEW.nombre_original, '')), 'A') ||
+        setweight(to_tsvector('spanish_unaccent', coalesce(
+            (SELECT numero || ' ' || nombre FROM archivos_fraccion WHERE id = NEW.fraccion_id), ''
+        )), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS archivos_archivo_vector_busqueda ON archivos_archivo;
+CREATE TRIGGER archivos_archivo_vector_busqueda
+    BEFORE INSERT OR UPDATE OF nombre_original, fraccion_id ON archivos_archivo
+    FOR EACH ROW EXECUTE FUNCTION archivos_archivo_vector_busqueda();
+
+-- Renombrar una fracción recalcula el vector de sus archivos
+CREATE OR REPLACE FUNCTION archivos_fraccion_vector_busqueda() RETURNS trigger AS $$
+BEGIN
+    UPDATE archivos_archivo SET nombre_original = nombre_original WHERE fraccion_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS archivos_fraccion_vector_busqueda ON archivos_fraccion;
+CREATE TRIGGER archivos_fraccion_vector_busqueda
+    AFTER UPDATE OF numero, nombre ON archivos_fraccion
+    FOR EACH ROW
+    WHEN (OLD.numero IS DISTINCT FROM NEW.numero OR OLD.nombre IS DISTINCT FROM NEW.nombre)
+    EXECUTE FUNCTION archivos_fraccion_vector_busqueda();
+
+UPDATE archivos_archivo SET nombre_original = nombre_original;
+
+CREATE INDEX IF NOT EXISTS archivos_archivo_vector_busqueda_gin
+    ON archivos_archivo USING gin (vector_busqueda);
+CREATE INDEX IF NOT EXISTS archivos_archivo_nombre_trgm
+    ON archivos_archivo USING gin (nombre_original gin_trgm_ops);
+"""
+
+SQL_QUITAR_BUSQUEDA = """
+DROP INDEX IF EXISTS archivos_archivo_nombre_trgm;
+DROP INDEX IF EXISTS archivos_archivo_vector_busqueda_gin;
+DROP TRIGGER IF EXISTS archivos_fraccion_vector_busqueda ON archivos_fraccion;
+DROP FUNCTION IF EXISTS archivos_fraccion_vector_busqueda();
+DROP TRIGGER IF EXISTS archivos_archivo_vector_busqueda ON archivos_archivo;
+DROP FUNCTION IF EXISTS archivos_archivo_vector_busqueda();
+DROP TEXT SEARCH CONFIGURATION IF EXISTS spanish_unaccent;
+"""
+
+
+def crear_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SQL_BUSQUEDA)
+
+
+def quitar_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SQL_QUITAR_BUSQUEDA)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0008_indices_paginacion_cursor'),
+    ]
+
+    operations = [
+        # CreateExtension no hace nada fuera de PostgreSQL
+        UnaccentExtension(),
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='archivo',
+            name='vector_busqueda',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(crear_busqueda, quitar_busqueda),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:07
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Solo PostgreSQL: trigger que mantiene archivos_textocontenido.vector con la
+# configuración spanish_unaccent (migración 0009) e índice GIN para la búsqueda
+SQL_BUSQUEDA_CONTENIDO = """
+CREATE OR REPLACE FUNCTION archivos_textocontenido_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.vector := to_tsvector('spanish_unaccent', coalesce(NEW.texto, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS archivos_textocontenido_vector ON archivos_textocontenido;
+CREATE TRIGGER archivos_textocontenido_vector
+    BEFORE INSERT OR UPDATE OF texto ON archivos_textocontenido
+    FOR EACH ROW EXECUTE FUNCTION archivos_textocontenido_vector();
+
+CREATE INDEX IF NOT EXISTS archivos_textocontenido_vector_gin
+    ON archivos_textocontenido USING gin (vector);
+"""
+
+SQL_QUITAR_BUSQUEDA_CONTENIDO = """
+DROP INDEX IF EXISTS archivos_textocontenido_vector_gin;
+DROP TRIGGER IF EXISTS archivos_textocontenido_vector ON archivos_textocontenido;
+DROP FUNCTION IF EXISTS archivos_textocontenido_vector();
+"""
+
+
+def crear_busqueda_contenido(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SQL_BUSQUEDA_CONTENIDO)
+
+
+def quitar_busqueda_contenido(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SQL_QUITAR_BUSQUEDA_CONTENIDO)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0009_busqueda_texto_completo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TextoContenido',
+            fields=[
+                ('contenido', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='texto', serialize=False, to='archivos.contenidoarchivo', verbose_name='Contenido')),
+                ('estado', models.CharField(choices=[('en_proceso', 'En proceso'), ('extraido', 'Extraído'), ('sin_texto', 'Sin texto'), ('no_soportado', 'Formato no soportado'), ('error', 'Error')], default='en_proceso', max_length=15, verbose_name='Estado')),
+                ('formato', models.CharField(blank=True, max_length=10, verbose_name='Formato')),
+                ('texto', models.TextField(blank=True, verbose_name='Texto normalizado')),
+                ('paginas', models.PositiveIntegerField(blank=True, null=True, verbose_name='Páginas u hojas')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('vector', django.contrib.postgres.search.SearchVectorField(editable=False, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Texto de Contenido',
+                'verbose_name_plural': 'Textos de Contenido',
+                'indexes': [models.Index(fields=['estado', 'updated_at'], name='archivos_te_estado_6733f8_idx')],
+            },
+        ),
+        migrations.RunPython(crear_busqueda_contenido, quitar_busqueda_contenido),
+    ]
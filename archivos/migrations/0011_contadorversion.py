@@ -0,0 +1,89 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:15
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+# Solo PostgreSQL: una sola versión vigente por periodo. Varias filas vigentes
+# del mismo periodo son válidas si comparten versión (una versión agrupa
+# varios archivos), por eso es una exclusión y no un índice único.
+SQL_VERSION_VIGENTE = """
+ALTER TABLE archivos_archivo ADD CONSTRAINT archivo_una_version_vigente
+    EXCLUDE USING gist (fraccion_id WITH =, "año" WITH =, periodo_especifico WITH =, version WITH <>)
+    WHERE (vigente);
+"""
+
+SQL_QUITAR_VERSION_VIGENTE = """
+ALTER TABLE archivos_archivo DROP CONSTRAINT IF EXISTS archivo_una_version_vigente;
+"""
+
+
+def inicializar_contadores(apps, schema_editor):
+    Archivo = apps.get_model('archivos', 'Archivo')
+    ContadorVersion = apps.get_model('archivos', 'ContadorVersion')
+    periodo = ('fraccion_id', 'año', 'periodo_especifico')
+
+    # Cargas simultáneas anteriores pudieron dejar dos versiones vigentes:
+    # se conserva la más reciente
+    duplicados = (
+        Archivo.objects.filter(vigente=True).values(*periodo)
+        .annotate(versiones=Count('version', distinct=True), maxima=Max('version'))
+        .filter(versiones__gt=1).order_by()
+    )
+    for fila in duplicados:
+        Archivo.objects.filter(
+            fraccion_id=fila['fraccion_id'], año=fila['año'],
+            periodo_especifico=fila['periodo_especifico'],
+            vigente=True, version__lt=fila['maxima'],
+        ).update(vigente=False)
+
+    ContadorVersion.objects.bulk_create(
+        [
+            ContadorVersion(
+                fraccion_id=fila['fraccion_id'], año=fila['año'],
+                periodo_especifico=fila['periodo_especifico'], ultima_version=fila['maxima'],
+            )
+            for fila in Archivo.objects.values(*periodo).annotate(maxima=Max('version')).order_by()
+        ],
+        batch_size=1000,
+    )
+
+
+def crear_restriccion(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SQL_VERSION_VIGENTE)
+
+
+def quitar_restriccion(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SQL_QUITAR_VERSION_VIGENTE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0010_textocontenido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('año', models.IntegerField(verbose_name='Año')),
+                ('periodo_especifico', models.CharField(max_length=20, verbose_name='Periodo Específico')),
+                ('ultima_version', models.PositiveIntegerField(default=0, verbose_name='Última Versión')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Última Publicación')),
+                ('fraccion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='archivos.fraccion', verbose_name='Fracción')),
+            ],
+            options={
+                'verbose_name': 'Contador de Versiones',
+                'verbose_name_plural': 'Contadores de Versiones',
+                'constraints': [models.UniqueConstraint(fields=('fraccion', 'año', 'periodo_especifico'), name='contador_version_unico')],
+            },
+        ),
+        migrations.RunPython(inicializar_contadores, migrations.RunPython.noop),
+        BtreeGistExtension(),
+        migrations.RunPython(crear_restriccion, quitar_restriccion),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0011_contadorversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contenidoarchivo',
+            name='error_verificacion',
+            field=models.TextField(blank=True, verbose_name='Error de Verificación'),
+        ),
+        migrations.AddField(
+            model_name='contenidoarchivo',
+            name='integro',
+            field=models.BooleanField(null=True, verbose_name='Íntegro'),
+        ),
+        migrations.AddField(
+            model_name='contenidoarchivo',
+            name='verificado_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Verificado'),
+        ),
+        migrations.AddIndex(
+            model_name='contenidoarchivo',
+            index=models.Index(fields=['verificado_at'], name='archivos_co_verific_83d1f7_idx'),
+        ),
+    ]
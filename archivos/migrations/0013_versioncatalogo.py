@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0012_verificacion_contenido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True, verbose_name='Catálogo')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Versión')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Último Cambio')),
+            ],
+            options={
+                'verbose_name': 'Versión de Catálogo',
+                'verbose_name_plural': 'Versiones de Catálogos',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0013_versioncatalogo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sesioncarga',
+            name='estado',
+            field=models.CharField(choices=[('activa', 'Activa'), ('completando', 'Completando'), ('completada', 'Completada'), ('cancelada', 'Cancelada')], default='activa', max_length=15, verbose_name='Estado'),
+        ),
+    ]
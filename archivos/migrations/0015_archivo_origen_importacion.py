@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0014_sesioncarga_completando'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivo',
+            name='origen_importacion',
+            field=models.CharField(blank=True, editable=False, help_text='Carpeta de la que se importó la versión (vacío si se subió desde la web)', max_length=500, verbose_name='Origen de importación'),
+        ),
+    ]
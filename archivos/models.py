@@ -1,9 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import FileExtensionValidator
 from django.db import transaction
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 import os
+import uuid
 
 # Choices para tipos de usuario
 TIPO_USUARIO_CHOICES = [
@@ -19,6 +22,10 @@ TIPO_PERIODO_CHOICES = [
     ('semestral', 'Semestral'),  # ← CAMBIO: era 'bimestral'
 ]
 
+# Años aceptados en Archivo.clean (y en la importación de carpetas)
+AÑO_MINIMO = 2020
+AÑO_MAXIMO = 2030
+
 class PerfilUsuario(models.Model):
     """Extensión del modelo User para agregar tipo de usuario"""
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -78,6 +85,136 @@ def archivo_upload_path(instance, filename):
     print(f"📁 Ruta generada para archivo: {path}")
     return path
 
+class ContenidoArchivo(models.Model):
+    """
+    Contenido físico de un archivo, identificado por su SHA-256.
+
+    Varias filas de Archivo (por ejemplo, la misma normativa cargada cada
+    trimestre) comparten un solo archivo en disco. `referencias` cuenta las
+    filas de Archivo que lo usan; al llegar a cero se elimina el archivo.
+    """
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name='SHA-256')
+    ruta = models.CharField(max_length=500, verbose_name='Ruta en MEDIA_ROOT')
+    tamaño = models.BigIntegerField(verbose_name='Tamaño (bytes)')
+    referencias = models.PositiveIntegerField(default=0, verbose_name='Referencias')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Integridad en disco, la comprueba el comando verificar_archivos (verificacion.py)
+    verificado_at = models.DateTimeField(null=True, blank=True, verbose_name='Verificado')
+    integro = models.BooleanField(null=True, verbose_name='Íntegro')
+    error_verificacion = models.TextField(blank=True, verbose_name='Error de Verificación')
+
+    class Meta:
+        verbose_name = 'Contenido de Archivo'
+        verbose_name_plural = 'Contenidos de Archivo'
+        indexes = [
+            models.Index(fields=['verificado_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.referencias} ref.)"
+
+class TextoContenido(models.Model):
+    """
+    Texto extraído de un ContenidoArchivo (PDF, DOCX o XLSX) por el comando
+    extraer_contenido, para buscar dentro de los documentos sin abrirlos al
+    consultar. Al ir ligado al contenido y no al Archivo, cada documento
+    distinto se procesa una sola vez: solo los contenidos nuevos (altas y
+    reemplazos) quedan pendientes. Ver archivos/extraccion.py.
+    """
+    ESTADO_CHOICES = [
+        ('en_proceso', 'En proceso'),
+        ('extraido', 'Extraído'),
+        ('sin_texto', 'Sin texto'),
+        ('no_soportado', 'Formato no soportado'),
+        ('error', 'Error'),
+    ]
+
+    contenido = models.OneToOneField(
+        ContenidoArchivo,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='texto',
+        verbose_name='Contenido'
+    )
+    estado = models.CharField(max_length=15, choices=ESTADO_CHOICES, default='en_proceso', verbose_name='Estado')
+    formato = models.CharField(max_length=10, blank=True, verbose_name='Formato')
+    texto = models.TextField(blank=True, verbose_name='Texto normalizado')
+    paginas = models.PositiveIntegerField(null=True, blank=True, verbose_name='Páginas u hojas')
+    error = models.TextField(blank=True, verbose_name='Error')
+
+    # Búsqueda (PostgreSQL): lo mantiene un trigger, ver archivos/busqueda.py
+    vector = SearchVectorField(null=True, editable=False)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Texto de Contenido'
+        verbose_name_plural = 'Textos de Contenido'
+        indexes = [
+            models.Index(fields=['estado', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.contenido_id} ({self.get_estado_display()})"
+
+class ArchivoQuerySet(models.QuerySet):
+    """Alta en lote de archivos ya almacenados (cargas múltiples, importaciones)"""
+
+    def crear_en_lote(self, archivos, batch_size=500):
+        """
+        Inserta `archivos` (instancias sin guardar) con bulk_create.
+
+        A diferencia de Archivo.save(), no hay full_clean() por fila: los
+        campos y clean() se validan en memoria, las FK se comprueban con una
+        consulta por modelo para todo el lote y no se toca el disco. Los
+        archivos deben estar ya en el almacén por contenido (`contenido` y
+        `archivo` con su ruta); la integridad de cada archivo en disco la
+        comprueba después el comando verificar_archivos.
+        Lanza ValidationError con un mensaje por archivo inválido.
+        """
+        archivos = list(archivos)
+        if not archivos:
+            return []
+
+        relaciones = [campo for campo in self.model._meta.concrete_fields if campo.is_relation]
+        excluir = [campo.name for campo in relaciones]
+        errores = []
+        for archivo in archivos:
+            if archivo.archivo and not archivo.archivo._committed:
+                raise ValueError('crear_en_lote requiere archivos ya almacenados (ver almacen.py)')
+            if not archivo.nombre_original:
+                archivo.nombre_original = archivo.archivo.name
+            if archivo.contenido_id and not archivo.tamaño:
+                archivo.tamaño = archivo.contenido.tamaño
+            try:
+                archivo.clean_fields(exclude=excluir)
+                archivo.clean()
+            except ValidationError as e:
+                errores.append(f"{archivo.nombre_original}: {'; '.join(e.messages)}")
+
+        # FK resueltas una vez por modelo, no una consulta por fila
+        for campo in relaciones:
+            valores = {getattr(archivo, campo.attname) for archivo in archivos}
+            if None in valores and not campo.null:
+                errores.append(f'{campo.verbose_name}: este campo es obligatorio')
+            ids = valores - {None}
+            existentes = set(
+                campo.related_model._base_manager.using(self.db)
+                .filter(pk__in=ids).values_list('pk', flat=True)
+            )
+            for faltante in ids - existentes:
+                errores.append(f'{campo.verbose_name} {faltante} no existe')
+        if errores:
+            raise ValidationError(errores)
+
+        creados = self.bulk_create(archivos, batch_size=batch_size)
+        # bulk_create no envía post_save: las facetas se invalidan aquí (signals.py)
+        from . import facetas
+        transaction.on_commit(facetas.invalidar)
+        return creados
+
+
 class Archivo(models.Model):
     """Modelo principal para archivos del Artículo 65"""
     fraccion = models.ForeignKey(Fraccion, on_delete=models.CASCADE, verbose_name='Fracción')
@@ -104,15 +241,36 @@ class Archivo(models.Model):
     )
     nombre_original = models.CharField(max_length=255, verbose_name='Nombre Original', blank=True)
     tamaño = models.BigIntegerField(verbose_name='Tamaño (bytes)', default=0)
+    contenido = models.ForeignKey(
+        ContenidoArchivo,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='archivos',
+        verbose_name='Contenido'
+    )
     
     # Control de versiones
     vigente = models.BooleanField(default=True, verbose_name='Vigente')
     version = models.IntegerField(default=1, verbose_name='Versión')
     editada = models.BooleanField(default=False, verbose_name='Editada')
+    origen_importacion = models.CharField(
+        max_length=500,
+        blank=True,
+        editable=False,
+        verbose_name='Origen de importación',
+        help_text='Carpeta de la que se importó la versión (vacío si se subió desde la web)'
+    )
+
+    # Búsqueda (PostgreSQL): lo mantiene un trigger, ver archivos/busqueda.py
+    vector_busqueda = SearchVectorField(null=True, editable=False)
 
     # Metadatos
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Carga')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Última Modificación')
+
+    objects = ArchivoQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Archivo'
@@ -122,7 +280,9 @@ class Archivo(models.Model):
         indexes = [
             models.Index(fields=['fraccion', 'año', 'periodo_especifico']),
             models.Index(fields=['vigente']),
-            models.Index(fields=['created_at']),
+            # Paginación por cursor (created_at, id): listado e historial por fracción
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['fraccion', 'created_at', 'id']),
     ]
    
     
@@ -134,11 +294,12 @@ class Archivo(models.Model):
         super().clean()
         
         # Validar que el año sea razonable
-        if self.año and (self.año < 2020 or self.año > 2030):
-            raise ValidationError({'año': 'El año debe estar entre 2020 y 2030'})
+        if self.año and (self.año < AÑO_MINIMO or self.año > AÑO_MAXIMO):
+            raise ValidationError({'año': f'El año debe estar entre {AÑO_MINIMO} y {AÑO_MAXIMO}'})
         
-        # Validar archivo si existe
-        if self.archivo and hasattr(self.archivo, 'size'):
+        # Validar archivo recién subido (uno ya guardado o preparado por
+        # cargas.py puede no estar aún en su ruta definitiva)
+        if self.archivo and not getattr(self.archivo, '_committed', True):
             # Verificar tamaño
             if self.archivo.size > 104857600:  # 100 MB
                 raise ValidationError({'archivo': 'El archivo no puede superar los 100 MB'})
@@ -160,16 +321,34 @@ class Archivo(models.Model):
         if self.archivo:
             if not self.nombre_original:
                 self.nombre_original = self.archivo.name
-            self.tamaño = self.archivo.size
+            if self.archivo._committed and self.contenido_id:
+                # El tamaño del contenido: no depende de que el archivo ya
+                # esté en disco (se promueve al confirmar la transacción)
+                self.tamaño = self.contenido.tamaño
+            else:
+                self.tamaño = self.archivo.size
             print(f"Nombre original: {self.nombre_original}")
             print(f"Tamaño: {self.tamaño} bytes")
 
+        # Archivo recién subido: se guarda en el almacén por contenido (SHA-256)
+        contenido_nuevo = bool(self.archivo) and not self.archivo._committed
+        contenido_anterior_id = self.contenido_id
+
         try:
             self.full_clean()  # Validaciones antes de guardar
-            super().save(*args, **kwargs)
+            with transaction.atomic():
+                if contenido_nuevo:
+                    from .almacen import registrar_contenido
+                    self.contenido = registrar_contenido(self.archivo.file)
+                    self.archivo = self.contenido.ruta
+                super().save(*args, **kwargs)
+                if contenido_nuevo and contenido_anterior_id:
+                    # Reemplazo: el contenido anterior pierde esta referencia
+                    from .almacen import liberar_contenido
+                    liberar_contenido(contenido_anterior_id)
             print(f"✅ Archivo guardado exitosamente con ID: {self.pk}")
             
-            if self.archivo:
+            if contenido_nuevo:
                 archivo_path = self.archivo.path
                 if os.path.exists(archivo_path):
                     print(f"Archivo físico encontrado en: {archivo_path}")
@@ -223,6 +402,54 @@ class Archivo(models.Model):
         return f"v{self.version}"
 
 
+class ContadorVersion(models.Model):
+    """
+    Última versión publicada de un periodo (fracción, año, periodo específico).
+
+    publicar_version bloquea esta fila (select_for_update) para asignar la
+    siguiente versión: las cargas simultáneas del mismo periodo se ordenan
+    y ninguna recorre el historial para calcularla. En PostgreSQL una
+    restricción de exclusión sobre Archivo garantiza además una sola
+    versión vigente por periodo (migración 0011).
+    """
+    fraccion = models.ForeignKey(Fraccion, on_delete=models.CASCADE, verbose_name='Fracción')
+    año = models.IntegerField(verbose_name='Año')
+    periodo_especifico = models.CharField(max_length=20, verbose_name='Periodo Específico')
+    ultima_version = models.PositiveIntegerField(default=0, verbose_name='Última Versión')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Última Publicación')
+
+    class Meta:
+        verbose_name = 'Contador de Versiones'
+        verbose_name_plural = 'Contadores de Versiones'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['fraccion', 'año', 'periodo_especifico'],
+                name='contador_version_unico',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.fraccion_id} - {self.año}-{self.periodo_especifico}: v{self.ultima_version}"
+
+
+class VersionCatalogo(models.Model):
+    """
+    Versión de un catálogo en memoria (catalogo.py). Vive en la base de datos
+    para que todos los procesos vean el cambio aunque la caché de Django sea
+    local a cada uno (LocMemCache).
+    """
+    nombre = models.CharField(max_length=50, unique=True, verbose_name='Catálogo')
+    version = models.PositiveBigIntegerField(default=0, verbose_name='Versión')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Último Cambio')
+
+    class Meta:
+        verbose_name = 'Versión de Catálogo'
+        verbose_name_plural = 'Versiones de Catálogos'
+
+    def __str__(self):
+        return f"{self.nombre}: v{self.version}"
+
+
 # ✅ REEMPLAZAR LA CLASE HistorialAcceso EN archivos/models.py
 
 class HistorialAcceso(models.Model):
@@ -235,7 +462,9 @@ class HistorialAcceso(models.Model):
         null=True,  # ✅ PERMITIR NULL para accesos anónimos
         blank=True
     )
-    fecha_acceso = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Acceso')
+    # default en lugar de auto_now_add: la bitácora asíncrona conserva la hora
+    # real del acceso aunque el registro se inserte después por lotes
+    fecha_acceso = models.DateTimeField(default=timezone.now, verbose_name='Fecha de Acceso')
     ip_address = models.GenericIPAddressField(verbose_name='IP Address', null=True, blank=True)
     es_acceso_publico = models.BooleanField(default=False, verbose_name='Acceso Público')  # ✅ NUEVO CAMPO
     user_agent = models.TextField(blank=True, verbose_name='User Agent')  # ✅ NUEVO CAMPO
@@ -259,4 +488,185 @@ class HistorialAcceso(models.Model):
         """Obtiene el display del usuario de forma segura"""
         if self.usuario:
             return self.usuario.get_full_name() or self.usuario.username
-        return "Usuario Anónimo"
\ No newline at end of file
+        return "Usuario Anónimo"
+
+class AccesoDiarioQuerySet(models.QuerySet):
+    """Consultas de analítica sobre los accesos consolidados"""
+
+    def entre(self, desde=None, hasta=None):
+        queryset = self
+        if desde:
+            queryset = queryset.filter(fecha__gte=desde)
+        if hasta:
+            queryset = queryset.filter(fecha__lte=hasta)
+        return queryset
+
+    def mas_consultados(self, desde=None, hasta=None, limite=10):
+        """Archivos con más accesos en el periodo, separando públicos y privados"""
+        return self.entre(desde, hasta).values(
+            'archivo_id',
+            'archivo__nombre_original',
+            'archivo__fraccion__numero',
+            'archivo__año',
+            'archivo__periodo_especifico',
+        ).annotate(
+            accesos=models.Sum('total'),
+            publicos=models.Sum('total', filter=models.Q(es_acceso_publico=True)),
+        ).order_by('-accesos')[:limite]
+
+    def por_dia(self, desde=None, hasta=None):
+        """Total de accesos por día"""
+        return self.entre(desde, hasta).values('fecha').annotate(
+            accesos=models.Sum('total'),
+            publicos=models.Sum('total', filter=models.Q(es_acceso_publico=True)),
+        ).order_by('fecha')
+
+    def por_fraccion(self, desde=None, hasta=None):
+        """Total de accesos por fracción"""
+        return self.entre(desde, hasta).values(
+            'archivo__fraccion__numero', 'archivo__fraccion__nombre'
+        ).annotate(
+            accesos=models.Sum('total'),
+        ).order_by('-accesos')
+
+
+class AccesoDiario(models.Model):
+    """Accesos consolidados por archivo, día y tipo de acceso"""
+    archivo = models.ForeignKey(Archivo, on_delete=models.CASCADE, verbose_name='Archivo')
+    fecha = models.DateField(verbose_name='Fecha')
+    es_acceso_publico = models.BooleanField(default=False, verbose_name='Acceso Público')
+    total = models.PositiveIntegerField(default=0, verbose_name='Total de Accesos')
+
+    objects = AccesoDiarioQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Acceso Diario'
+        verbose_name_plural = 'Accesos Diarios'
+        ordering = ['-fecha']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['archivo', 'fecha', 'es_acceso_publico'],
+                name='acceso_diario_unico',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['fecha']),
+        ]
+
+    def __str__(self):
+        tipo_acceso = "Público" if self.es_acceso_publico else "Privado"
+        return f"{self.archivo} - {self.fecha} ({tipo_acceso}): {self.total}"
+
+
+class MarcaConsolidacion(models.Model):
+    """Último registro procesado por un proceso de consolidación incremental"""
+    nombre = models.CharField(max_length=50, unique=True, verbose_name='Nombre')
+    ultimo_id = models.BigIntegerField(default=0, verbose_name='Último ID procesado')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Última Ejecución')
+
+    class Meta:
+        verbose_name = 'Marca de Consolidación'
+        verbose_name_plural = 'Marcas de Consolidación'
+
+    def __str__(self):
+        return f"{self.nombre}: {self.ultimo_id}"
+
+
+class SesionCarga(models.Model):
+    """Carga por bloques (reanudable) de un archivo grande"""
+    ESTADO_CHOICES = [
+        ('activa', 'Activa'),
+        ('completando', 'Completando'),
+        ('completada', 'Completada'),
+        ('cancelada', 'Cancelada'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Usuario')
+    fraccion = models.ForeignKey(Fraccion, on_delete=models.CASCADE, verbose_name='Fracción')
+    tipo_periodo = models.CharField(max_length=15, choices=TIPO_PERIODO_CHOICES, verbose_name='Tipo de Periodo')
+    año = models.IntegerField(verbose_name='Año')
+    periodo_especifico = models.CharField(max_length=20, verbose_name='Periodo Específico')
+
+    nombre_original = models.CharField(max_length=255, verbose_name='Nombre Original')
+    tamaño = models.BigIntegerField(verbose_name='Tamaño (bytes)')
+    tamaño_bloque = models.PositiveIntegerField(verbose_name='Tamaño de Bloque (bytes)')
+    sha256 = models.CharField(max_length=64, blank=True, verbose_name='SHA-256 del archivo completo')
+
+    estado = models.CharField(max_length=15, choices=ESTADO_CHOICES, default='activa', verbose_name='Estado')
+    archivo = models.ForeignKey(
+        Archivo, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Archivo generado'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Sesión de Carga'
+        verbose_name_plural = 'Sesiones de Carga'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['estado', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre_original} ({self.get_estado_display()})"
+
+    @property
+    def total_bloques(self):
+        return max(1, -(-self.tamaño // self.tamaño_bloque))
+
+    def tamaño_esperado(self, indice):
+        """Bytes que debe tener el bloque indicado (el último puede ser menor)"""
+        if indice == self.total_bloques - 1:
+            return self.tamaño - indice * self.tamaño_bloque
+        return self.tamaño_bloque
+
+
+class TrabajoExportacion(models.Model):
+    """Exportación del listado generada en segundo plano por procesar_exportaciones"""
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En proceso'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+        ('vencido', 'Vencido'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Usuario')
+    parametros = models.JSONField(default=dict, verbose_name='Filtros del listado')
+    base_url = models.CharField(max_length=200, verbose_name='URL base de los enlaces públicos')
+
+    estado = models.CharField(max_length=15, choices=ESTADO_CHOICES, default='pendiente', verbose_name='Estado')
+    procesadas = models.PositiveIntegerField(default=0, verbose_name='Filas procesadas')
+    total = models.PositiveIntegerField(default=0, verbose_name='Filas totales')
+    ruta = models.CharField(max_length=500, blank=True, verbose_name='Archivo generado')
+    nombre_archivo = models.CharField(max_length=255, blank=True, verbose_name='Nombre de descarga')
+    error = models.TextField(blank=True, verbose_name='Error')
+    expira_at = models.DateTimeField(null=True, blank=True, verbose_name='Disponible hasta')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Trabajo de Exportación'
+        verbose_name_plural = 'Trabajos de Exportación'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['estado', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre_archivo or self.pk} ({self.get_estado_display()})"
+
+    @property
+    def porcentaje(self):
+        if self.estado == 'completado':
+            return 100
+        if not self.total:
+            return 0
+        return min(99, self.procesadas * 100 // self.total)
+
+    @property
+    def disponible(self):
+        return self.estado == 'completado' and (self.expira_at is None or self.expira_at > timezone.now())
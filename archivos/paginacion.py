@@ -0,0 +1,157 @@
+"""
+Paginación por cursor (keyset) sobre (created_at, id), o sobre (rango, id)
+cuando el listado se ordena por relevancia de la búsqueda.
+
+En lugar de OFFSET + COUNT(*), cada página se pide a partir del último (o
+primer) registro de la anterior: WHERE (created_at, id) < (c, i) ORDER BY
+created_at DESC, id DESC LIMIT n. Con el índice correspondiente el costo de
+una página no depende de qué tan profunda sea. El cursor viaja en la URL
+como token opaco y firmado (?despues=... / ?antes=...) junto con los
+filtros; un token alterado se ignora y se muestra la primera página.
+
+El total es opcional (?total=1) y aproximado en PostgreSQL: se toma la
+estimación del planificador en lugar de contar las filas.
+"""
+import json
+from datetime import datetime
+
+from django.core import signing
+from django.db import connection
+from django.db.models import Q
+
+TAMAÑO_PAGINA = 20
+SAL_CURSOR = 'archivos.paginacion.cursor'
+
+
+def codificar_cursor(objeto, campo='created_at'):
+    valor = getattr(objeto, campo)
+    # Prefijo de tipo: d = fecha (created_at), f = número (rango de búsqueda)
+    if isinstance(valor, datetime):
+        valor = f"d{valor.isoformat()}"
+    else:
+        valor = f"f{float(valor)!r}"
+    return signing.dumps(f"{valor}|{objeto.pk}", salt=SAL_CURSOR)
+
+
+def decodificar_cursor(token):
+    """(valor, id) del token o None si es inválido o no tiene una firma válida"""
+    try:
+        valor, pk = signing.loads(token, salt=SAL_CURSOR).split('|')
+        if valor[:1] == 'd':
+            return datetime.fromisoformat(valor[1:]), int(pk)
+        if valor[:1] == 'f':
+            return float(valor[1:]), int(pk)
+    except (signing.BadSignature, ValueError, AttributeError):
+        pass
+    return None
+
+
+class PaginaCursor:
+    """Página de resultados con los tokens de la siguiente y la anterior"""
+
+    def __init__(self, objetos, siguiente=None, anterior=None, es_primera=True):
+        self.object_list = objetos
+        self.siguiente = siguiente
+        self.anterior = anterior
+        self.es_primera = es_primera
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.siguiente is not None
+
+    def has_previous(self):
+        return self.anterior is not None
+
+
+def paginar(queryset, despues=None, antes=None, tamaño=TAMAÑO_PAGINA, campo='created_at'):
+    """
+    Página de `queryset` en orden (-campo, -id).
+
+    `campo` es created_at o una anotación numérica (el rango de la
+    búsqueda). `despues`/`antes` son tokens de cursor; se pide una fila
+    extra para saber si hay más sin contar.
+    """
+    cursor_despues = decodificar_cursor(despues) if despues else None
+    cursor_antes = decodificar_cursor(antes) if antes and not cursor_despues else None
+
+    if cursor_antes:
+        valor, pk = cursor_antes
+        filas = list(
+            queryset.filter(Q(**{f'{campo}__gt': valor}) | Q(**{campo: valor, 'pk__gt': pk}))
+            .order_by(campo, 'id')[:tamaño + 1]
+        )
+        hay_mas = len(filas) > tamaño
+        objetos = filas[:tamaño][::-1]
+        return PaginaCursor(
+            objetos,
+            siguiente=codificar_cursor(objetos[-1], campo) if objetos else None,
+            anterior=codificar_cursor(objetos[0], campo) if hay_mas else None,
+            es_primera=not hay_mas,
+        )
+
+    if cursor_despues:
+        valor, pk = cursor_despues
+        queryset = queryset.filter(Q(**{f'{campo}__lt': valor}) | Q(**{campo: valor, 'pk__lt': pk}))
+    filas = list(queryset.order_by(f'-{campo}', '-id')[:tamaño + 1])
+    objetos = filas[:tamaño]
+    return PaginaCursor(
+        objetos,
+        siguiente=codificar_cursor(objetos[-1], campo) if len(filas) > tamaño else None,
+        anterior=codificar_cursor(objetos[0], campo) if cursor_despues and objetos else None,
+        es_primera=cursor_despues is None,
+    )
+
+
+def conteo_aproximado(queryset):
+    """
+    Total de filas del queryset: estimación del planificador en PostgreSQL
+    (no recorre la tabla), conteo exacto en otros motores.
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class PaginacionCursorMixin:
+    """
+    Sustituye la paginación de ListView por paginación por cursor.
+
+    El contexto conserva object_list/page_obj/is_paginated; page_obj es una
+    PaginaCursor y `total_aproximado` solo se calcula con ?total=1.
+    """
+    tamaño_pagina = TAMAÑO_PAGINA
+    campo_cursor = 'created_at'
+
+    def get_campo_cursor(self):
+        return self.campo_cursor
+
+    def paginate_queryset(self, queryset, page_size):
+        pagina = paginar(
+            queryset,
+            despues=self.request.GET.get('despues'),
+            antes=self.request.GET.get('antes'),
+            tamaño=self.tamaño_pagina,
+            campo=self.get_campo_cursor(),
+        )
+        return None, pagina, pagina.object_list, pagina.has_next() or pagina.has_previous()
+
+    def get_paginate_by(self, queryset):
+        # Cualquier valor verdadero para que ListView llame a paginate_queryset
+        return self.tamaño_pagina
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.request.GET.get('total') == '1':
+            context['total_aproximado'] = conteo_aproximado(self.object_list)
+        # Filtros actuales sin el cursor, para armar los enlaces de página
+        parametros = self.request.GET.copy()
+        for nombre in ('despues', 'antes', 'parcial'):
+            parametros.pop(nombre, None)
+        context['parametros_filtro'] = parametros.urlencode()
+        return context
@@ -0,0 +1,400 @@
+"""
+Particionado mensual, retención y archivo comprimido de HistorialAcceso.
+
+En PostgreSQL la tabla se convierte (una sola vez) en una tabla particionada
+por rango de fecha_acceso con una partición por mes (UTC). El mantenimiento
+periódico crea las particiones de los meses siguientes y, para los meses que
+salen de la ventana de retención, exporta los registros a JSONL/CSV
+comprimido con gzip y elimina la partición completa (sin DELETE masivo ni
+VACUUM posterior).
+
+Los registros sin partición de su mes caen en la partición DEFAULT (por
+ejemplo, si el mantenimiento dejó de correr varios meses). PostgreSQL no
+permite crear la partición de un mes que ya tiene filas en DEFAULT, así que
+crear_particion() las saca antes: bloquea DEFAULT contra inserciones, mueve
+las filas del mes a una tabla temporal, crea la partición y las vuelve a
+insertar, todo en una transacción. El mantenimiento crea además las
+particiones con meses de anticipación (--meses-adelante) y la de cada mes
+que encuentre en DEFAULT, así que ese caso es la excepción.
+
+En otros motores (SQLite en desarrollo) no hay particiones: la retención
+exporta y borra los registros del mes.
+"""
+import csv
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from .consolidacion import MARCA_HISTORIAL, consolidar_accesos
+from .models import Archivo, HistorialAcceso, MarcaConsolidacion
+
+TABLA = HistorialAcceso._meta.db_table
+TABLA_PREVIA = f'{TABLA}_previa'
+TABLA_DEFAULT = f'{TABLA}_default'
+TABLA_MOVIDAS = f'{TABLA}_movidas'
+# Nombre distinto a la secuencia de identidad de la tabla original
+SECUENCIA = f'{TABLA}_id_part_seq'
+PARTICION_RE = re.compile(rf'^{TABLA}_p(\d{{4}})_(\d{{2}})$')
+
+CAMPOS_EXPORTACION = [
+    'id', 'archivo_id', 'usuario_id', 'fecha_acceso',
+    'ip_address', 'es_acceso_publico', 'user_agent',
+]
+
+
+def _inicio_mes(año, mes):
+    return datetime(año, mes, 1, tzinfo=dt_timezone.utc)
+
+
+def _sumar_meses(año, mes, meses):
+    indice = año * 12 + (mes - 1) + meses
+    return indice // 12, indice % 12 + 1
+
+
+def nombre_particion(año, mes):
+    return f'{TABLA}_p{año:04d}_{mes:02d}'
+
+
+def es_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+def esta_particionada():
+    if not es_postgresql():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [TABLA])
+        fila = cursor.fetchone()
+    return bool(fila) and fila[0] == 'p'
+
+
+def particiones_existentes():
+    """Meses (año, mes) con partición propia, ordenados."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT hija.relname
+            FROM pg_inherits
+            JOIN pg_class hija ON hija.oid = pg_inherits.inhrelid
+            JOIN pg_class padre ON padre.oid = pg_inherits.inhparent
+            WHERE padre.relname = %s
+            """,
+            [TABLA],
+        )
+        nombres = [fila[0] for fila in cursor.fetchall()]
+    meses = []
+    for nombre in nombres:
+        match = PARTICION_RE.match(nombre)
+        if match:
+            meses.append((int(match.group(1)), int(match.group(2))))
+    return sorted(meses)
+
+
+def _existe_default(cursor):
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [connection.ops.quote_name(TABLA_DEFAULT)])
+    return cursor.fetchone()[0]
+
+
+def meses_en_default(cursor):
+    """Meses (año, mes) con registros en la partición DEFAULT."""
+    if not _existe_default(cursor):
+        return []
+    cursor.execute(
+        f"SELECT DISTINCT date_trunc('month', fecha_acceso AT TIME ZONE 'UTC') "
+        f"FROM {connection.ops.quote_name(TABLA_DEFAULT)}"
+    )
+    return sorted((fecha.year, fecha.month) for (fecha,) in cursor.fetchall())
+
+
+def crear_particion(cursor, año, mes):
+    """
+    Crea la partición del mes si no existe. Si el mes ya tiene registros en
+    DEFAULT los mueve a la partición nueva. Devuelve los registros movidos.
+    """
+    q = connection.ops.quote_name
+    rango = [_inicio_mes(año, mes), _inicio_mes(*_sumar_meses(año, mes, 1))]
+    movidas = 0
+    with transaction.atomic():
+        if _existe_default(cursor):
+            # Sin inserciones nuevas en DEFAULT hasta crear la partición
+            cursor.execute(f'LOCK TABLE {q(TABLA_DEFAULT)} IN SHARE ROW EXCLUSIVE MODE')
+            cursor.execute(
+                f'SELECT EXISTS (SELECT 1 FROM {q(TABLA_DEFAULT)} '
+                f'WHERE fecha_acceso >= %s AND fecha_acceso < %s)',
+                rango,
+            )
+            if cursor.fetchone()[0]:
+                cursor.execute(f'CREATE TEMPORARY TABLE {q(TABLA_MOVIDAS)} (LIKE {q(TABLA)}) ON COMMIT DROP')
+                cursor.execute(
+                    f'WITH movidas AS ('
+                    f'DELETE FROM {q(TABLA_DEFAULT)} WHERE fecha_acceso >= %s AND fecha_acceso < %s '
+                    f'RETURNING *) INSERT INTO {q(TABLA_MOVIDAS)} SELECT * FROM movidas',
+                    rango,
+                )
+                movidas = cursor.rowcount
+
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {q(nombre_particion(año, mes))}
+            PARTITION OF {q(TABLA)}
+            FOR VALUES FROM (%s) TO (%s)
+            """,
+            rango,
+        )
+        if movidas:
+            cursor.execute(f'INSERT INTO {q(TABLA)} SELECT * FROM {q(TABLA_MOVIDAS)}')
+            cursor.execute(f'DROP TABLE {q(TABLA_MOVIDAS)}')
+    return movidas
+
+
+def asegurar_particiones(meses_adelante=3, hoy=None):
+    """
+    Crea las particiones del mes actual y de los siguientes, y las de los
+    meses que tengan registros en DEFAULT. Devuelve [(año, mes, movidos)].
+    """
+    hoy = hoy or datetime.now(dt_timezone.utc)
+    creadas = []
+    existentes = set(particiones_existentes())
+    with connection.cursor() as cursor:
+        meses = set(meses_en_default(cursor))
+        for desplazamiento in range(meses_adelante + 1):
+            meses.add(_sumar_meses(hoy.year, hoy.month, desplazamiento))
+        for año, mes in sorted(meses - existentes):
+            creadas.append((año, mes, crear_particion(cursor, año, mes)))
+    return creadas
+
+
+def convertir_a_particionada(meses_adelante=3):
+    """
+    Convierte la tabla actual en una tabla particionada por mes.
+
+    Conserva nombres de índices y llaves foráneas para que las migraciones
+    posteriores sigan funcionando. La llave primaria pasa a (id, fecha_acceso)
+    porque PostgreSQL exige incluir la columna de partición; id sigue siendo
+    único porque lo asigna una sola secuencia.
+    """
+    q = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {q(TABLA)} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'ALTER TABLE {q(TABLA)} RENAME TO {q(TABLA_PREVIA)}')
+
+        # Índices secundarios y llaves foráneas de la tabla original
+        cursor.execute(
+            """
+            SELECT indexname, indexdef FROM pg_indexes
+            WHERE tablename = %s AND indexname NOT IN (
+                SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass
+            )
+            """,
+            [TABLA_PREVIA, TABLA_PREVIA],
+        )
+        indices = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f'
+            """,
+            [TABLA_PREVIA],
+        )
+        llaves = cursor.fetchall()
+        for nombre, _ in indices:
+            cursor.execute(f'ALTER INDEX {q(nombre)} RENAME TO {q(nombre[:50] + "_previa")}')
+        for nombre, _ in llaves:
+            cursor.execute(
+                f'ALTER TABLE {q(TABLA_PREVIA)} RENAME CONSTRAINT {q(nombre)} TO {q(nombre[:50] + "_previa")}'
+            )
+
+        cursor.execute(
+            f'CREATE TABLE {q(TABLA)} (LIKE {q(TABLA_PREVIA)} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE (fecha_acceso)'
+        )
+        cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS {q(SECUENCIA)} OWNED BY {q(TABLA)}.id')
+        cursor.execute(f"ALTER TABLE {q(TABLA)} ALTER COLUMN id SET DEFAULT nextval('{SECUENCIA}')")
+        cursor.execute(f'ALTER TABLE {q(TABLA)} ADD PRIMARY KEY (id, fecha_acceso)')
+        for nombre, definicion in llaves:
+            cursor.execute(f'ALTER TABLE {q(TABLA)} ADD CONSTRAINT {q(nombre)} {definicion}')
+        for _, definicion in indices:
+            # La definición se leyó con el nombre original del índice
+            cursor.execute(re.sub(rf'\bON (\S+\.)?{TABLA_PREVIA}\b', f'ON {q(TABLA)}', definicion))
+
+        # Particiones para todos los meses con datos más los siguientes
+        cursor.execute(f'SELECT MIN(fecha_acceso) FROM {q(TABLA_PREVIA)}')
+        minimo = cursor.fetchone()[0] or datetime.now(dt_timezone.utc)
+        minimo = minimo.astimezone(dt_timezone.utc)
+        hoy = datetime.now(dt_timezone.utc)
+        año, mes = minimo.year, minimo.month
+        tope = _sumar_meses(hoy.year, hoy.month, meses_adelante)
+        while (año, mes) <= tope:
+            crear_particion(cursor, año, mes)
+            año, mes = _sumar_meses(año, mes, 1)
+        cursor.execute(f'CREATE TABLE {q(TABLA_DEFAULT)} PARTITION OF {q(TABLA)} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {q(TABLA)} SELECT * FROM {q(TABLA_PREVIA)}')
+        cursor.execute(
+            f"SELECT setval('{SECUENCIA}', COALESCE((SELECT MAX(id) FROM {q(TABLA)}), 0) + 1, false)"
+        )
+        cursor.execute(f'DROP TABLE {q(TABLA_PREVIA)}')
+
+
+def _filas_mes(año, mes):
+    inicio = _inicio_mes(año, mes)
+    fin = _inicio_mes(*_sumar_meses(año, mes, 1))
+    return HistorialAcceso.objects.filter(fecha_acceso__gte=inicio, fecha_acceso__lt=fin)
+
+
+def exportar_mes(año, mes, destino, formato='jsonl'):
+    """
+    Exporta los accesos de un mes a un archivo comprimido.
+
+    Usa un cursor del lado del servidor para no cargar el mes en memoria.
+    Escribe primero a un archivo temporal y lo renombra al terminar, así un
+    archivo final siempre está completo. Devuelve (ruta, filas).
+    """
+    os.makedirs(destino, exist_ok=True)
+    ruta = os.path.join(destino, f'historial_acceso_{año:04d}_{mes:02d}.{formato}.gz')
+    temporal = f'{ruta}.tmp'
+
+    filas = 0
+    registros = _filas_mes(año, mes).order_by().values_list(*CAMPOS_EXPORTACION)
+    with gzip.open(temporal, 'wt', encoding='utf-8', newline='') as salida:
+        escritor = None
+        if formato == 'csv':
+            escritor = csv.writer(salida)
+            escritor.writerow(CAMPOS_EXPORTACION)
+        for registro in registros.iterator(chunk_size=5000):
+            fila = dict(zip(CAMPOS_EXPORTACION, registro))
+            fila['fecha_acceso'] = fila['fecha_acceso'].isoformat()
+            if escritor:
+                escritor.writerow([fila[campo] for campo in CAMPOS_EXPORTACION])
+            else:
+                salida.write(json.dumps(fila, ensure_ascii=False) + '\n')
+            filas += 1
+    os.replace(temporal, ruta)
+    return ruta, filas
+
+
+def eliminar_mes(año, mes):
+    """Elimina la partición del mes (o los registros si no hay particiones)."""
+    if esta_particionada():
+        nombre = nombre_particion(año, mes)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'ALTER TABLE {connection.ops.quote_name(TABLA)} '
+                f'DETACH PARTITION {connection.ops.quote_name(nombre)}'
+            )
+            cursor.execute(f'DROP TABLE {connection.ops.quote_name(nombre)}')
+        return
+    _filas_mes(año, mes).delete()
+
+
+def meses_vencidos(retencion_meses, hoy=None):
+    """Meses completos que quedan fuera de la ventana de retención."""
+    hoy = hoy or datetime.now(dt_timezone.utc)
+    limite = _sumar_meses(hoy.year, hoy.month, -retencion_meses)
+
+    if esta_particionada():
+        return [mes for mes in particiones_existentes() if mes < limite]
+
+    primero = HistorialAcceso.objects.order_by('fecha_acceso').values_list('fecha_acceso', flat=True).first()
+    if primero is None:
+        return []
+    primero = primero.astimezone(dt_timezone.utc)
+    meses = []
+    año, mes = primero.year, primero.month
+    while (año, mes) < limite:
+        meses.append((año, mes))
+        año, mes = _sumar_meses(año, mes, 1)
+    return meses
+
+
+def aplicar_retencion(retencion_meses, destino, formato='jsonl', hoy=None):
+    """
+    Archiva y elimina los meses vencidos.
+
+    Antes de borrar se consolidan los accesos pendientes, para que los
+    totales de AccesoDiario no pierdan nada. Un mes solo se elimina si su
+    exportación terminó y si la consolidación ya lo cubre.
+    """
+    consolidar_accesos()
+    marca = MarcaConsolidacion.objects.filter(nombre=MARCA_HISTORIAL).values_list('ultimo_id', flat=True).first() or 0
+
+    resultados = []
+    for año, mes in meses_vencidos(retencion_meses, hoy=hoy):
+        ultimo_id = _filas_mes(año, mes).order_by('-id').values_list('id', flat=True).first()
+        if ultimo_id is not None and ultimo_id > marca:
+            resultados.append({'mes': (año, mes), 'estado': 'sin_consolidar'})
+            continue
+        ruta, filas = exportar_mes(año, mes, destino, formato)
+        eliminar_mes(año, mes)
+        resultados.append({'mes': (año, mes), 'estado': 'archivado', 'ruta': ruta, 'filas': filas})
+    return resultados
+
+
+def _leer_exportacion(ruta):
+    with gzip.open(ruta, 'rt', encoding='utf-8', newline='') as entrada:
+        if ruta.endswith('.csv.gz'):
+            for fila in csv.DictReader(entrada):
+                fila['usuario_id'] = fila['usuario_id'] or None
+                fila['ip_address'] = fila['ip_address'] or None
+                fila['es_acceso_publico'] = fila['es_acceso_publico'] == 'True'
+                yield fila
+        else:
+            for linea in entrada:
+                if linea.strip():
+                    yield json.loads(linea)
+
+
+def restaurar_exportacion(ruta, tamaño_lote=5000):
+    """
+    Vuelve a cargar un archivo exportado en HistorialAcceso.
+
+    En PostgreSQL particionado se crea antes la partición de cada mes
+    restaurado. Los registros que ya existan (mismo id) se omiten, igual que
+    los de archivos que ya fueron eliminados. Devuelve (restaurados, omitidos).
+    """
+    particionada = esta_particionada()
+    meses_creados = set()
+    lote = []
+    total = 0
+    omitidos = 0
+
+    def guardar(lote):
+        existentes = set(Archivo.objects.filter(
+            id__in={registro.archivo_id for registro in lote}
+        ).values_list('id', flat=True))
+        validos = [registro for registro in lote if registro.archivo_id in existentes]
+        HistorialAcceso.objects.bulk_create(validos, batch_size=tamaño_lote, ignore_conflicts=True)
+        return len(validos)
+
+    for fila in _leer_exportacion(ruta):
+        fecha = parse_datetime(fila['fecha_acceso'])
+        if particionada:
+            clave = (fecha.astimezone(dt_timezone.utc).year, fecha.astimezone(dt_timezone.utc).month)
+            if clave not in meses_creados:
+                with connection.cursor() as cursor:
+                    crear_particion(cursor, *clave)
+                meses_creados.add(clave)
+        lote.append(HistorialAcceso(
+            id=int(fila['id']),
+            archivo_id=int(fila['archivo_id']),
+            usuario_id=int(fila['usuario_id']) if fila['usuario_id'] else None,
+            fecha_acceso=fecha,
+            ip_address=fila['ip_address'],
+            es_acceso_publico=fila['es_acceso_publico'],
+            user_agent=fila['user_agent'] or '',
+        ))
+        if len(lote) >= tamaño_lote:
+            guardados = guardar(lote)
+            total += guardados
+            omitidos += len(lote) - guardados
+            lote = []
+    if lote:
+        guardados = guardar(lote)
+        total += guardados
+        omitidos += len(lote) - guardados
+    return total, omitidos
@@ -0,0 +1,29 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Archivo, Fraccion
+
+
+@receiver(post_delete, sender=Archivo)
+def liberar_contenido_archivo(sender, instance, **kwargs):
+    """Al eliminar un Archivo (también en cascada) su contenido pierde una referencia"""
+    if instance.contenido_id:
+        from .almacen import liberar_contenido
+        liberar_contenido(instance.contenido_id)
+
+
+@receiver(post_save, sender=Archivo)
+@receiver(post_delete, sender=Archivo)
+def invalidar_facetas(sender, **kwargs):
+    """Los conteos de los filtros del listado se recalculan tras el cambio"""
+    from .facetas import invalidar
+    transaction.on_commit(invalidar)
+
+
+@receiver(post_save, sender=Fraccion)
+@receiver(post_delete, sender=Fraccion)
+def invalidar_catalogo_fracciones(sender, **kwargs):
+    """Una fracción nueva, reasignada o desactivada: todos los procesos recargan el catálogo"""
+    from .catalogo import catalogo
+    transaction.on_commit(catalogo.invalidar)
@@ -1,3 +1,871 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from openpyxl import load_workbook
+
+from . import autorizacion, cache_exportaciones, extraccion, facetas, manejadores, paginacion, particiones, trabajos
+from .bitacora import BitacoraAccesos, ip_cliente
+from .cargas import completar_cargas, guardar_bloque, publicar_version
+from .consolidacion import consolidar_accesos
+from .catalogo import catalogo
+from .descargas import MAX_RANGOS, parsear_rangos, servir_archivo
+from .manejadores import ManejadorCargaVerificada, archivos_rechazados
+from .models import (
+    AccesoDiario, Archivo, ContadorVersion, ContenidoArchivo, Fraccion, HistorialAcceso, PerfilUsuario,
+    SesionCarga, TrabajoExportacion, VersionCatalogo,
+)
+from .views import HistorialView
+
+PERIODO = {'tipo_periodo': 'anual', 'año': 2025, 'periodo_especifico': 'A'}
+
+
+def archivo_pdf(nombre, contenido):
+    return SimpleUploadedFile(nombre, b'%PDF-1.4\n' + contenido.encode(), content_type='application/pdf')
+
+
+class VersionadoConcurrenteTests(TransactionTestCase):
+    """Asignación de versiones con el contador por periodo (ContadorVersion)"""
+
+    CARGAS_SIMULTANEAS = 8
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        ajustes = override_settings(
+            MEDIA_ROOT=self.media,
+            ARCHIVOS_PREPARACION_DIR=os.path.join(self.media, '.preparacion'),
+            ARCHIVOS_CARGAS_DIR=os.path.join(self.media, '.cargas'),
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+
+        self.usuario = User.objects.create_user('capturista', password='x')
+        self.fraccion = Fraccion.objects.create(
+            numero='I', nombre='Fracción de prueba', tipo_usuario_asignado='transparencia'
+        )
+
+    def publicar(self, etiqueta, archivos=1):
+        return publicar_version(
+            fraccion=self.fraccion,
+            usuario=self.usuario,
+            archivos_subidos=[archivo_pdf(f'{etiqueta}-{i}.pdf', f'{etiqueta}-{i}') for i in range(archivos)],
+            **PERIODO,
+        )
+
+    def versiones_vigentes(self):
+        return set(Archivo.objects.filter(fraccion=self.fraccion, vigente=True).values_list('version', flat=True))
+
+    def test_versiones_consecutivas(self):
+        versiones = [self.publicar(f'carga{i}', archivos=2)[0] for i in range(5)]
+
+        self.assertEqual(versiones, [1, 2, 3, 4, 5])
+        self.assertEqual(self.versiones_vigentes(), {5})
+        self.assertEqual(Archivo.objects.filter(vigente=True).count(), 2)
+        self.assertEqual(ContadorVersion.objects.get(fraccion=self.fraccion).ultima_version, 5)
+
+    def test_consultas_no_dependen_del_historial(self):
+        self.publicar('inicial')
+        with CaptureQueriesContext(connection) as con_poco_historial:
+            self.publicar('segunda')
+
+        for i in range(20):
+            self.publicar(f'historial{i}')
+        with CaptureQueriesContext(connection) as con_mucho_historial:
+            self.publicar('final')
+
+        self.assertEqual(len(con_poco_historial), len(con_mucho_historial))
+
+    def test_contador_parte_de_versiones_existentes(self):
+        # Periodo con versiones creadas fuera de publicar_version (sin contador)
+        Archivo.objects.create(
+            fraccion=self.fraccion, usuario=self.usuario, archivo=archivo_pdf('admin.pdf', 'admin'),
+            vigente=True, version=7, **PERIODO,
+        )
+
+        version, _ = self.publicar('nueva')
+
+        self.assertEqual(version, 8)
+        self.assertEqual(self.versiones_vigentes(), {8})
+
+    def test_completar_dos_veces_la_misma_carga(self):
+        contenido = b'%PDF-1.4\n' + b'x' * 100
+        sesion = SesionCarga.objects.create(
+            usuario=self.usuario, fraccion=self.fraccion, nombre_original='grande.pdf',
+            tamaño=len(contenido), tamaño_bloque=64, **PERIODO,
+        )
+        for indice in range(sesion.total_bloques):
+            guardar_bloque(sesion, indice, io.BytesIO(contenido[indice * 64:(indice + 1) * 64]))
+        # Doble envío: la segunda solicitud leyó la sesión cuando aún estaba activa
+        repetida = SesionCarga.objects.get(pk=sesion.pk)
+
+        self.assertEqual(completar_cargas([sesion], self.usuario)[0], 1)
+        with self.assertRaises(ValidationError):
+            completar_cargas([repetida], self.usuario)
+
+        self.assertEqual(Archivo.objects.filter(fraccion=self.fraccion).count(), 1)
+        self.assertEqual(SesionCarga.objects.get(pk=sesion.pk).estado, 'completada')
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_cargas_simultaneas_del_mismo_periodo(self):
+        barrera = threading.Barrier(self.CARGAS_SIMULTANEAS)
+        versiones = []
+        errores = []
+
+        def cargar(indice):
+            try:
+                barrera.wait()
+                versiones.append(self.publicar(f'hilo{indice}', archivos=2)[0])
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=cargar, args=(i,)) for i in range(self.CARGAS_SIMULTANEAS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        self.assertEqual(sorted(versiones), list(range(1, self.CARGAS_SIMULTANEAS + 1)))
+        self.assertEqual(self.versiones_vigentes(), {self.CARGAS_SIMULTANEAS})
+        self.assertEqual(Archivo.objects.filter(vigente=True).count(), 2)
+        self.assertEqual(Archivo.objects.count(), 2 * self.CARGAS_SIMULTANEAS)
+        self.assertEqual(
+            ContadorVersion.objects.get(fraccion=self.fraccion).ultima_version, self.CARGAS_SIMULTANEAS
+        )
+
+
+class FacetasTests(TestCase):
+    """Conteos por faceta del listado (facetas.py)"""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+
+        usuario = User.objects.create_user('capturista', password='x')
+        self.primera = Fraccion.objects.create(numero='I', nombre='Primera', tipo_usuario_asignado='transparencia')
+        self.segunda = Fraccion.objects.create(numero='II', nombre='Segunda', tipo_usuario_asignado='transparencia')
+        ajena = Fraccion.objects.create(numero='III', nombre='Ajena', tipo_usuario_asignado='otro')
+        filas = [
+            (self.primera, 2024, 'anual', 'A', True),
+            (self.primera, 2024, 'anual', 'A', False),
+            (self.primera, 2025, 'trimestral', 'T1', True),
+            (self.segunda, 2024, 'anual', 'A', True),
+            (ajena, 2024, 'anual', 'A', True),
+        ]
+        for i, (fraccion, año, tipo_periodo, periodo, vigente) in enumerate(filas):
+            Archivo.objects.create(
+                fraccion=fraccion, usuario=usuario, archivo=archivo_pdf(f'f{i}.pdf', f'f{i}'),
+                año=año, tipo_periodo=tipo_periodo, periodo_especifico=periodo, vigente=vigente,
+            )
+
+    def test_cada_faceta_excluye_su_propio_filtro(self):
+        conteos = facetas.calcular('transparencia', {'año': '2024'})
+
+        self.assertEqual(conteos['fraccion'], {self.primera.id: 1, self.segunda.id: 1})
+        self.assertEqual(conteos['año'], {2024: 2, 2025: 1})
+        self.assertEqual(conteos['tipo_periodo'], {'anual': 2})
+        self.assertEqual(conteos['estado'], {'vigente': 2, 'historico': 1, 'todos': 3})
+
+    def test_parametros_de_grouping_sets_en_orden_del_sql(self):
+        consultas = []
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value = cursor
+        cursor.execute.side_effect = lambda sql, parametros: consultas.append((sql, parametros))
+        cursor.fetchall.return_value = []
+        base = facetas._base('transparencia', {})
+        filtros = facetas._filtros({'año': '2024', 'fraccion': str(self.primera.id)})
+
+        with mock.patch.object(facetas.connection, 'cursor', return_value=cursor):
+            facetas._conteos_grouping_sets(base, filtros)
+
+        sql, parametros = consultas[0]
+        antes_de_from = sql[:sql.index(' FROM (')].count('%s')
+        _, parametros_base = base.values(*facetas.FACETAS.values()).query.sql_with_params()
+        # fraccion_id, año y vigente (por defecto) filtrados: cada faceta usa los de las otras
+        primera = self.primera.id
+        self.assertEqual(
+            parametros[:antes_de_from],
+            [2024, True, primera, True, primera, 2024, True, primera, 2024],
+        )
+        self.assertEqual(parametros[antes_de_from:], list(parametros_base))
+
+
+class AutorizacionTests(TestCase):
+    """Contexto de autorización por solicitud (autorizacion.py)"""
+
+    def test_cambio_de_perfil_se_ve_en_la_siguiente_solicitud(self):
+        usuario = User.objects.create_user('capturista', password='x')
+        PerfilUsuario.objects.create(user=usuario, tipo_usuario='transparencia')
+        with self.captureOnCommitCallbacks(execute=True):
+            fraccion = Fraccion.objects.create(numero='I', nombre='Primera', tipo_usuario_asignado='transparencia')
+        self.assertTrue(autorizacion.obtener(User.objects.get(pk=usuario.pk)).puede_fraccion(fraccion.id))
+
+        # Cambio hecho por otro proceso: sin señales en este
+        PerfilUsuario.objects.filter(user=usuario).update(tipo_usuario='recursos_financieros')
+
+        self.assertFalse(autorizacion.obtener(User.objects.get(pk=usuario.pk)).puede_fraccion(fraccion.id))
+
+
+@override_settings(ARCHIVOS_CATALOGO_REVISION_SEGUNDOS=0)
+class CatalogoTests(TestCase):
+    """Catálogo de fracciones en memoria con la versión en la base de datos (catalogo.py)"""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fraccion = Fraccion.objects.create(
+                numero='I', nombre='Primera', tipo_usuario_asignado='transparencia'
+            )
+
+    def test_cambio_en_este_proceso(self):
+        self.assertEqual(catalogo.por_numero('I').nombre, 'Primera')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fraccion.tipo_usuario_asignado = 'recursos_financieros'
+            self.fraccion.save()
+
+        self.assertEqual(catalogo.por_tipo_usuario('transparencia'), [])
+
+    def test_cambio_en_otro_proceso(self):
+        self.assertEqual(catalogo.por_tipo_usuario('transparencia'), [self.fraccion])
+
+        # Lo que hace otro worker al guardar: sin señales en este proceso
+        Fraccion.objects.filter(pk=self.fraccion.pk).update(activa=False)
+        VersionCatalogo.objects.filter(nombre='fracciones').update(version=F('version') + 1)
+
+        self.assertEqual(catalogo.por_tipo_usuario('transparencia'), [])
+        self.assertFalse(catalogo.por_id(self.fraccion.id).activa)
+
+
+class BitacoraTests(TestCase):
+    """Bitácora de accesos por lotes (bitacora.py)"""
+
+    def test_ip_de_x_forwarded_for_invalida(self):
+        fabrica = RequestFactory()
+
+        self.assertEqual(ip_cliente(fabrica.get('/', HTTP_X_FORWARDED_FOR='10.0.0.7, 10.0.0.1')), '10.0.0.7')
+        self.assertEqual(ip_cliente(fabrica.get('/', HTTP_X_FORWARDED_FOR='<script>', REMOTE_ADDR='10.0.0.2')), '10.0.0.2')
+        self.assertEqual(ip_cliente(fabrica.get('/', HTTP_X_FORWARDED_FOR='x', REMOTE_ADDR='')), '0.0.0.0')
+
+    def test_evento_invalido_no_descarta_el_lote(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media):
+            archivo = Archivo.objects.create(
+                fraccion=Fraccion.objects.create(numero='I', nombre='Primera', tipo_usuario_asignado='transparencia'),
+                usuario=User.objects.create_user('capturista', password='x'),
+                archivo=archivo_pdf('a.pdf', 'a'), **PERIODO,
+            )
+        bitacora = BitacoraAccesos()
+        eventos = [{'archivo_id': archivo.pk, 'ip_address': f'10.0.0.{i}'} for i in range(5)]
+        eventos[2]['fecha_acceso'] = 'no es una fecha'
+
+        with self.assertLogs('archivos.bitacora', 'WARNING'):
+            bitacora._escribir(eventos)
+
+        self.assertEqual(HistorialAcceso.objects.count(), 4)
+        self.assertEqual((bitacora.registrados, bitacora.errores), (4, 1))
+
+    def test_reporte_periodico_de_contadores(self):
+        bitacora = BitacoraAccesos(capacidad=1, reporte=0.01)
+        bitacora._asegurar_hilo = lambda: None  # Sin hilo: la cola se llena con el segundo evento
+        bitacora.registrar(archivo_id=1)
+        bitacora.registrar(archivo_id=2)
+        time.sleep(0.02)
+
+        with self.assertLogs('archivos.bitacora', 'INFO') as registro:
+            bitacora._reportar()
+        self.assertIn("'descartados': 1", registro.output[0])
+
+        # Sin actividad desde el último reporte no se repite la línea
+        time.sleep(0.02)
+        with self.assertNoLogs('archivos.bitacora', 'INFO'):
+            bitacora._reportar()
+
+
+class CacheExportacionesTests(TestCase):
+    """Caché en disco de las exportaciones a Excel (cache_exportaciones.py)"""
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        ajustes = override_settings(
+            MEDIA_ROOT=os.path.join(directorio, 'media'),
+            ARCHIVOS_EXPORTACIONES_CACHE_DIR=os.path.join(directorio, 'cache'),
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.usuarios = []
+        for nombre in ('ana', 'beto'):
+            usuario = User.objects.create_user(nombre, password='x')
+            PerfilUsuario.objects.create(user=usuario, tipo_usuario='transparencia')
+            self.usuarios.append(usuario)
+        Archivo.objects.create(
+            fraccion=Fraccion.objects.create(numero='I', nombre='Primera', tipo_usuario_asignado='transparencia'),
+            usuario=self.usuarios[0], archivo=archivo_pdf('a.pdf', 'a'), **PERIODO,
+        )
+
+    def generado_por(self, usuario):
+        archivo, _ = trabajos.generar_xlsx(User.objects.get(pk=usuario.pk), {}, 'http://testserver')
+        with archivo:
+            hoja = load_workbook(archivo, read_only=True).active
+            for fila in hoja.iter_rows(values_only=True):
+                if fila and fila[0] == 'Reporte generado por:':
+                    return fila[1]
+
+    def test_entrada_por_usuario(self):
+        self.assertEqual(self.generado_por(self.usuarios[0]), 'ana')
+        self.assertEqual(self.generado_por(self.usuarios[1]), 'beto')
+        self.assertEqual(len(os.listdir(settings.ARCHIVOS_EXPORTACIONES_CACHE_DIR)), 2)
+
+    def test_exportar_excel_calcula_la_huella_una_vez(self):
+        self.client.force_login(self.usuarios[0])
+        with mock.patch.object(cache_exportaciones, 'huella', wraps=cache_exportaciones.huella) as huella:
+            response = self.client.get(reverse('archivos:listado_archivos'), {'export': 'excel'})
+
+        self.assertEqual(response.status_code, 200)
+        b''.join(response.streaming_content)
+        self.assertEqual(huella.call_count, 1)
+
+    def test_cambio_de_fraccion_invalida_la_entrada(self):
+        self.generado_por(self.usuarios[0])
+        fraccion = Fraccion.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            fraccion.nombre = 'Primera (renombrada)'
+            fraccion.save()
+
+        self.generado_por(self.usuarios[0])
+        self.assertEqual(len(os.listdir(settings.ARCHIVOS_EXPORTACIONES_CACHE_DIR)), 2)
+
+
+class ExtraccionPdfTests(TestCase):
+    """Lector mínimo de PDF de la extracción de texto (extraccion.py)"""
+
+    def pdf(self, *flujos):
+        partes = [b'%PDF-1.4\n1 0 obj << /Type /Page >> endobj\n']
+        for i, flujo in enumerate(flujos, start=2):
+            partes.append(
+                b'%d 0 obj << /Length %d /Filter /FlateDecode >> stream\n' % (i, len(flujo))
+                + flujo + b'\nendstream endobj\n'
+            )
+        return io.BytesIO(b''.join(partes) + b'%%EOF')
+
+    def test_texto_de_flujo_comprimido(self):
+        texto, paginas = extraccion.extraer_pdf(self.pdf(zlib.compress(b'BT /F1 12 Tf (Informe anual) Tj ET')))
+
+        self.assertEqual((texto, paginas), ('Informe anual', 1))
+
+    @override_settings(ARCHIVOS_EXTRACCION_MAX_DESCOMPRIMIDO=1024 * 1024)
+    def test_bomba_de_descompresion(self):
+        # ~200 KB comprimidos que se expanden a 200 MB
+        compresor = zlib.compressobj()
+        ceros = b'\0' * (1024 * 1024)
+        bomba = compresor.compress(b'BT (a) Tj ET ') + b''.join(compresor.compress(ceros) for _ in range(200))
+        bomba += compresor.flush()
+        flujos = list(extraccion._flujos(self.pdf(bomba, bomba).read()))
+
+        self.assertEqual(len(flujos), 1)
+        self.assertEqual(len(flujos[0][1]), 1024 * 1024)
+
+
+@override_settings(ARCHIVOS_ENTREGA='django')
+class RangosTests(SimpleTestCase):
+    """Solicitudes parciales (Range / If-Range) en servir_archivo (descargas.py)"""
+
+    CONTENIDO = bytes(range(100))
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        self.ruta = os.path.join(directorio, 'documento.pdf')
+        with open(self.ruta, 'wb') as archivo:
+            archivo.write(self.CONTENIDO)
+        self.fabrica = RequestFactory()
+
+    def servir(self, ruta=None, **encabezados):
+        response = servir_archivo(self.fabrica.get('/', **encabezados), ruta or self.ruta)
+        cuerpo = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, cuerpo
+
+    def test_parsear_y_combinar(self):
+        self.assertEqual(parsear_rangos('bytes=0-9,5-19,20-29,50-', 100), [(0, 29), (50, 99)])
+        self.assertEqual(parsear_rangos('bytes=-10', 100), [(90, 99)])
+        self.assertEqual(parsear_rangos('bytes=-500', 100), [(0, 99)])
+        self.assertEqual(parsear_rangos('bytes=90-200', 100), [(90, 99)])
+
+    def test_parsear_invalidos_y_no_satisfacibles(self):
+        self.assertIsNone(parsear_rangos('', 100))
+        self.assertIsNone(parsear_rangos('items=0-9', 100))
+        self.assertIsNone(parsear_rangos('bytes=9-0', 100))
+        self.assertIsNone(parsear_rangos('bytes=' + ','.join(['0-1'] * (MAX_RANGOS + 1)), 100))
+        self.assertEqual(parsear_rangos('bytes=100-', 100), [])
+        self.assertEqual(parsear_rangos('bytes=-0', 100), [])
+        self.assertEqual(parsear_rangos('bytes=-10', 0), [])
+
+    def test_un_rango(self):
+        response, cuerpo = self.servir(HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(cuerpo, self.CONTENIDO[10:20])
+
+    def test_rango_no_satisfacible(self):
+        response, _ = self.servir(HTTP_RANGE='bytes=200-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_sufijo_de_archivo_vacio(self):
+        vacio = os.path.join(os.path.dirname(self.ruta), 'vacio.pdf')
+        open(vacio, 'wb').close()
+
+        response, _ = self.servir(vacio, HTTP_RANGE='bytes=-10')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */0')
+
+    def test_if_range(self):
+        vigente = http_date(os.stat(self.ruta).st_mtime)
+        anterior = http_date(os.stat(self.ruta).st_mtime - 3600)
+
+        self.assertEqual(self.servir(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=vigente)[0].status_code, 206)
+        response, cuerpo = self.servir(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=anterior)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cuerpo, self.CONTENIDO)
+        self.assertEqual(self.servir(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='W/"debil"')[0].status_code, 200)
+
+    def test_multirango_content_length(self):
+        response, cuerpo = self.servir(HTTP_RANGE='bytes=0-4,50-59,-5')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        self.assertEqual(int(response['Content-Length']), len(cuerpo))
+        for inicio, fin in [(0, 4), (50, 59), (95, 99)]:
+            self.assertIn(f'Content-Range: bytes {inicio}-{fin}/100'.encode(), cuerpo)
+            self.assertIn(self.CONTENIDO[inicio:fin + 1], cuerpo)
+
+
+class ImportacionTests(TestCase):
+    """Importación de carpetas históricas (importar_archivos)"""
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        ajustes = override_settings(
+            MEDIA_ROOT=os.path.join(directorio, 'media'),
+            ARCHIVOS_PREPARACION_DIR=os.path.join(directorio, 'preparacion'),
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.raiz = os.path.join(directorio, 'historico')
+        self.checkpoint = os.path.join(directorio, 'checkpoint.json')
+        self.usuario = User.objects.create_user('importador', password='x')
+        self.fraccion = Fraccion.objects.create(
+            numero='I', nombre='Fracción de prueba', tipo_usuario_asignado='transparencia'
+        )
+
+    def crear(self, relativa, contenido):
+        ruta = os.path.join(self.raiz, relativa)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'wb') as archivo:
+            archivo.write(b'%PDF-1.4\n' + contenido.encode())
+
+    def importar(self, *args):
+        salida = io.StringIO()
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                'importar_archivos', self.raiz, *args, usuario='importador', procesos=1,
+                checkpoint=self.checkpoint, stdout=salida,
+            )
+        return salida.getvalue()
+
+    def test_version_posterior_con_los_mismos_archivos(self):
+        self.crear('I/2025/A/v1/informe.pdf', 'igual')
+        self.crear('I/2025/A/v2/informe.pdf', 'igual')
+
+        self.importar()
+        self.assertEqual(
+            list(Archivo.objects.order_by('version').values_list('version', 'vigente', 'origen_importacion')),
+            [(1, False, 'I/2025/A/v1'), (2, True, 'I/2025/A/v2')],
+        )
+
+        # Repetir la importación (sin checkpoint) no duplica nada
+        salida = self.importar()
+        self.assertEqual(Archivo.objects.count(), 2)
+        self.assertIn('Versiones omitidas por estar ya importadas: 2', salida)
+
+    def test_periodo_con_version_vigente_desde_la_web(self):
+        web = publicar_version(self.fraccion, self.usuario, archivos_subidos=[archivo_pdf('web.pdf', 'web')], **PERIODO)[1]
+        self.crear('I/2025/A/historico.pdf', 'historico')
+
+        salida = self.importar()
+        self.assertIn('ya tiene cargas desde la web', salida)
+        self.assertEqual(list(Archivo.objects.filter(vigente=True)), web)
+        self.assertFalse(Archivo.objects.exclude(origen_importacion='').exists())
+
+        self.importar('--reemplazar')
+        self.assertEqual(
+            list(Archivo.objects.filter(vigente=True).values_list('version', 'origen_importacion')),
+            [(2, 'I/2025/A')],
+        )
+
+
+class TrabajosExportacionTests(TransactionTestCase):
+    """Worker de exportaciones en segundo plano (trabajos.py)"""
+
+    def test_latido_evita_reanudar_un_trabajo_vivo(self):
+        usuario = User.objects.create_user('ana', password='x')
+        trabajo = TrabajoExportacion.objects.create(usuario=usuario, base_url='http://testserver', estado='en_proceso')
+        reanudados = []
+
+        def hoja_lenta(*args, **kwargs):
+            # Sin avance de filas durante más que el plazo de reanudar_interrumpidos
+            TrabajoExportacion.objects.filter(pk=trabajo.pk).update(
+                updated_at=timezone.now() - timedelta(hours=1)
+            )
+            time.sleep(0.3)
+            reanudados.append(trabajos.reanudar_interrumpidos())
+            raise RuntimeError('fin de la prueba')
+
+        with mock.patch.object(trabajos, 'INTERVALO_LATIDO', 0.05), \
+                mock.patch.object(trabajos, 'generar_xlsx', side_effect=hoja_lenta):
+            trabajos.procesar_trabajo(trabajo)
+
+        self.assertEqual(reanudados, [0])
+        self.assertEqual(TrabajoExportacion.objects.get(pk=trabajo.pk).estado, 'error')
+
+
+class AlmacenTests(TestCase):
+    """Almacén por contenido (almacen.py)"""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.fraccion = Fraccion.objects.create(numero='I', nombre='Primera', tipo_usuario_asignado='transparencia')
+        self.usuario = User.objects.create_user('capturista', password='x')
+
+    def crear(self, nombre, contenido):
+        return Archivo.objects.create(
+            fraccion=self.fraccion, usuario=self.usuario, archivo=archivo_pdf(nombre, contenido), **PERIODO,
+        )
+
+    def test_baja_no_borra_un_contenido_registrado_de_nuevo(self):
+        contenido = self.crear('a.pdf', 'a').contenido
+        ruta = os.path.join(self.media, contenido.ruta)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Archivo.objects.all().delete()
+        # Otra carga registra el mismo contenido antes de que corra el callback
+        ContenidoArchivo.objects.create(sha256=contenido.sha256, ruta=contenido.ruta, tamaño=contenido.tamaño)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(os.path.exists(ruta))
+
+        # Sin otra fila con la ruta, el archivo sí se borra
+        contenido = self.crear('b.pdf', 'b').contenido
+        ruta = os.path.join(self.media, contenido.ruta)
+        with self.captureOnCommitCallbacks(execute=True):
+            Archivo.objects.filter(contenido=contenido).delete()
+        self.assertEqual(os.listdir(os.path.dirname(ruta)), [])
+
+    def test_deduplicar_no_reutiliza_un_blob_corrupto(self):
+        archivo = self.crear('a.pdf', 'original')
+        contenido = archivo.contenido
+        blob = os.path.join(self.media, contenido.ruta)
+        # Fila anterior al almacén por contenido, con un blob dañado de una migración interrumpida
+        os.makedirs(os.path.join(self.media, 'archivos'))
+        shutil.copyfile(blob, os.path.join(self.media, 'archivos', 'a.pdf'))
+        Archivo.objects.filter(pk=archivo.pk).update(archivo='archivos/a.pdf', contenido=None)
+        contenido.delete()
+        with open(blob, 'wb') as dañado:
+            dañado.write(b'%PDF-1.4\notro')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('deduplicar_archivos', stdout=io.StringIO())
+
+        archivo.refresh_from_db()
+        self.assertEqual(archivo.contenido.ruta, contenido.ruta)
+        with open(blob, 'rb') as migrado:
+            self.assertEqual(migrado.read(), b'%PDF-1.4\noriginal')
+        self.assertFalse(os.path.exists(os.path.join(self.media, 'archivos', 'a.pdf')))
+
+
+class RetencionHistorialTests(TestCase):
+    """Particiones, retención y restauración de HistorialAcceso (particiones.py)"""
+
+    HOY = datetime(2026, 10, 15, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        self.destino = os.path.join(directorio, 'respaldos')
+        with override_settings(MEDIA_ROOT=os.path.join(directorio, 'media')):
+            self.archivo = Archivo.objects.create(
+                fraccion=Fraccion.objects.create(numero='I', nombre='Primera', tipo_usuario_asignado='transparencia'),
+                usuario=User.objects.create_user('capturista', password='x'),
+                archivo=archivo_pdf('a.pdf', 'a'), **PERIODO,
+            )
+
+    def acceso(self, fecha, **campos):
+        return HistorialAcceso.objects.create(archivo=self.archivo, fecha_acceso=fecha, ip_address='10.0.0.1', **campos)
+
+    def test_no_elimina_un_mes_sin_consolidar(self):
+        self.acceso(datetime(2024, 1, 10, tzinfo=dt_timezone.utc))
+
+        with mock.patch.object(particiones, 'consolidar_accesos'):
+            resultados = particiones.aplicar_retencion(12, self.destino, hoy=self.HOY)
+
+        self.assertEqual(resultados[0], {'mes': (2024, 1), 'estado': 'sin_consolidar'})
+        self.assertEqual(HistorialAcceso.objects.count(), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.destino, 'historial_acceso_2024_01.jsonl.gz')))
+
+    def test_restaurar_el_mes_archivado(self):
+        accesos = [
+            self.acceso(datetime(2024, 1, 10, tzinfo=dt_timezone.utc), usuario=self.archivo.usuario),
+            self.acceso(datetime(2024, 1, 31, 23, 59, tzinfo=dt_timezone.utc), es_acceso_publico=True),
+        ]
+        esperados = list(HistorialAcceso.objects.order_by('id').values_list(*particiones.CAMPOS_EXPORTACION))
+
+        for formato in ('jsonl', 'csv'):
+            with self.subTest(formato=formato):
+                resultado = particiones.aplicar_retencion(12, self.destino, formato, hoy=self.HOY)[0]
+                self.assertEqual((resultado['mes'], resultado['estado'], resultado['filas']), ((2024, 1), 'archivado', 2))
+                self.assertFalse(HistorialAcceso.objects.exists())
+
+                self.assertEqual(particiones.restaurar_exportacion(resultado['ruta']), (len(accesos), 0))
+                self.assertEqual(
+                    list(HistorialAcceso.objects.order_by('id').values_list(*particiones.CAMPOS_EXPORTACION)),
+                    esperados,
+                )
+
+    @skipUnless(connection.vendor == 'postgresql', 'las particiones solo existen en PostgreSQL')
+    def test_crear_particion_mueve_los_registros_de_default(self):
+        particiones.convertir_a_particionada(meses_adelante=0)
+        # Mes sin partición propia: el registro cae en DEFAULT
+        acceso = self.acceso(datetime(2031, 5, 10, tzinfo=dt_timezone.utc))
+
+        with connection.cursor() as cursor:
+            self.assertEqual(particiones.meses_en_default(cursor), [(2031, 5)])
+            self.assertEqual(particiones.crear_particion(cursor, 2031, 5), 1)
+            self.assertEqual(particiones.meses_en_default(cursor), [])
+            cursor.execute(f'SELECT id FROM {connection.ops.quote_name(particiones.nombre_particion(2031, 5))}')
+            self.assertEqual(cursor.fetchall(), [(acceso.pk,)])
+        self.assertEqual(HistorialAcceso.objects.get().pk, acceso.pk)
+
+
+@override_settings(ARCHIVOS_ENTREGA='django', ARCHIVOS_BITACORA_ASINCRONA=False)
+class DescargasCondicionalesTests(TestCase):
+    """ETag / Last-Modified y respuestas 304 en las vistas de archivos"""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(
+            MEDIA_ROOT=self.media, ARCHIVOS_PREPARACION_DIR=os.path.join(self.media, '.preparacion'),
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.usuario = User.objects.create_user('capturista', password='x')
+        PerfilUsuario.objects.create(user=self.usuario, tipo_usuario='transparencia')
+        self.archivo = Archivo.objects.create(
+            fraccion=Fraccion.objects.create(numero='I', nombre='Primera', tipo_usuario_asignado='transparencia'),
+            usuario=self.usuario, archivo=archivo_pdf('a.pdf', 'a'), **PERIODO,
+        )
+        self.url = reverse('archivos:ver_archivo_publico', args=[self.archivo.pk])
+
+    def test_304_sin_registrar_acceso(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        b''.join(response.streaming_content)
+
+        for encabezados in (
+            {'HTTP_IF_NONE_MATCH': response['ETag']},
+            {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']},
+        ):
+            with self.subTest(encabezados=encabezados):
+                no_modificado = self.client.get(self.url, **encabezados)
+                self.assertEqual(no_modificado.status_code, 304)
+                self.assertEqual(no_modificado['ETag'], response['ETag'])
+        # Solo la primera solicitud es un acceso; las revalidaciones no
+        self.assertEqual(HistorialAcceso.objects.count(), 1)
+
+    def test_etag_nuevo_al_reemplazar_el_archivo(self):
+        etag = self.client.get(self.url)['ETag']
+
+        self.client.force_login(self.usuario)
+        self.client.post(
+            reverse('archivos:editar_version', args=[self.archivo.fraccion_id, 2025, 'A', self.archivo.version]),
+            {'action': 'reemplazar', 'archivo_id': self.archivo.pk,
+             'nuevo_archivo_reemplazo': archivo_pdf('b.pdf', 'nuevo')},
+        )
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4\nnuevo')
+
+
+class ConsolidacionTests(TestCase):
+    """Consolidación incremental de HistorialAcceso en AccesoDiario (consolidacion.py)"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media):
+            self.archivo = Archivo.objects.create(
+                fraccion=Fraccion.objects.create(numero='I', nombre='Primera', tipo_usuario_asignado='transparencia'),
+                usuario=User.objects.create_user('capturista', password='x'),
+                archivo=archivo_pdf('a.pdf', 'a'), **PERIODO,
+            )
+        self.ayer = timezone.now() - timedelta(days=1)
+
+    def acceso(self, fecha):
+        return HistorialAcceso.objects.create(archivo=self.archivo, fecha_acceso=fecha, ip_address='10.0.0.1')
+
+    def totales(self):
+        return sum(AccesoDiario.objects.values_list('total', flat=True))
+
+    def test_dos_ejecuciones_no_cuentan_dos_veces(self):
+        for _ in range(3):
+            self.acceso(self.ayer)
+
+        consolidar_accesos()
+        resumen = consolidar_accesos()
+
+        self.assertEqual(self.totales(), 3)
+        self.assertEqual(resumen['bloques'], 0)
+
+    def test_registros_dentro_del_margen_en_la_siguiente_ejecucion(self):
+        self.acceso(self.ayer)
+        reciente = self.acceso(timezone.now())
+
+        consolidar_accesos(margen=timedelta(minutes=5))
+        self.assertEqual(self.totales(), 1)
+
+        # Pasado el margen, el registro reciente se suma una sola vez
+        HistorialAcceso.objects.filter(pk=reciente.pk).update(fecha_acceso=self.ayer)
+        consolidar_accesos(margen=timedelta(minutes=5))
+        consolidar_accesos(margen=timedelta(minutes=5))
+        self.assertEqual(self.totales(), 2)
+
+
+class PaginacionTests(TestCase):
+    """Paginación por cursor (paginacion.py)"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.usuario = User.objects.create_user('capturista', password='x')
+        PerfilUsuario.objects.create(user=self.usuario, tipo_usuario='transparencia')
+        self.fraccion = Fraccion.objects.create(numero='I', nombre='Primera', tipo_usuario_asignado='transparencia')
+        with override_settings(MEDIA_ROOT=media):
+            for indice in range(7):
+                Archivo.objects.create(
+                    fraccion=self.fraccion, usuario=self.usuario,
+                    archivo=archivo_pdf(f'{indice}.pdf', 'a'), **PERIODO,
+                )
+        # Misma fecha para todos: el orden lo decide el id
+        Archivo.objects.update(created_at=timezone.now())
+        self.esperados = list(Archivo.objects.order_by('-id').values_list('pk', flat=True))
+
+    def test_recorrer_paginas_con_fechas_repetidas(self):
+        paginas = [paginacion.paginar(Archivo.objects.all(), tamaño=3)]
+        while paginas[-1].has_next():
+            paginas.append(paginacion.paginar(Archivo.objects.all(), despues=paginas[-1].siguiente, tamaño=3))
+        self.assertEqual([archivo.pk for pagina in paginas for archivo in pagina], self.esperados)
+
+        # De regreso con ?antes= se obtienen las mismas páginas
+        anterior = paginacion.paginar(Archivo.objects.all(), antes=paginas[-1].anterior, tamaño=3)
+        self.assertEqual([archivo.pk for archivo in anterior], [archivo.pk for archivo in paginas[-2]])
+
+    def test_token_alterado(self):
+        token = paginacion.codificar_cursor(Archivo.objects.first())
+        for alterado in (token[:-2] + '!!', 'bm8tZXMtdW4tY3Vyc29y', token + 'x', ''):
+            with self.subTest(token=alterado):
+                self.assertIsNone(paginacion.decodificar_cursor(alterado))
+                pagina = paginacion.paginar(Archivo.objects.all(), despues=alterado, tamaño=3)
+                self.assertTrue(pagina.es_primera)
+                self.assertEqual([archivo.pk for archivo in pagina], self.esperados[:3])
+
+    def test_parcial_devuelve_el_fragmento(self):
+        self.client.force_login(self.usuario)
+        url = reverse('archivos:historial', args=[self.fraccion.pk])
+        with mock.patch.object(HistorialView, 'tamaño_pagina', 3):
+            primera = self.client.get(url)
+            response = self.client.get(url, {'despues': primera.context['page_obj'].siguiente, 'parcial': '1'})
+
+        self.assertEqual(response['Content-Type'], 'application/json')
+        datos = response.json()
+        self.assertEqual(set(datos), {'html', 'siguiente'})
+        self.assertIsNotNone(datos['siguiente'])
+        self.assertNotIn('<html', datos['html'])
+
+
+class ManejadorCargaTests(SimpleTestCase):
+    """Verificación de los archivos mientras se reciben (manejadores.py)"""
+
+    def archivos_recibidos(self, *archivos):
+        request = RequestFactory().post('/cargar/', {'archivo': list(archivos)})
+        request.upload_handlers = [ManejadorCargaVerificada(request)]
+        recibidos = request.FILES.getlist('archivo')
+        self.addCleanup(lambda: [archivo.close() for archivo in recibidos])
+        return recibidos, archivos_rechazados(request)
+
+    def test_rechazos(self):
+        casos = [
+            ('firma', SimpleUploadedFile('falso.pdf', b'MZ\x90\x00no es un pdf'), 'no corresponde a un archivo PDF'),
+            ('extension', SimpleUploadedFile('programa.exe', b'%PDF-1.4\n'), 'formato no permitido'),
+            ('tamaño', SimpleUploadedFile('grande.pdf', b'%PDF-1.4\n' + b'x' * 100), 'supera el límite'),
+        ]
+        for caso, archivo, motivo in casos:
+            with self.subTest(caso), mock.patch.object(manejadores, 'TAMAÑO_MAXIMO', 64):
+                recibidos, rechazados = self.archivos_recibidos(archivo, archivo_pdf('valido.pdf', 'ok'))
+                # Solo se descarta el archivo rechazado; el resto de la carga continúa
+                self.assertEqual([recibido.name for recibido in recibidos], ['valido.pdf'])
+                self.assertEqual(len(rechazados), 1)
+                self.assertIn(motivo, rechazados[0])
+
+    def test_sha256_del_archivo_aceptado(self):
+        contenido = b'%PDF-1.4\n' + os.urandom(200 * 1024)  # Varios bloques del parser
+        (recibido,), rechazados = self.archivos_recibidos(SimpleUploadedFile('informe.pdf', contenido))
+
+        self.assertEqual(rechazados, [])
+        self.assertEqual(recibido.sha256, hashlib.sha256(contenido).hexdigest())
+        self.assertEqual(recibido.tipo_detectado, 'pdf')
+        with open(recibido.temporary_file_path(), 'rb') as escrito:
+            self.assertEqual(escrito.read(), contenido)
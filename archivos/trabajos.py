@@ -0,0 +1,248 @@
+"""
+Exportaciones en segundo plano.
+
+Las exportaciones grandes no se generan dentro de la solicitud (nginx corta
+a los 60 s): la vista registra un TrabajoExportacion y el comando
+procesar_exportaciones lo toma, genera el libro reportando el avance en la
+fila del trabajo y deja el archivo en ARCHIVOS_EXPORTACIONES_DIR hasta
+expira_at. No hay broker: la tabla es la cola y los trabajos se reparten
+con select_for_update(skip_locked=True), así que pueden correr varios
+procesos del comando a la vez.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import cache_exportaciones, exportaciones
+from .models import PerfilUsuario, TrabajoExportacion
+
+logger = logging.getLogger(__name__)
+
+INTERVALO_AVANCE = 1.0  # segundos mínimos entre actualizaciones de `procesadas`
+INTERVALO_LATIDO = 60.0  # segundos entre latidos (updated_at) de un trabajo en proceso
+
+
+def _listado(usuario, parametros):
+    """(tipo de usuario, queryset del listado) para `usuario` con los filtros dados"""
+    try:
+        tipo_usuario = usuario.perfilusuario.tipo_usuario
+    except PerfilUsuario.DoesNotExist:
+        tipo_usuario = ''
+    return tipo_usuario, exportaciones.filtrar_listado(tipo_usuario, parametros)
+
+
+def huella_listado(usuario, parametros):
+    """Huella de caché del listado (cache_exportaciones.huella); [1] es el total de filas"""
+    return cache_exportaciones.huella(_listado(usuario, parametros)[1])
+
+
+def generar_xlsx(usuario, parametros, base_url, al_avanzar=None, procesos=1, huella_datos=None):
+    """
+    Libro del listado para `usuario` con los filtros dados, usando la caché
+    de exportaciones. Devuelve (archivo abierto, total de filas).
+
+    Con hojas=fraccion se genera una hoja por fracción, en `procesos`
+    procesos. `al_avanzar(procesadas)` se llama conforme se escriben filas.
+    `huella_datos` evita volver a calcular la huella si el llamador ya la
+    tiene (huella_listado).
+    """
+    tipo_usuario, queryset = _listado(usuario, parametros)
+    if huella_datos is None:
+        huella_datos = cache_exportaciones.huella(queryset)
+
+    # El libro incluye quién lo generó y cuándo: la entrada es del usuario y del día
+    clave = cache_exportaciones.clave(
+        'xlsx', tipo_usuario,
+        cache_exportaciones.filtros_normalizados(parametros),
+        huella_datos,
+        extra=[base_url, usuario.pk, timezone.localdate().isoformat()],
+    )
+    archivo = cache_exportaciones.obtener(clave, 'xlsx')
+    if archivo is not None:
+        logger.info("Exportación servida desde caché")
+        return archivo, huella_datos[1]
+
+    if parametros.get('hojas') == 'fraccion':
+        return cache_exportaciones.guardar(
+            clave, 'xlsx',
+            lambda destino: exportaciones.exportar_por_fraccion_xlsx(
+                destino, tipo_usuario, parametros, base_url,
+                exportaciones.informacion_reporte(usuario, parametros),
+                procesos=procesos, al_avanzar=al_avanzar,
+            ),
+        )
+
+    filas = exportaciones.filas_listado(queryset)
+    if al_avanzar:
+        filas = _con_avance(filas, al_avanzar)
+    return cache_exportaciones.guardar(
+        clave, 'xlsx',
+        lambda destino: exportaciones.exportar_listado_xlsx(
+            destino,
+            filas,
+            lambda archivo_id: f"{base_url}/publico/archivo/{archivo_id}/",
+            exportaciones.informacion_reporte(usuario, parametros),
+        ),
+    )
+
+
+def _con_avance(filas, al_avanzar):
+    procesadas = 0
+    ultimo = time.monotonic()
+    for fila in filas:
+        yield fila
+        procesadas += 1
+        if time.monotonic() - ultimo >= INTERVALO_AVANCE:
+            al_avanzar(procesadas)
+            ultimo = time.monotonic()
+    al_avanzar(procesadas)
+
+
+def crear_trabajo(usuario, parametros, base_url, total=0):
+    """
+    Registra una exportación para el worker.
+
+    Si el usuario ya tiene un trabajo pendiente o en proceso con los mismos
+    filtros se devuelve ese (recargar la página no encola otro).
+    """
+    filtros = cache_exportaciones.filtros_normalizados(parametros)
+    existente = TrabajoExportacion.objects.filter(
+        usuario=usuario,
+        estado__in=['pendiente', 'en_proceso'],
+        parametros=filtros,
+        base_url=base_url,
+    ).first()
+    if existente:
+        return existente
+    return TrabajoExportacion.objects.create(
+        usuario=usuario,
+        parametros=filtros,
+        base_url=base_url,
+        total=total,
+        nombre_archivo=f"{exportaciones.nombre_exportacion(filtros, total)}.xlsx",
+    )
+
+
+def _ruta_artefacto(trabajo):
+    return os.path.join(settings.ARCHIVOS_EXPORTACIONES_DIR, f'{trabajo.pk}.xlsx')
+
+
+def tomar_siguiente():
+    """Marca como en proceso el trabajo pendiente más antiguo y lo devuelve (o None)"""
+    with transaction.atomic():
+        trabajo = (
+            TrabajoExportacion.objects.select_for_update(skip_locked=True)
+            .filter(estado='pendiente')
+            .order_by('created_at')
+            .first()
+        )
+        if trabajo is None:
+            return None
+        trabajo.estado = 'en_proceso'
+        trabajo.save(update_fields=['estado', 'updated_at'])
+    return trabajo
+
+
+@contextmanager
+def _latido(trabajo):
+    """
+    Actualiza updated_at del trabajo cada INTERVALO_LATIDO segundos desde un
+    hilo mientras dura el bloque. El avance por filas no basta: con una hoja
+    por fracción solo se reporta al terminar cada hoja, que puede tardar más
+    que el plazo de reanudar_interrumpidos.
+    """
+    detener = threading.Event()
+
+    def latir():
+        try:
+            while not detener.wait(INTERVALO_LATIDO):
+                try:
+                    TrabajoExportacion.objects.filter(pk=trabajo.pk, estado='en_proceso').update(
+                        updated_at=timezone.now()
+                    )
+                except Exception:
+                    logger.exception("Falló el latido de la exportación %s", trabajo.pk)
+        finally:
+            connection.close()
+
+    hilo = threading.Thread(target=latir, name=f'latido-{trabajo.pk}', daemon=True)
+    hilo.start()
+    try:
+        yield
+    finally:
+        detener.set()
+        hilo.join()
+
+
+def procesar_trabajo(trabajo):
+    """Genera el archivo del trabajo; los errores quedan registrados en la fila"""
+    logger.info("Procesando exportación %s (%s)", trabajo.pk, trabajo.usuario.username)
+
+    def al_avanzar(procesadas):
+        TrabajoExportacion.objects.filter(pk=trabajo.pk).update(
+            procesadas=procesadas, updated_at=timezone.now()
+        )
+
+    try:
+        with _latido(trabajo):
+            archivo, total = generar_xlsx(
+                trabajo.usuario, trabajo.parametros, trabajo.base_url, al_avanzar,
+                procesos=settings.ARCHIVOS_EXPORTACION_PROCESOS,
+            )
+        os.makedirs(settings.ARCHIVOS_EXPORTACIONES_DIR, exist_ok=True)
+        ruta = _ruta_artefacto(trabajo)
+        with archivo:
+            # Copia propia: la entrada de caché puede desalojarse antes de la descarga
+            try:
+                os.link(archivo.name, ruta)
+            except OSError:
+                shutil.copyfile(archivo.name, ruta)
+    except Exception as e:
+        logger.exception("Falló la exportación %s", trabajo.pk)
+        trabajo.estado = 'error'
+        trabajo.error = str(e)
+        trabajo.save(update_fields=['estado', 'error', 'updated_at'])
+        return trabajo
+
+    trabajo.estado = 'completado'
+    trabajo.ruta = ruta
+    trabajo.total = trabajo.procesadas = total
+    trabajo.nombre_archivo = f"{exportaciones.nombre_exportacion(trabajo.parametros, total)}.xlsx"
+    trabajo.expira_at = timezone.now() + timedelta(hours=settings.ARCHIVOS_EXPORTACIONES_VIGENCIA_HORAS)
+    trabajo.save()
+    logger.info("Exportación %s lista: %s archivos", trabajo.pk, total)
+    return trabajo
+
+
+def reanudar_interrumpidos(minutos=10):
+    """
+    Devuelve a la cola los trabajos en proceso sin latido reciente (worker
+    detenido): mientras un worker genera el archivo, _latido mantiene
+    updated_at al día aunque no haya avance de filas.
+    """
+    limite = timezone.now() - timedelta(minutes=minutos)
+    return TrabajoExportacion.objects.filter(
+        estado='en_proceso', updated_at__lt=limite
+    ).update(estado='pendiente', procesadas=0, updated_at=timezone.now())
+
+
+def depurar_vencidos():
+    """Elimina los archivos de los trabajos vencidos y los marca como tales"""
+    vencidos = TrabajoExportacion.objects.filter(estado='completado', expira_at__lt=timezone.now())
+    total = 0
+    for trabajo in vencidos.iterator():
+        if trabajo.ruta and os.path.exists(trabajo.ruta):
+            os.remove(trabajo.ruta)
+        trabajo.estado = 'vencido'
+        trabajo.ruta = ''
+        trabajo.save(update_fields=['estado', 'ruta', 'updated_at'])
+        total += 1
+    return total
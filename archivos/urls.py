@@ -17,6 +17,10 @@ urlpatterns = [
     
     # Gestión de archivos (PRIVADAS - requieren autenticación)
     path('cargar/', views.CargarArchivoView.as_view(), name='cargar_archivo'),
+    path('cargas/', views.IniciarCargaView.as_view(), name='iniciar_carga'),
+    path('cargas/completar/', views.CompletarCargaView.as_view(), name='completar_carga'),
+    path('cargas/<uuid:sesion_id>/', views.EstadoCargaView.as_view(), name='estado_carga'),
+    path('cargas/<uuid:sesion_id>/bloques/<int:indice>/', views.BloqueCargaView.as_view(), name='bloque_carga'),
     path('listado/', views.ListadoArchivosView.as_view(), name='listado_archivos'),
     path('historial/<int:fraccion_id>/', views.HistorialView.as_view(), name='historial'),
     
@@ -33,6 +37,10 @@ urlpatterns = [
     
     # Estadísticas
     path('estadisticas/', views.EstadisticasView.as_view(), name='estadisticas'),
+    path('accesos/exportar/', views.ExportarAccesosView.as_view(), name='exportar_accesos'),
+    path('exportaciones/<uuid:trabajo_id>/', views.ExportacionView.as_view(), name='exportacion'),
+    path('exportaciones/<uuid:trabajo_id>/estado/', views.EstadoExportacionView.as_view(), name='estado_exportacion'),
+    path('exportaciones/<uuid:trabajo_id>/descargar/', views.DescargarExportacionView.as_view(), name='descargar_exportacion'),
     path('versiones/<int:fraccion_id>/', VersionesView.as_view(), name='versiones'),
     path('editar-version/<int:fraccion_id>/<int:año>/<str:periodo>/<int:version>/', EditarVersionView.as_view(), name='editar_version'),
 
@@ -0,0 +1,86 @@
+"""
+Verificación diferida de la integridad de los archivos almacenados.
+
+Las altas en lote (Archivo.objects.crear_en_lote) no tocan el disco. El
+comando verificar_archivos revisa después cada ContenidoArchivo no
+verificado: que el archivo exista en su ruta, que el tamaño y el SHA-256
+coincidan con los registrados y que la firma corresponda a la extensión. Al
+ir por contenido, un archivo que comparten muchas filas se lee una sola vez.
+
+Los contenidos recién creados se dejan MARGEN de espera: el archivo se mueve
+a su ruta al confirmarse la transacción de la carga (almacen.py).
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .manejadores import verificar_contenido
+from .models import ContenidoArchivo
+
+MARGEN = timedelta(minutes=1)
+TAMAÑO_LECTURA = 1024 * 1024
+
+
+def pendientes():
+    return ContenidoArchivo.objects.filter(
+        verificado_at__isnull=True, created_at__lt=timezone.now() - MARGEN
+    ).order_by('id')
+
+
+def verificar(contenido):
+    """Motivo por el que el contenido no está íntegro, o '' si lo está"""
+    digest = hashlib.sha256()
+    tamaño = 0
+    try:
+        with default_storage.open(contenido.ruta, 'rb') as archivo:
+            cabecera = archivo.read(16)
+            digest.update(cabecera)
+            tamaño = len(cabecera)
+            for parte in iter(lambda: archivo.read(TAMAÑO_LECTURA), b''):
+                digest.update(parte)
+                tamaño += len(parte)
+    except FileNotFoundError:
+        return 'El archivo no existe en el almacenamiento'
+    except OSError as e:
+        return f'No se pudo leer el archivo: {e}'
+
+    if tamaño != contenido.tamaño:
+        return f'Tamaño en disco ({tamaño} bytes) distinto del registrado ({contenido.tamaño} bytes)'
+    if digest.hexdigest() != contenido.sha256:
+        return 'El SHA-256 del archivo no coincide con el registrado'
+    return verificar_contenido(os.path.basename(contenido.ruta), cabecera) or ''
+
+
+def verificar_lote(limite=200):
+    """
+    Verifica hasta `limite` contenidos pendientes, varios a la vez
+    (ARCHIVOS_CARGA_HILOS hilos), y guarda el resultado con un bulk_update.
+    Devuelve [(contenido, motivo)].
+    """
+    lote = list(pendientes()[:limite])
+    if not lote:
+        return []
+    with ThreadPoolExecutor(max_workers=settings.ARCHIVOS_CARGA_HILOS) as pool:
+        motivos = list(pool.map(verificar, lote))
+
+    ahora = timezone.now()
+    for contenido, motivo in zip(lote, motivos):
+        contenido.verificado_at = ahora
+        contenido.integro = not motivo
+        contenido.error_verificacion = motivo
+    # Solo estos campos: las referencias pueden cambiar mientras tanto
+    ContenidoArchivo.objects.bulk_update(lote, ['verificado_at', 'integro', 'error_verificacion'])
+    return list(zip(lote, motivos))
+
+
+def reiniciar(solo_fallidos=False):
+    """Vuelve a dejar pendientes los contenidos (todos o solo los no íntegros)"""
+    contenidos = ContenidoArchivo.objects.exclude(verificado_at__isnull=True)
+    if solo_fallidos:
+        contenidos = contenidos.filter(integro=False)
+    return contenidos.update(verificado_at=None, integro=None, error_verificacion='')
@@ -4,24 +4,41 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.views.generic import TemplateView, ListView, CreateView
 from django.views import View
-from django.http import HttpResponse, Http404, FileResponse
+from django.http import HttpResponse, Http404, FileResponse, JsonResponse
 from django.urls import reverse_lazy
+from django.template.loader import render_to_string
 from django.db.models import Count, Q, Max
 from django.utils import timezone
 from django.db import transaction
 from django.core.exceptions import ValidationError
+import copy
 import json  # ✅ NUEVA IMPORTACIÓN
 import mimetypes
 import os
+import uuid
+from datetime import timedelta
 from django.core.files.base import ContentFile
 from django.utils._os import safe_join
 from django.conf import settings
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
 from pathlib import Path
-from .models import Archivo, Fraccion, PerfilUsuario, HistorialAcceso
-from .forms import ArchivoForm
+from .models import Archivo, HistorialAcceso, AccesoDiario, SesionCarga, TrabajoExportacion
+from .forms import ArchivoForm, SesionCargaForm
+from .descargas import respuesta_no_modificada, servir_archivo, solicita_continuacion
+from .bitacora import ip_cliente, registrar_acceso
+from . import busqueda, exportaciones, facetas, trabajos
+from . import cargas
+from .cargas import bloquear_periodo, crear_archivos_preparados, descartar_preparados, preparar_archivos, publicar_version
+from .manejadores import archivos_rechazados
+from .paginacion import PaginacionCursorMixin
+from .catalogo import catalogo
+
+
+def fraccion_o_404(fraccion_id):
+    """Fracción del catálogo en memoria o 404"""
+    fraccion = catalogo.por_id(fraccion_id)
+    if fraccion is None:
+        raise Http404("Fracción no encontrada")
+    return fraccion
 
 
 class DashboardView(LoginRequiredMixin, TemplateView):
@@ -31,32 +48,28 @@ class DashboardView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Obtener perfil del usuario
-        try:
-            perfil = self.request.user.perfilusuario
-            tipo_usuario = perfil.tipo_usuario
-        except PerfilUsuario.DoesNotExist:
-            tipo_usuario = None
+        # Perfil y fracciones del usuario (resueltos por AutorizacionMiddleware)
+        autorizacion = self.request.autorizacion
+        tipo_usuario = autorizacion.tipo_usuario
+        if not autorizacion.tiene_perfil:
             messages.warning(self.request, 'Tu usuario no tiene un perfil asignado. Contacta al administrador.')
         
         # Filtrar fracciones según el tipo de usuario
         if tipo_usuario:
-            fracciones = Fraccion.objects.filter(
-                tipo_usuario_asignado=tipo_usuario,
-                activa=True
-            )
+            fracciones = autorizacion.fracciones_activas()
         else:
-            fracciones = Fraccion.objects.filter(activa=True)
+            fracciones = [fraccion for fraccion in catalogo.todas() if fraccion.activa]
+        fracciones_ids = [fraccion.id for fraccion in fracciones]
         
         # Estadísticas básicas
         total_archivos = Archivo.objects.filter(
-            fraccion__in=fracciones,
+            fraccion_id__in=fracciones_ids,
             vigente=True
         ).count()
         
         archivos_recientes = Archivo.objects.filter(
-            fraccion__in=fracciones
-        ).order_by('-created_at')[:5]
+            fraccion_id__in=fracciones_ids
+        ).select_related('fraccion').order_by('-created_at')[:5]
         
         context.update({
             'fracciones': fracciones,
@@ -68,6 +81,21 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         return context
 
 
+def mensaje_carga_exitosa(request, archivos_creados, nueva_version):
+    """Mensaje de éxito común al formulario y a las cargas por bloques"""
+    if archivos_creados:
+        if len(archivos_creados) == 1:
+            messages.success(
+                request, 
+                f'<strong>¡Éxito!</strong> El archivo "{archivos_creados[0].nombre_original}" se cargó correctamente como <strong>versión {nueva_version}</strong>.'
+            )
+        else:
+            messages.success(
+                request, 
+                f'<strong>¡Éxito!</strong> Se cargaron {len(archivos_creados)} archivos como <strong>versión {nueva_version}</strong>.'
+            )
+
+
 class CargarArchivoView(LoginRequiredMixin, CreateView):
     """Vista para cargar archivos"""
     model = Archivo
@@ -78,6 +106,8 @@ class CargarArchivoView(LoginRequiredMixin, CreateView):
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs['user'] = self.request.user
+        # Se lee después de request.FILES (super) para que ya se haya procesado la carga
+        kwargs['archivos_rechazados'] = archivos_rechazados(self.request)
         return kwargs
 
     # ✅ NUEVO: Añadir opciones de periodo al contexto
@@ -106,12 +136,11 @@ class CargarArchivoView(LoginRequiredMixin, CreateView):
         print(f"Usuario: {self.request.user}")
     
         # Verificar perfil de usuario
-        try:
-            perfil = self.request.user.perfilusuario
-            print(f"Perfil usuario: {perfil.tipo_usuario}")
-        except PerfilUsuario.DoesNotExist:
+        autorizacion = self.request.autorizacion
+        if not autorizacion.tiene_perfil:
             messages.error(self.request, 'Tu usuario no tiene un perfil asignado. Contacta al administrador.')
             return self.form_invalid(form)
+        print(f"Perfil usuario: {autorizacion.tipo_usuario}")
     
         # Obtener múltiples archivos
         archivos_subidos = self.request.FILES.getlist('archivo')
@@ -124,128 +153,40 @@ class CargarArchivoView(LoginRequiredMixin, CreateView):
     
         # Verificar que la fracción corresponde al usuario
         fraccion = form.cleaned_data['fraccion']
-        if fraccion.tipo_usuario_asignado != perfil.tipo_usuario:
-            print(f"❌ Fracción no permitida para usuario: {fraccion.tipo_usuario_asignado} != {perfil.tipo_usuario}")
+        if not autorizacion.puede_fraccion(fraccion.id):
+            print(f"❌ Fracción no permitida para usuario: {fraccion.tipo_usuario_asignado} != {autorizacion.tipo_usuario}")
             messages.error(self.request, 'No tienes permisos para cargar archivos en esta fracción.')
             return self.form_invalid(form)
     
-        # PROCESAR CADA ARCHIVO
-        archivos_creados = []
-        archivos_con_error = []
-    
         # ✅ VALIDACIÓN PREVIA: Verificar nombres duplicados en la carga actual
         nombres_subidos = [f.name for f in archivos_subidos]
         if len(nombres_subidos) != len(set(nombres_subidos)):
             messages.error(self.request, '<strong>Carga detenida:</strong> No puedes subir dos archivos con el mismo nombre en la misma operación.', extra_tags='danger')
             return self.form_invalid(form)
 
-
-           # Usar transacción atómica para todos los archivos
+        # Versionado y guardado en una sola transacción (archivos/cargas.py)
         try:
-            with transaction.atomic():
-                # 🔥 PASO 1: Marcar archivos anteriores como no vigentes ANTES de crear nuevos
-                archivos_existentes = Archivo.objects.filter(
-                    fraccion=form.cleaned_data['fraccion'],
-                    año=form.cleaned_data['año'],
-                    periodo_especifico=form.cleaned_data['periodo_especifico'],
-                    vigente=True  # ← SOLO los que están vigentes
-                )
-
-                nueva_version = 1
-                if archivos_existentes.exists():
-                    ultima_version = archivos_existentes.aggregate(
-                        max_version=Max('version')
-                    )['max_version'] or 0
-                    nueva_version = ultima_version + 1
-                    print(f"📝 Nueva versión calculada: {nueva_version}")
-
-                    # ⚡ MARCAR COMO NO VIGENTES ANTES DE CREAR NUEVOS
-                    cantidad_marcados = archivos_existentes.update(vigente=False)
-                    print(f"🔄 {cantidad_marcados} archivos marcados como no vigentes")
-                else:
-                    print("📝 Primera versión para esta combinación")
-
-                # 🔥 PASO 2: CREAR TODOS LOS ARCHIVOS NUEVOS COMO VIGENTES
-                archivos_creados = []
-                archivos_con_error = []
-
-                for i, archivo_file in enumerate(archivos_subidos):
-                    print(f"\n--- Procesando archivo {i+1}/{len(archivos_subidos)}: {archivo_file.name} ---")
-
-                    try:
-                        # Validar cada archivo individualmente
-                        if archivo_file.size > 104857600:
-                            raise ValidationError(f'Archivo "{archivo_file.name}" muy grande: {archivo_file.size/1024/1024:.1f} MB')
-
-                        if archivo_file.size == 0:
-                            raise ValidationError(f'Archivo "{archivo_file.name}" está vacío')
-
-                        # Validar extensión
-                        extensiones_permitidas = ['.pdf', '.doc', '.docx', '.xls', '.xlsx']
-                        nombre_archivo = archivo_file.name.lower()
-                        if not any(nombre_archivo.endswith(ext) for ext in extensiones_permitidas):
-                            raise ValidationError(f'Archivo "{archivo_file.name}" tiene formato no permitido')
-
-                        # 🎯 CREAR ARCHIVO - TODOS VIGENTES
-                        archivo_instance = Archivo(
-                            fraccion=form.cleaned_data['fraccion'],
-                            usuario=self.request.user,
-                            tipo_periodo=form.cleaned_data['tipo_periodo'],
-                            año=form.cleaned_data['año'],
-                            periodo_especifico=form.cleaned_data['periodo_especifico'],
-                            archivo=archivo_file,
-                            nombre_original=archivo_file.name,
-                            tamaño=archivo_file.size,
-                            vigente=True,  # ✅ TODOS VIGENTES
-                            version=nueva_version  # ✅ MISMA VERSIÓN PARA TODOS
-                        )
-
-                        # Guardar archivo
-                        archivo_instance.save()
-                        archivos_creados.append(archivo_instance)
-
-                        print(f"✅ Archivo guardado como VIGENTE: {archivo_instance.nombre_original} (v{nueva_version})")
-
-                    except ValidationError as e:
-                        print(f"❌ Error validando {archivo_file.name}: {e}")
-                        archivos_con_error.append(f"{archivo_file.name}: {e}")
-                    except Exception as e:
-                        print(f"❌ Error inesperado con {archivo_file.name}: {e}")
-                        archivos_con_error.append(f"{archivo_file.name}: Error inesperado")
-
-                # Si hay errores, lanzar excepción para hacer rollback
-                if archivos_con_error:
-                    raise ValidationError("Errores en algunos archivos")
-
-                print(f"🎉 RESUMEN: {len(archivos_creados)} archivos creados como VIGENTES (versión {nueva_version})")
-
-        except Exception as e:
+            nueva_version, archivos_creados = publicar_version(
+                fraccion=fraccion,
+                usuario=self.request.user,
+                tipo_periodo=form.cleaned_data['tipo_periodo'],
+                año=form.cleaned_data['año'],
+                periodo_especifico=form.cleaned_data['periodo_especifico'],
+                archivos_subidos=archivos_subidos,
+            )
+        except ValidationError as e:
             print(f"❌ Error en transacción: {e}")
-        
             # Mostrar errores específicos
-            if archivos_con_error:
-                for error in archivos_con_error:
-                    messages.error(self.request, f"❌ {error}")
-            else:
-                messages.error(self.request, f'Error al guardar archivos: {e}')
-        
+            for error in e.messages:
+                messages.error(self.request, f"❌ {error}")
+            return self.form_invalid(form)
+        except Exception as e:
+            print(f"❌ Error en transacción: {e}")
+            messages.error(self.request, f'Error al guardar archivos: {e}')
             return self.form_invalid(form)
     
         # MOSTRAR RESULTADO EXITOSO
-        if archivos_creados:
-            if len(archivos_creados) == 1:
-                messages.success(
-                    self.request, 
-                    f'<strong>¡Éxito!</strong> El archivo "{archivos_creados[0].nombre_original}" se cargó correctamente como <strong>versión {nueva_version}</strong>.'
-                )
-            else:
-                messages.success(
-                    self.request, 
-                    f'<strong>¡Éxito!</strong> Se cargaron {len(archivos_creados)} archivos como <strong>versión {nueva_version}</strong>.'
-                )
-                # Mostrar lista de archivos cargados
-                # for archivo in archivos_creados:
-                #     messages.info(self.request, f"📁 {archivo.nombre_original}")
+        mensaje_carga_exitosa(self.request, archivos_creados, nueva_version)
     
         print(f"✅ Proceso completado: {len(archivos_creados)} archivos creados")
         print("=== FIN DEBUG MÚLTIPLES ARCHIVOS ===")
@@ -270,88 +211,159 @@ class CargarArchivoView(LoginRequiredMixin, CreateView):
         return super().form_invalid(form)
 
 
-class ListadoArchivosView(LoginRequiredMixin, ListView):
+# ✅ CARGA POR BLOQUES (REANUDABLE) PARA ARCHIVOS GRANDES
+def _estado_sesion(sesion):
+    recibidos = cargas.bloques_recibidos(sesion)
+    return {
+        'id': str(sesion.pk),
+        'nombre': sesion.nombre_original,
+        'estado': sesion.estado,
+        'tamaño': sesion.tamaño,
+        'tamaño_bloque': sesion.tamaño_bloque,
+        'total_bloques': sesion.total_bloques,
+        'recibidos': sorted(recibidos),
+        'faltantes': cargas.bloques_faltantes(sesion),
+    }
+
+
+class IniciarCargaView(LoginRequiredMixin, View):
+    """Crea una sesión de carga por bloques para un archivo"""
+
+    def post(self, request):
+        form = SesionCargaForm(request.POST, user=request.user)
+        if not form.is_valid():
+            print(f"❌ Sesión de carga inválida: {form.errors}")
+            return JsonResponse({'errores': form.errors}, status=400)
+
+        sesion = form.save(commit=False)
+        sesion.usuario = request.user
+        sesion.tamaño_bloque = settings.ARCHIVOS_CARGA_TAMAÑO_BLOQUE
+        sesion.save()
+        print(f"📦 Sesión de carga creada: {sesion.nombre_original} ({sesion.total_bloques} bloques)")
+        return JsonResponse(_estado_sesion(sesion), status=201)
+
+
+class EstadoCargaView(LoginRequiredMixin, View):
+    """Estado de una sesión (para reanudar) y cancelación"""
+
+    def get(self, request, sesion_id):
+        sesion = get_object_or_404(SesionCarga, pk=sesion_id, usuario=request.user)
+        return JsonResponse(_estado_sesion(sesion))
+
+    def delete(self, request, sesion_id):
+        sesion = get_object_or_404(SesionCarga, pk=sesion_id, usuario=request.user, estado='activa')
+        cargas.cancelar_carga(sesion)
+        return JsonResponse(_estado_sesion(sesion))
+
+
+class BloqueCargaView(LoginRequiredMixin, View):
+    """
+    Recibe un bloque en el cuerpo de la solicitud (application/octet-stream).
+
+    El cuerpo se lee por partes con request.read(), sin pasar por
+    request.body ni por los manejadores de carga, así que la memoria del
+    worker no depende del tamaño del bloque. La cabecera opcional
+    X-Checksum-SHA256 se verifica antes de aceptar el bloque.
+    """
+
+    def put(self, request, sesion_id, indice):
+        sesion = get_object_or_404(SesionCarga, pk=sesion_id, usuario=request.user)
+        if sesion.estado != 'activa':
+            return JsonResponse({'errores': [f'La sesión está {sesion.get_estado_display().lower()}']}, status=409)
+
+        try:
+            sha256 = cargas.guardar_bloque(
+                sesion, indice, request, request.headers.get('X-Checksum-SHA256', '')
+            )
+        except ValidationError as e:
+            print(f"❌ Bloque {indice} rechazado: {e}")
+            return JsonResponse({'errores': e.messages}, status=400)
+
+        return JsonResponse({'indice': indice, 'sha256': sha256})
+
+    post = put
+
+
+class CompletarCargaView(LoginRequiredMixin, View):
+    """Ensambla las sesiones indicadas y las publica como una nueva versión"""
+
+    def post(self, request):
+        try:
+            ids = [uuid.UUID(valor) for valor in request.POST.getlist('sesiones')]
+        except ValueError:
+            return JsonResponse({'errores': ['Identificador de sesión no válido.']}, status=400)
+        sesiones = list(
+            SesionCarga.objects.filter(pk__in=ids, usuario=request.user, estado='activa')
+            .select_related('fraccion')
+        )
+        if len(sesiones) != len(set(ids)):
+            return JsonResponse({'errores': ['Alguna sesión no existe o ya fue completada.']}, status=400)
+
+        # Respetar el orden en que el usuario seleccionó los archivos
+        sesiones.sort(key=lambda sesion: ids.index(sesion.pk))
+        try:
+            nueva_version, archivos_creados = cargas.completar_cargas(sesiones, request.user)
+        except ValidationError as e:
+            print(f"❌ Error completando carga: {e}")
+            return JsonResponse({'errores': e.messages}, status=400)
+
+        mensaje_carga_exitosa(request, archivos_creados, nueva_version)
+        print(f"✅ Carga por bloques completada: {len(archivos_creados)} archivos (v{nueva_version})")
+        return JsonResponse({
+            'version': nueva_version,
+            'archivos': [archivo.pk for archivo in archivos_creados],
+            'redirect': str(reverse_lazy('archivos:dashboard')),
+        })
+
+
+class ListadoArchivosView(LoginRequiredMixin, PaginacionCursorMixin, ListView):
     """Vista para listar archivos con exportación a Excel"""
     model = Archivo
     template_name = 'archivos/listado_archivos.html'
     context_object_name = 'archivos'
-    paginate_by = 20
+    tamaño_pagina = 20
     
     def get(self, request, *args, **kwargs):
         # VERIFICAR SI ES UNA SOLICITUD DE EXPORTACIÓN
-        if request.GET.get('export') == 'excel':
+        formato = request.GET.get('export')
+        if formato == 'excel':
             return self.exportar_excel(request)
+        if formato in exportaciones.FORMATOS_FLUJO:
+            return self.exportar_flujo(request, formato)
         
         return super().get(request, *args, **kwargs)
     
     def get_queryset(self):
         # Obtener perfil del usuario
-        try:
-            perfil = self.request.user.perfilusuario
-            tipo_usuario = perfil.tipo_usuario
-        except PerfilUsuario.DoesNotExist:
+        tipo_usuario = self.request.autorizacion.tipo_usuario
+        if not tipo_usuario:
             messages.warning(self.request, 'Tu usuario no tiene un perfil asignado.')
             return Archivo.objects.none()
-        
-        # Filtrar por tipo de usuario
-        queryset = Archivo.objects.filter(
-            fraccion__tipo_usuario_asignado=tipo_usuario
-        ).select_related('fraccion', 'usuario').order_by('-created_at')
-        
-        # FILTRO POR ESTADO (VIGENTE/HISTÓRICO/TODOS)
-        estado = self.request.GET.get('estado', 'vigente')  # Por defecto solo vigentes
-        
-        if estado == 'vigente':
-            queryset = queryset.filter(vigente=True)
-        elif estado == 'historico':
-            queryset = queryset.filter(vigente=False)
-        # Si estado == 'todos', no filtramos por vigente
-        
-        # Filtros adicionales
-        fraccion_id = self.request.GET.get('fraccion')
-        año = self.request.GET.get('año')
-        tipo_periodo = self.request.GET.get('tipo_periodo')
-        periodo_especifico = self.request.GET.get('periodo_especifico')
-        
-        if fraccion_id:
-            queryset = queryset.filter(fraccion_id=fraccion_id)
-        
-        if año:
-            queryset = queryset.filter(año=año)
-        if tipo_periodo:
-            queryset = queryset.filter(tipo_periodo=tipo_periodo)
-        if periodo_especifico:
-            queryset = queryset.filter(periodo_especifico=periodo_especifico)
-        
-        # Funcionalidad de búsqueda
-        busqueda = self.request.GET.get('busqueda')
-        if busqueda:
-            queryset = queryset.filter(
-                Q(nombre_original__icontains=busqueda) |
-                Q(fraccion__nombre__icontains=busqueda) |
-                Q(fraccion__numero__icontains=busqueda)
-            )
-        
+
+        # Filtros del listado (compartidos con las exportaciones en segundo plano)
+        queryset = exportaciones.filtrar_listado(tipo_usuario, self.request.GET)
+        # Con búsqueda, las páginas se ordenan por relevancia
+        queryset, self.campo_cursor = busqueda.anotar_rango(queryset, self.request.GET.get('busqueda'))
         return queryset
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
         # Obtener fracciones para filtros
-        try:
-            perfil = self.request.user.perfilusuario
-            tipo_usuario = perfil.tipo_usuario
-            fracciones = Fraccion.objects.filter(
-                tipo_usuario_asignado=tipo_usuario,
-                activa=True
-            )
-        except PerfilUsuario.DoesNotExist:
-            fracciones = Fraccion.objects.none()
-        
-        # Años disponibles
-        años = Archivo.objects.filter(
-            fraccion__in=fracciones
-        ).values_list('año', flat=True).distinct().order_by('-año')
+        tipo_usuario = self.request.autorizacion.tipo_usuario
+        fracciones = self.request.autorizacion.fracciones_activas()
+
+        # Conteos de cada opción de los filtros (una consulta agrupada, en caché)
+        conteos = facetas.obtener(tipo_usuario, self.request.GET) if tipo_usuario else {
+            'fraccion': {}, 'año': {}, 'tipo_periodo': {}, 'estado': {},
+        }
+        # Copias: las instancias del catálogo se comparten entre solicitudes
+        fracciones = [copy.copy(fraccion) for fraccion in fracciones]
+        for fraccion in fracciones:
+            fraccion.conteo = conteos['fraccion'].get(fraccion.id, 0)
+
+        # Años disponibles, con su conteo
+        años = sorted(conteos['año'].items(), reverse=True)
         
         # ✅ NUEVO: Opciones de periodo para el filtro
         periodo_opciones = {
@@ -375,6 +387,8 @@ class ListadoArchivosView(LoginRequiredMixin, ListView):
             'periodo_especifico_seleccionado': self.request.GET.get('periodo_especifico'),
             'periodo_opciones_json': json.dumps(periodo_opciones),
             'busqueda_actual': self.request.GET.get('busqueda', ''),
+            'conteos_tipo_periodo': conteos['tipo_periodo'],
+            'conteos_estado': conteos['estado'],
         })
         
         return context
@@ -382,230 +396,183 @@ class ListadoArchivosView(LoginRequiredMixin, ListView):
     def exportar_excel(self, request):
         """
         Exporta los archivos filtrados a un archivo Excel agrupado por fracción.
+
+        Hasta ARCHIVOS_EXPORTACION_DIRECTA_MAXIMO filas el libro se genera en
+        la solicitud (o sale de la caché de exportaciones); arriba de eso se
+        registra un trabajo para procesar_exportaciones y se redirige a la
+        página de avance, para no ocupar el worker web ni chocar con el
+        timeout del proxy.
         """
         print("📊 Iniciando exportación a Excel agrupada...")
+        base_url = f"{request.scheme}://{request.get_host()}"
+
+        # Una sola agregación: da el total y la huella de la caché
+        huella = trabajos.huella_listado(request.user, request.GET)
+        total = huella[1]
+        if total > settings.ARCHIVOS_EXPORTACION_DIRECTA_MAXIMO:
+            trabajo = trabajos.crear_trabajo(request.user, request.GET, base_url, total)
+            print(f"⏳ Exportación de {total} archivos enviada a segundo plano: {trabajo.pk}")
+            return redirect('archivos:exportacion', trabajo_id=trabajo.pk)
+
+        archivo, total = trabajos.generar_xlsx(request.user, request.GET, base_url, huella_datos=huella)
+        print(f"📁 Archivos exportados: {total}")
+
+        return FileResponse(
+            archivo,
+            as_attachment=True,
+            filename=f"{exportaciones.nombre_exportacion(request.GET, total)}.xlsx",
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
 
-        queryset = self.get_queryset().order_by(
-            'fraccion__numero',
-            'año',
-            'periodo_especifico',
-            '-created_at'
+    def exportar_flujo(self, request, formato):
+        """Exporta los archivos filtrados como CSV o JSON Lines en flujo (gzip=1 para comprimir)"""
+        print(f"📤 Exportación en flujo del listado: {formato}")
+        base_url = f"{request.scheme}://{request.get_host()}"
+        filas = exportaciones.con_enlace_publico(
+            exportaciones.filas_listado(self.get_queryset()),
+            lambda archivo_id: f"{base_url}/publico/archivo/{archivo_id}/",
+        )
+        return exportaciones.respuesta_flujo(
+            filas, exportaciones.COLUMNAS_LISTADO, formato,
+            exportaciones.nombre_exportacion(request.GET),
+            comprimir=request.GET.get('gzip') == '1',
         )
 
-        tipo_usuario_display = self._get_tipo_usuario_display(request)
-        wb, ws, styles = self._crear_workbook()
-        row_num = self._escribir_encabezados(ws, styles)
-        row_num = self._escribir_datos_archivos(ws, queryset, request, row_num, styles)
-        self._ajustar_ancho_columnas(ws)
-        info_row = self._agregar_informacion_reporte(ws, request, queryset, tipo_usuario_display, row_num)
-        self._agregar_estadisticas_fracciones(ws, queryset, info_row)
 
-        response = self._preparar_respuesta_excel(request, queryset, wb)
-        print(f"📁 Fracciones incluidas: {len(set(a.fraccion.numero for a in queryset))}")
+class ExportacionView(LoginRequiredMixin, TemplateView):
+    """Avance de una exportación en segundo plano y enlace de descarga"""
+    template_name = 'archivos/exportacion.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        trabajo = get_object_or_404(TrabajoExportacion, pk=kwargs['trabajo_id'], usuario=self.request.user)
+        context.update({
+            'trabajo': trabajo,
+            'trabajos_recientes': TrabajoExportacion.objects.filter(
+                usuario=self.request.user
+            ).exclude(pk=trabajo.pk)[:10],
+        })
+        return context
 
-        return response
 
-    def _get_tipo_usuario_display(self, request):
+class EstadoExportacionView(LoginRequiredMixin, View):
+    """Estado de la exportación en JSON (consultado periódicamente por la página de avance)"""
+
+    def get(self, request, trabajo_id):
+        trabajo = get_object_or_404(TrabajoExportacion, pk=trabajo_id, usuario=request.user)
+        return JsonResponse({
+            'estado': trabajo.estado,
+            'estado_display': trabajo.get_estado_display(),
+            'procesadas': trabajo.procesadas,
+            'total': trabajo.total,
+            'porcentaje': trabajo.porcentaje,
+            'error': trabajo.error,
+            'descarga': (
+                str(reverse_lazy('archivos:descargar_exportacion', kwargs={'trabajo_id': trabajo.pk}))
+                if trabajo.disponible else None
+            ),
+        })
+
+
+class DescargarExportacionView(LoginRequiredMixin, View):
+    """Descarga el archivo generado mientras no haya expirado"""
+
+    def get(self, request, trabajo_id):
+        trabajo = get_object_or_404(TrabajoExportacion, pk=trabajo_id, usuario=request.user)
+        if not trabajo.disponible or not os.path.exists(trabajo.ruta):
+            raise Http404("La exportación no está disponible o ya expiró")
+        return FileResponse(
+            open(trabajo.ruta, 'rb'),
+            as_attachment=True,
+            filename=trabajo.nombre_archivo,
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+
+
+class ExportarAccesosView(LoginRequiredMixin, View):
+    """
+    Exporta HistorialAcceso de las fracciones del usuario como CSV o JSON Lines.
+
+    Parámetros: formato (csv|jsonl), desde/hasta (AAAA-MM-DD), fraccion,
+    publico (1|0) y gzip=1. Las filas se leen con cursor del servidor y se
+    envían en flujo, así que millones de registros no se acumulan en memoria.
+    """
+
+    def get_queryset(self):
+        autorizacion = self.request.autorizacion
+        if not autorizacion.tiene_perfil:
+            return HistorialAcceso.objects.none()
+
+        queryset = HistorialAcceso.objects.filter(
+            archivo__fraccion_id__in=autorizacion.fracciones_ids
+        )
+        parametros = self.request.GET
+        if parametros.get('desde'):
+            queryset = queryset.filter(fecha_acceso__date__gte=parametros['desde'])
+        if parametros.get('hasta'):
+            queryset = queryset.filter(fecha_acceso__date__lte=parametros['hasta'])
+        if parametros.get('fraccion'):
+            queryset = queryset.filter(archivo__fraccion_id=parametros['fraccion'])
+        if parametros.get('publico') in ('0', '1'):
+            queryset = queryset.filter(es_acceso_publico=parametros['publico'] == '1')
+        return queryset
+
+    def get(self, request):
+        formato = request.GET.get('formato', 'csv')
+        if formato not in exportaciones.FORMATOS_FLUJO:
+            raise Http404("Formato de exportación no disponible")
+
         try:
-            perfil = request.user.perfilusuario
-            return perfil.get_tipo_usuario_display()
-        except PerfilUsuario.DoesNotExist:
-            return "Usuario"
-
-    def _crear_workbook(self):
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Archivos Artículo 65"
-        styles = {
-            'header_font': Font(bold=True, color="FFFFFF", size=12),
-            'header_fill': PatternFill(start_color="366092", end_color="366092", fill_type="solid"),
-            'header_alignment': Alignment(horizontal="center", vertical="center"),
-            'fraccion_font': Font(bold=True, color="FFFFFF", size=11),
-            'fraccion_fill': PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid"),
-            'border': Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-        }
-        return wb, ws, styles
-
-    def _escribir_encabezados(self, ws, styles):
-        headers = [
-            'Número',
-            'Fracción',
-            'Año',
-            'Tipo Periodo',
-            'Archivo',
-            'Fecha Carga',
-            'Enlace Público'
-        ]
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = styles['header_font']
-            cell.fill = styles['header_fill']
-            cell.alignment = styles['header_alignment']
-            cell.border = styles['border']
-        return 2
-
-    def _escribir_datos_archivos(self, ws, queryset, request, row_num, styles):
-        current_fraccion = None
-        headers_len = 7
-        for archivo in queryset:
-            if current_fraccion != archivo.fraccion.numero:
-                if current_fraccion is not None:
-                    row_num += 1
-                ws.merge_cells(f'A{row_num}:G{row_num}')
-                title_cell = ws.cell(row=row_num, column=1,
-                                    value=f"FRACCIÓN {archivo.fraccion.numero} - {archivo.fraccion.nombre}")
-                title_cell.font = styles['fraccion_font']
-                title_cell.fill = styles['fraccion_fill']
-                title_cell.alignment = Alignment(horizontal="center", vertical="center")
-                for col in range(1, headers_len + 1):
-                    ws.cell(row=row_num, column=col).border = styles['border']
-                row_num += 1
-                current_fraccion = archivo.fraccion.numero
-
-            enlace_publico = f"{request.scheme}://{request.get_host()}/publico/archivo/{archivo.id}/"
-            row_data = [
-                archivo.fraccion.numero,
-                archivo.fraccion.nombre,
-                archivo.año,
-                archivo.get_tipo_periodo_display(),
-                archivo.nombre_original,
-                archivo.created_at.strftime("%d/%m/%Y %H:%M"),
-                enlace_publico
-            ]
-            for col, value in enumerate(row_data, 1):
-                cell = ws.cell(row=row_num, column=col, value=value)
-                cell.border = styles['border']
-                if archivo.vigente:
-                    cell.fill = PatternFill(start_color="E8F5E8", end_color="E8F5E8", fill_type="solid")
-                else:
-                    cell.fill = PatternFill(start_color="F5F5F5", end_color="F5F5F5", fill_type="solid")
-            row_num += 1
-        return row_num
-
-    def _ajustar_ancho_columnas(self, ws):
-        column_widths = [
-            12,  # Número
-            45,  # Fracción
-            10,  # Año
-            15,  # Tipo Periodo
-            40,  # Archivo
-            18,  # Fecha Carga
-            55   # Enlace Público
-        ]
-        for col, width in enumerate(column_widths, 1):
-            ws.column_dimensions[get_column_letter(col)].width = width
-
-    def _agregar_informacion_reporte(self, ws, request, queryset, tipo_usuario_display, row_num):
-        info_row = row_num + 3
-        ws.merge_cells(f'A{info_row}:C{info_row}')
-        info_title = ws.cell(row=info_row, column=1, value="INFORMACIÓN DEL REPORTE")
-        info_title.font = Font(bold=True, size=11)
-        info_title.fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-        info_row += 1
-
-        info_data = [
-            ("Reporte generado por:", f"{request.user.get_full_name() or request.user.username}"),
-            ("Fecha de generación:", timezone.now().strftime("%d/%m/%Y %H:%M")),
-            ("Tipo de usuario:", tipo_usuario_display),
-            ("Total de archivos:", queryset.count()),
-        ]
-        filtros_info = []
-        if request.GET.get('fraccion'):
-            try:
-                fraccion = Fraccion.objects.get(id=request.GET.get('fraccion'))
-                filtros_info.append(f"Fracción: {fraccion.numero} - {fraccion.nombre}")
-            except Fraccion.DoesNotExist:
-                pass
-        if request.GET.get('año'):
-            filtros_info.append(f"Año: {request.GET.get('año')}")
-        if request.GET.get('tipo_periodo'):
-            filtros_info.append(f"Tipo Periodo: {request.GET.get('tipo_periodo').capitalize()}")
-        if request.GET.get('periodo_especifico'):
-            filtros_info.append(f"Periodo Específico: {request.GET.get('periodo_especifico')}")
-        if request.GET.get('estado'):
-            estado = request.GET.get('estado')
-            filtros_info.append(f"Estado: {estado.capitalize()}")
-        if request.GET.get('busqueda'):
-            filtros_info.append(f"Búsqueda: {request.GET.get('busqueda')}")
-        if filtros_info:
-            info_data.append(("Filtros aplicados:", " | ".join(filtros_info)))
-        for label, value in info_data:
-            ws.cell(row=info_row, column=1, value=label).font = Font(bold=True)
-            ws.cell(row=info_row, column=2, value=str(value))
-            info_row += 1
-        return info_row
-
-    def _agregar_estadisticas_fracciones(self, ws, queryset, info_row):
-        if queryset.count() > 0:
-            stats_fraccion = queryset.values('fraccion__numero', 'fraccion__nombre').annotate(
-                total=Count('id')
-            ).order_by('fraccion__numero')
-            if len(stats_fraccion) > 1:
-                info_row += 1
-                ws.cell(row=info_row, column=1, value="ARCHIVOS POR FRACCIÓN:").font = Font(bold=True)
-                info_row += 1
-                for stat in stats_fraccion:
-                    ws.cell(row=info_row, column=1, value=f"Fracción {stat['fraccion__numero']}:")
-                    ws.cell(row=info_row, column=2, value=f"{stat['total']} archivo(s)")
-                    info_row += 1
-
-    def _preparar_respuesta_excel(self, request, queryset, wb):
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            filas = exportaciones.filas_historial(self.get_queryset())
+        except (ValidationError, ValueError):
+            # Fechas o fracción con formato inválido
+            raise Http404("Parámetros de exportación no válidos")
+
+        print(f"📤 Exportación de accesos: {formato} ({request.user})")
+        nombre = f"Accesos_Articulo65_{timezone.now().strftime('%Y%m%d_%H%M')}"
+        return exportaciones.respuesta_flujo(
+            filas, exportaciones.COLUMNAS_HISTORIAL, formato, nombre,
+            comprimir=request.GET.get('gzip') == '1',
         )
-        fecha_actual = timezone.now().strftime("%Y%m%d_%H%M")
-        filtro_str = ""
-        if request.GET.get('año'):
-            filtro_str += f"_{request.GET.get('año')}"
-        if request.GET.get('fraccion'):
-            try:
-                fraccion = Fraccion.objects.get(id=request.GET.get('fraccion'))
-                filtro_str += f"_Frac{fraccion.numero}"
-            except Fraccion.DoesNotExist:
-                pass
-        elif queryset.count() > 0:
-            filtro_str += "_TodasFracciones"
-        filename = f"Archivos_Articulo65{filtro_str}_{fecha_actual}.xlsx"
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        wb.save(response)
-        return response
-
-
-class HistorialView(LoginRequiredMixin, ListView):
-    """Vista para mostrar historial de una fracción"""
+
+
+class HistorialView(LoginRequiredMixin, PaginacionCursorMixin, ListView):
+    """Vista para mostrar historial de una fracción (por páginas, con "Cargar más")"""
     model = Archivo
     template_name = 'archivos/historial.html'
     context_object_name = 'archivos'
+    tamaño_pagina = 50
+    
+    def render_to_response(self, context, **response_kwargs):
+        # "Cargar más": solo los elementos nuevos de la línea de tiempo
+        if self.request.GET.get('parcial') == '1':
+            pagina = context['page_obj']
+            return JsonResponse({
+                'html': render_to_string('archivos/historial_items.html', context, request=self.request),
+                'siguiente': pagina.siguiente,
+            })
+        return super().render_to_response(context, **response_kwargs)
     
     def get_queryset(self):
         fraccion_id = self.kwargs['fraccion_id']
         
-        # Verificar permisos
-        try:
-            perfil = self.request.user.perfilusuario
-            fraccion = get_object_or_404(Fraccion, id=fraccion_id)
-            
-            if fraccion.tipo_usuario_asignado != perfil.tipo_usuario:
-                messages.error(self.request, 'No tienes permisos para ver el historial de esta fracción.')
-                return Archivo.objects.none()
-                
-        except PerfilUsuario.DoesNotExist:
+        # Verificar permisos (la fracción inexistente da 404 en get_context_data)
+        autorizacion = self.request.autorizacion
+        if not autorizacion.tiene_perfil:
             messages.error(self.request, 'Tu usuario no tiene un perfil asignado.')
             return Archivo.objects.none()
+        if not autorizacion.puede_fraccion(fraccion_id):
+            messages.error(self.request, 'No tienes permisos para ver el historial de esta fracción.')
+            return Archivo.objects.none()
         
         return Archivo.objects.filter(
             fraccion_id=fraccion_id
-        ).order_by('-created_at')
+        ).select_related('usuario').order_by('-created_at')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         fraccion_id = self.kwargs['fraccion_id']
-        context['fraccion'] = get_object_or_404(Fraccion, id=fraccion_id)
+        context['fraccion'] = fraccion_o_404(fraccion_id)
         return context
 
 
@@ -616,32 +583,34 @@ class DescargarArchivoView(LoginRequiredMixin, View):
         archivo = get_object_or_404(Archivo, id=archivo_id)
         
         # Verificar permisos
-        try:
-            perfil = request.user.perfilusuario
-            if archivo.fraccion.tipo_usuario_asignado != perfil.tipo_usuario:
-                raise Http404("No tienes permisos para acceder a este archivo")
-        except PerfilUsuario.DoesNotExist:
+        if not request.autorizacion.tiene_perfil:
             raise Http404("Tu usuario no tiene un perfil asignado")
+        if not request.autorizacion.puede_archivo(archivo):
+            raise Http404("No tienes permisos para acceder a este archivo")
         
-        # Registrar acceso
-        try:
-            HistorialAcceso.objects.create(
-                archivo=archivo,
-                usuario=request.user,
-                ip_address=self.get_client_ip(request)
-            )
-        except Exception as e:
-            print(f"Error al registrar acceso: {e}")
+        # Copia del cliente vigente: 304 sin abrir el archivo ni registrar otro acceso
+        no_modificado = respuesta_no_modificada(request, archivo)
+        if no_modificado is not None:
+            return no_modificado
+        
+        # Registrar acceso (las continuaciones de un rango no cuentan como acceso nuevo)
+        if not solicita_continuacion(request):
+            try:
+                registrar_acceso(archivo, request, usuario=request.user)
+            except Exception as e:
+                print(f"Error al registrar acceso: {e}")
         
         # Servir archivo
         try:
             if archivo.archivo and archivo.archivo.name:
                 file_path = safe_join(settings.MEDIA_ROOT, archivo.archivo.name)
                 if os.path.exists(file_path):
-                    response = FileResponse(
-                        open(file_path, 'rb'),
+                    response = servir_archivo(
+                        request,
+                        file_path,
                         as_attachment=True,
-                        filename=archivo.nombre_original
+                        filename=archivo.nombre_original,
+                        archivo=archivo
                     )
                     return response
                 else:
@@ -653,12 +622,7 @@ class DescargarArchivoView(LoginRequiredMixin, View):
             raise Http404("Error al acceder al archivo")
     
     def get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0].strip()
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip or '0.0.0.0'
+        return ip_cliente(request)
 
 
 class VerArchivoView(LoginRequiredMixin, View):
@@ -668,22 +632,22 @@ class VerArchivoView(LoginRequiredMixin, View):
         archivo = get_object_or_404(Archivo, id=archivo_id)
         
         # Verificar permisos (mismo código que DescargarArchivoView)
-        try:
-            perfil = request.user.perfilusuario
-            if archivo.fraccion.tipo_usuario_asignado != perfil.tipo_usuario:
-                raise Http404("No tienes permisos para acceder a este archivo")
-        except PerfilUsuario.DoesNotExist:
+        if not request.autorizacion.tiene_perfil:
             raise Http404("Tu usuario no tiene un perfil asignado")
+        if not request.autorizacion.puede_archivo(archivo):
+            raise Http404("No tienes permisos para acceder a este archivo")
         
-        # Registrar acceso
-        try:
-            HistorialAcceso.objects.create(
-                archivo=archivo,
-                usuario=request.user,
-                ip_address=self.get_client_ip(request)
-            )
-        except Exception as e:
-            print(f"Error al registrar acceso: {e}")
+        # Copia del cliente vigente: 304 sin abrir el archivo ni registrar otro acceso
+        no_modificado = respuesta_no_modificada(request, archivo)
+        if no_modificado is not None:
+            return no_modificado
+        
+        # Registrar acceso (las continuaciones de un rango no cuentan como acceso nuevo)
+        if not solicita_continuacion(request):
+            try:
+                registrar_acceso(archivo, request, usuario=request.user)
+            except Exception as e:
+                print(f"Error al registrar acceso: {e}")
         
         # Servir archivo para visualización
         try:
@@ -691,9 +655,11 @@ class VerArchivoView(LoginRequiredMixin, View):
                 file_path = safe_join(settings.MEDIA_ROOT, archivo.archivo.name)
                 if os.path.exists(file_path):
                     content_type, _ = mimetypes.guess_type(file_path)
-                    response = FileResponse(
-                        open(file_path, 'rb'),
-                        content_type=content_type
+                    response = servir_archivo(
+                        request,
+                        file_path,
+                        content_type=content_type,
+                        archivo=archivo
                     )
                     return response
                 else:
@@ -705,12 +671,7 @@ class VerArchivoView(LoginRequiredMixin, View):
             raise Http404("Error al acceder al archivo")
     
     def get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0].strip()
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip or '0.0.0.0'
+        return ip_cliente(request)
 
 
 class EstadisticasView(LoginRequiredMixin, TemplateView):
@@ -721,11 +682,8 @@ class EstadisticasView(LoginRequiredMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         
         # Obtener tipo de usuario
-        try:
-            perfil = self.request.user.perfilusuario
-            tipo_usuario = perfil.tipo_usuario
-        except PerfilUsuario.DoesNotExist:
-            tipo_usuario = None
+        tipo_usuario = self.request.autorizacion.tipo_usuario
+        if not tipo_usuario:
             messages.warning(self.request, 'Tu usuario no tiene un perfil asignado.')
         
         if tipo_usuario:
@@ -746,10 +704,19 @@ class EstadisticasView(LoginRequiredMixin, TemplateView):
                 total=Count('id')
             ).order_by('año')
             
+            # Accesos de los últimos 30 días (tabla consolidada, no el historial crudo)
+            accesos = AccesoDiario.objects.filter(
+                archivo__fraccion__tipo_usuario_asignado=tipo_usuario
+            )
+            desde = timezone.localdate() - timedelta(days=30)
+            mas_consultados = accesos.mas_consultados(desde=desde, limite=10)
+            
             context.update({
                 'stats_fraccion': stats_fraccion,
                 'stats_año': stats_año,
                 'tipo_usuario': tipo_usuario,
+                'mas_consultados': mas_consultados,
+                'accesos_por_dia': accesos.por_dia(desde=desde),
             })
         
         return context
@@ -765,15 +732,17 @@ class VerArchivoPublicoView(View):
         print(f"👤 IP: {self.get_client_ip(request)}")
         print(f"🌐 User Agent: {request.META.get('HTTP_USER_AGENT', 'No disponible')}")
         
+        # Copia del cliente vigente: 304 sin abrir el archivo ni registrar otro acceso
+        no_modificado = respuesta_no_modificada(request, archivo, publico=True)
+        if no_modificado is not None:
+            return no_modificado
+        
         # Registrar acceso público (usuario anónimo)
-        try:
-            HistorialAcceso.objects.create(
-                archivo=archivo,
-                usuario=None,  # Usuario anónimo
-                ip_address=self.get_client_ip(request)
-            )
-        except Exception as e:
-            print(f"⚠️ Error registrando acceso público: {e}")
+        if not solicita_continuacion(request):
+            try:
+                registrar_acceso(archivo, request, es_acceso_publico=True)  # Usuario anónimo
+            except Exception as e:
+                print(f"⚠️ Error registrando acceso público: {e}")
         
         # Servir archivo para visualización
         try:
@@ -785,10 +754,13 @@ class VerArchivoPublicoView(View):
                     print(f"✅ Sirviendo archivo: {file_path}")
                     print(f"📄 Content-Type: {content_type}")
                     
-                    response = FileResponse(
-                        open(file_path, 'rb'),
+                    response = servir_archivo(
+                        request,
+                        file_path,
                         content_type=content_type,
-                        filename=archivo.nombre_original
+                        filename=archivo.nombre_original,
+                        archivo=archivo,
+                        publico=True
                     )
                     
                     # Headers adicionales para mejor experiencia
@@ -808,12 +780,7 @@ class VerArchivoPublicoView(View):
             raise Http404("Error al acceder al archivo")
     
     def get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0].strip()
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip or '0.0.0.0'
+        return ip_cliente(request)
 
 
 class DescargarArchivoPublicoView(View):
@@ -825,15 +792,17 @@ class DescargarArchivoPublicoView(View):
         print(f"⬇️ Descarga pública de archivo: {archivo.nombre_original}")
         print(f"👤 IP: {self.get_client_ip(request)}")
         
+        # Copia del cliente vigente: 304 sin abrir el archivo ni registrar otro acceso
+        no_modificado = respuesta_no_modificada(request, archivo, publico=True)
+        if no_modificado is not None:
+            return no_modificado
+        
         # Registrar acceso público
-        try:
-            HistorialAcceso.objects.create(
-                archivo=archivo,
-                usuario=None,  # Usuario anónimo
-                ip_address=self.get_client_ip(request)
-            )
-        except Exception as e:
-            print(f"⚠️ Error registrando descarga pública: {e}")
+        if not solicita_continuacion(request):
+            try:
+                registrar_acceso(archivo, request, es_acceso_publico=True)  # Usuario anónimo
+            except Exception as e:
+                print(f"⚠️ Error registrando descarga pública: {e}")
         
         # Servir archivo para descarga
         try:
@@ -842,15 +811,16 @@ class DescargarArchivoPublicoView(View):
                 if os.path.exists(file_path):
                     print(f"✅ Descargando archivo: {file_path}")
                     
-                    response = FileResponse(
-                        open(file_path, 'rb'),
+                    # Content-Length lo calcula servir_archivo según el rango solicitado
+                    response = servir_archivo(
+                        request,
+                        file_path,
                         as_attachment=True,
-                        filename=archivo.nombre_original
+                        filename=archivo.nombre_original,
+                        archivo=archivo,
+                        publico=True
                     )
                     
-                    # Headers adicionales
-                    response['Content-Length'] = archivo.tamaño
-                    
                     return response
                 else:
                     print(f"❌ Archivo físico no encontrado para descarga: {file_path}")
@@ -864,12 +834,7 @@ class DescargarArchivoPublicoView(View):
             raise Http404("Error al descargar el archivo")
     
     def get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0].strip()
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip or '0.0.0.0'
+        return ip_cliente(request)
     
 
 
@@ -882,18 +847,14 @@ class VersionesView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         fraccion_id = self.kwargs['fraccion_id']
         
-        # Verificar permisos
-        try:
-            perfil = self.request.user.perfilusuario
-            fraccion = get_object_or_404(Fraccion, id=fraccion_id)
-            
-            if fraccion.tipo_usuario_asignado != perfil.tipo_usuario:
-                messages.error(self.request, 'No tienes permisos para ver las versiones de esta fracción.')
-                return Archivo.objects.none()
-                
-        except PerfilUsuario.DoesNotExist:
+        # Verificar permisos (la fracción inexistente da 404 en get_context_data)
+        autorizacion = self.request.autorizacion
+        if not autorizacion.tiene_perfil:
             messages.error(self.request, 'Tu usuario no tiene un perfil asignado.')
             return Archivo.objects.none()
+        if not autorizacion.puede_fraccion(fraccion_id):
+            messages.error(self.request, 'No tienes permisos para ver las versiones de esta fracción.')
+            return Archivo.objects.none()
         
         # Obtener versiones agrupadas
         versiones = Archivo.objects.filter(
@@ -911,7 +872,7 @@ class VersionesView(LoginRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         fraccion_id = self.kwargs['fraccion_id']
-        context['fraccion'] = get_object_or_404(Fraccion, id=fraccion_id)
+        context['fraccion'] = fraccion_o_404(fraccion_id)
         return context
 
 
@@ -930,17 +891,14 @@ class EditarVersionView(LoginRequiredMixin, TemplateView):
         version = self.kwargs['version']
         
         # Verificar permisos
-        try:
-            perfil = self.request.user.perfilusuario
-            fraccion = get_object_or_404(Fraccion, id=fraccion_id)
-            
-            if fraccion.tipo_usuario_asignado != perfil.tipo_usuario:
-                messages.error(self.request, 'No tienes permisos para editar esta versión.')
-                return context
-                
-        except PerfilUsuario.DoesNotExist:
+        autorizacion = self.request.autorizacion
+        fraccion = fraccion_o_404(fraccion_id)
+        if not autorizacion.tiene_perfil:
             messages.error(self.request, 'Tu usuario no tiene un perfil asignado.')
             return context
+        if not autorizacion.puede_fraccion(fraccion_id):
+            messages.error(self.request, 'No tienes permisos para editar esta versión.')
+            return context
         
         # Obtener archivos de la versión
         archivos = Archivo.objects.filter(
@@ -988,6 +946,11 @@ class EditarVersionView(LoginRequiredMixin, TemplateView):
         archivo_id = request.POST.get('archivo_id')
         nuevo_archivo_reemplazo = request.FILES.get('nuevo_archivo_reemplazo')
 
+        if archivos_rechazados(request):
+            for motivo in archivos_rechazados(request):
+                messages.error(request, motivo)
+            return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
+
         if not archivo_id or not nuevo_archivo_reemplazo:
             messages.error(request, 'Datos incompletos para reemplazar el archivo.')
             return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
@@ -996,8 +959,7 @@ class EditarVersionView(LoginRequiredMixin, TemplateView):
             archivo_a_reemplazar = get_object_or_404(Archivo, id=archivo_id)
             
             # Verificar permisos
-            perfil = request.user.perfilusuario
-            if archivo_a_reemplazar.fraccion.tipo_usuario_asignado != perfil.tipo_usuario:
+            if not request.autorizacion.puede_archivo(archivo_a_reemplazar):
                 messages.error(request, 'No tienes permisos para editar este archivo.')
                 return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
             
@@ -1024,70 +986,79 @@ class EditarVersionView(LoginRequiredMixin, TemplateView):
         """Lógica para agregar nuevos archivos a la versión."""
         archivos_nuevos = request.FILES.getlist('nuevos_archivos_agregar')
 
+        if archivos_rechazados(request):
+            for motivo in archivos_rechazados(request):
+                messages.error(request, motivo, extra_tags='danger')
+            return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
+
         if not archivos_nuevos:
             messages.warning(request, 'No seleccionaste ningún archivo para agregar.')
             return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
 
+        fraccion = fraccion_o_404(fraccion_id)
+
+        # Verificar permisos una sola vez
+        if not request.autorizacion.puede_fraccion(fraccion.id):
+            messages.error(request, 'No tienes permisos para agregar archivos a esta fracción.', extra_tags='danger')
+            return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
+
+        # Verificar duplicados dentro de la nueva carga
+        nombres_nuevos = {f.name for f in archivos_nuevos}
+        if len(archivos_nuevos) != len(nombres_nuevos):
+            messages.error(request, '<strong>Operación detenida:</strong> No puedes agregar dos archivos con el mismo nombre.', extra_tags='danger')
+            return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
+
+        # Los archivos se escriben antes de la transacción (archivos/cargas.py)
+        try:
+            preparados = preparar_archivos(archivos_nuevos)
+        except ValidationError as e:
+            for error in e.messages:
+                messages.error(request, f"❌ {error}", extra_tags='danger')
+            return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
+
         try:
             with transaction.atomic():
-                fraccion = get_object_or_404(Fraccion, id=fraccion_id)
-                perfil = request.user.perfilusuario
+                # Bloquear el periodo: una carga simultánea no puede publicar otra
+                # versión mientras se agregan archivos a esta
+                bloquear_periodo(fraccion.id, año, periodo)
 
-                # Verificar permisos una sola vez
-                if fraccion.tipo_usuario_asignado != perfil.tipo_usuario:
-                    messages.error(request, 'No tienes permisos para agregar archivos a esta fracción.', extra_tags='danger')
-                    return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
+                # El tipo_periodo se toma de un archivo de la versión, que debe seguir vigente
+                archivo_existente = Archivo.objects.filter(
+                    fraccion_id=fraccion_id, año=año, periodo_especifico=periodo, version=version, vigente=True
+                ).first()
+                if not archivo_existente:
+                    raise ValidationError(f'La versión {version} ya no es la vigente; recarga la página.')
 
                 # ✅ VALIDACIÓN: Verificar si los nuevos archivos ya existen en esta versión
                 nombres_existentes = set(Archivo.objects.filter(
                     fraccion_id=fraccion_id, año=año, periodo_especifico=periodo, version=version
                 ).values_list('nombre_original', flat=True))
-
-                nombres_nuevos = {f.name for f in archivos_nuevos}
-
-                # Verificar duplicados dentro de la nueva carga
-                if len(archivos_nuevos) != len(nombres_nuevos):
-                    messages.error(request, '<strong>Operación detenida:</strong> No puedes agregar dos archivos con el mismo nombre.', extra_tags='danger')
-                    return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
-
                 archivos_duplicados = nombres_existentes.intersection(nombres_nuevos)
                 if archivos_duplicados:
-                    messages.error(request, f'"{", ".join(archivos_duplicados)}" ya existe(n) en esta versión.', extra_tags='danger')
-                    return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
+                    raise ValidationError(f'"{", ".join(archivos_duplicados)}" ya existe(n) en esta versión.')
 
                 # Marcar toda la versión como 'editada'
                 Archivo.objects.filter(fraccion_id=fraccion_id, año=año, periodo_especifico=periodo, version=version).update(editada=True)
 
-                archivos_creados_count = 0
-                for archivo_file in archivos_nuevos:
-                    # Aquí puedes añadir validaciones individuales si lo deseas (tamaño, tipo, etc.)
-                    
-                    # ✅ CORRECCIÓN: Obtener el tipo_periodo de un archivo existente en la versión.
-                    # En lugar de fraccion.fraccion_archivos, consultamos directamente el modelo Archivo.
-                    archivo_existente = Archivo.objects.filter(
-                        fraccion_id=fraccion_id, año=año, periodo_especifico=periodo, version=version
-                    ).first()
-
-                    if not archivo_existente:
-                        raise Exception("No se encontró un archivo base para determinar el tipo de período.")
-
-                    Archivo.objects.create(
-                        fraccion=fraccion,
-                        usuario=request.user,
-                        tipo_periodo=archivo_existente.tipo_periodo, # Tomar de un archivo existente
-                        año=año,
-                        periodo_especifico=periodo,
-                        archivo=archivo_file,
-                        nombre_original=archivo_file.name,
-                        tamaño=archivo_file.size,
-                        vigente=True,
-                        version=version, # Misma versión
-                        editada=True # Marcar como editado
-                    )
-                    archivos_creados_count += 1
+                crear_archivos_preparados(
+                    preparados,
+                    fraccion=fraccion,
+                    usuario=request.user,
+                    tipo_periodo=archivo_existente.tipo_periodo, # Tomar de un archivo existente
+                    año=año,
+                    periodo_especifico=periodo,
+                    vigente=True,
+                    version=version, # Misma versión
+                    editada=True # Marcar como editado
+                )
 
-            messages.success(request, f'<strong>Nuevos archivos agregados:</strong> Se añadieron {archivos_creados_count} archivo(s) a la versión {version}.')
+            messages.success(request, f'<strong>Nuevos archivos agregados:</strong> Se añadieron {len(preparados)} archivo(s) a la versión {version}.')
+        except ValidationError as e:
+            descartar_preparados(preparados)
+            for error in e.messages:
+                messages.error(request, error, extra_tags='danger')
         except Exception as e:
+            descartar_preparados(preparados)
             messages.error(request, f'Error al agregar nuevos archivos: {e}', extra_tags='danger')
 
         return redirect('archivos:editar_version', fraccion_id=fraccion_id, año=año, periodo=periodo, version=version)
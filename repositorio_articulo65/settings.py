@@ -20,6 +20,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # búsqueda de texto completo y trigramas
     'archivos',  # Nuestra app principal
 ]
 
@@ -29,6 +30,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'archivos.middleware.AutorizacionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -116,17 +118,72 @@ try:
 except Exception as e:
     print(f"❌ Error creando directorios media: {e}")
 
+# Entrega de archivos en las vistas de visualización y descarga
+# 'django'   -> el worker transmite el archivo (desarrollo)
+# 'nginx'    -> X-Accel-Redirect hacia la location interna de nginx.conf
+# 'sendfile' -> X-Sendfile (Apache mod_xsendfile / lighttpd)
+ARCHIVOS_ENTREGA = config('ARCHIVOS_ENTREGA', default='django')
+ARCHIVOS_ENTREGA_URL_INTERNA = config('ARCHIVOS_ENTREGA_URL_INTERNA', default='/media-interno/')
+
+# Bitácora de accesos (HistorialAcceso): cola en memoria escrita por lotes
+ARCHIVOS_BITACORA_ASINCRONA = config('ARCHIVOS_BITACORA_ASINCRONA', default=True, cast=bool)
+ARCHIVOS_BITACORA_LOTE = 200  # eventos por bulk_create
+ARCHIVOS_BITACORA_INTERVALO = 2.0  # segundos máximos entre escrituras
+ARCHIVOS_BITACORA_CAPACIDAD = 10000  # eventos en cola por proceso
+ARCHIVOS_BITACORA_DESBORDE = 'descartar'  # 'descartar' o 'sincrono' cuando la cola está llena
+ARCHIVOS_BITACORA_REPORTE = 300  # segundos entre líneas de log con los contadores (0 = nunca)
+
+# Retención de HistorialAcceso (particiones mensuales en PostgreSQL)
+ARCHIVOS_HISTORIAL_RETENCION_MESES = config('ARCHIVOS_HISTORIAL_RETENCION_MESES', default=24, cast=int)
+ARCHIVOS_HISTORIAL_RESPALDOS = config('ARCHIVOS_HISTORIAL_RESPALDOS', default=str(BASE_DIR / 'respaldos' / 'historial'))
+
+# Cargas por bloques (reanudables) para archivos grandes
+ARCHIVOS_CARGAS_DIR = config('ARCHIVOS_CARGAS_DIR', default=str(BASE_DIR / 'cargas'))
+ARCHIVOS_CARGA_TAMAÑO_BLOQUE = 5 * 1024 * 1024  # 5 MB por bloque
+ARCHIVOS_CARGA_VIGENCIA_HORAS = 24  # sesiones inactivas que se eliminan con limpiar_cargas
+
+# Área de preparación: los archivos se escriben aquí antes de la transacción y
+# se mueven a MEDIA_ROOT al confirmarse. Fuera de MEDIA_ROOT: lo que hay aquí aún
+# no está validado ni publicado y /media/ se sirve sin autenticación. En el mismo
+# sistema de archivos que MEDIA_ROOT el paso es un rename; si no, una copia
+ARCHIVOS_PREPARACION_DIR = config('ARCHIVOS_PREPARACION_DIR', default=str(BASE_DIR / 'preparacion'))
+ARCHIVOS_CARGA_HILOS = config('ARCHIVOS_CARGA_HILOS', default=8, cast=int)  # archivos de una carga validados y escritos en paralelo
+
+# Caché en disco de exportaciones (clave: filtros + tipo de usuario + huella de datos)
+ARCHIVOS_EXPORTACIONES_CACHE_DIR = config('ARCHIVOS_EXPORTACIONES_CACHE_DIR', default=str(BASE_DIR / 'cache' / 'exportaciones'))
+ARCHIVOS_EXPORTACIONES_CACHE_MAXIMO = config('ARCHIVOS_EXPORTACIONES_CACHE_MAXIMO', default=500 * 1024 * 1024, cast=int)  # bytes
+
+# Exportaciones en segundo plano (comando procesar_exportaciones)
+ARCHIVOS_EXPORTACION_DIRECTA_MAXIMO = config('ARCHIVOS_EXPORTACION_DIRECTA_MAXIMO', default=5000, cast=int)  # filas generadas en la solicitud
+ARCHIVOS_EXPORTACIONES_DIR = config('ARCHIVOS_EXPORTACIONES_DIR', default=str(BASE_DIR / 'exportaciones'))
+ARCHIVOS_EXPORTACIONES_VIGENCIA_HORAS = 24  # tiempo que el archivo generado queda disponible
+ARCHIVOS_EXPORTACION_PROCESOS = config('ARCHIVOS_EXPORTACION_PROCESOS', default=os.cpu_count() or 1, cast=int)  # hojas por fracción en paralelo
+
+# Texto de los documentos para la búsqueda por contenido (comando extraer_contenido)
+ARCHIVOS_EXTRACCION_MAX_CARACTERES = config('ARCHIVOS_EXTRACCION_MAX_CARACTERES', default=200000, cast=int)  # por documento
+ARCHIVOS_EXTRACCION_MAX_DESCOMPRIMIDO = config('ARCHIVOS_EXTRACCION_MAX_DESCOMPRIMIDO', default=64 * 1024 * 1024, cast=int)  # bytes de flujos PDF por documento
+
+# Conteos de los filtros del listado (archivos/facetas.py)
+ARCHIVOS_FACETAS_CACHE_SEGUNDOS = config('ARCHIVOS_FACETAS_CACHE_SEGUNDOS', default=300, cast=int)
+
+# Catálogo de fracciones en memoria (archivos/catalogo.py): cada proceso
+# consulta la versión en la base de datos a lo sumo con esta frecuencia
+ARCHIVOS_CATALOGO_REVISION_SEGUNDOS = config('ARCHIVOS_CATALOGO_REVISION_SEGUNDOS', default=2, cast=float)
+
 # File upload settings (CONFIGURACIÓN CRÍTICA)
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100 MB
+# Con ManejadorCargaVerificada (abajo) los archivos siempre se escriben a disco;
+# este límite solo aplica si se vuelve a los manejadores de Django
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100 MB
 FILE_UPLOAD_PERMISSIONS = 0o644  # Permisos de archivos
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = 0o755  # Permisos de directorios
 
 # Configuración adicional para archivos grandes
 FILE_UPLOAD_TEMP_DIR = None  # Usar directorio temporal del sistema
+# Escribe a disco, calcula SHA-256 y valida tipo (magic bytes) y tamaño
+# mientras se recibe cada archivo (archivos/manejadores.py)
 FILE_UPLOAD_HANDLERS = [
-    'django.core.files.uploadhandler.MemoryFileUploadHandler',
-    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+    'archivos.manejadores.ManejadorCargaVerificada',
 ]
 
 # Default primary key field type
@@ -207,6 +264,11 @@ if DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # Configuración de cache (opcional, mejora rendimiento)
+# LocMemCache es local a cada proceso (worker): nada que deba verse igual en
+# todos los workers depende de ella. Los permisos se leen en cada solicitud
+# (archivos/autorizacion.py), la versión del catálogo de fracciones está en
+# la base de datos (archivos/catalogo.py) y los conteos de facetas solo se
+# reutilizan ARCHIVOS_FACETAS_CACHE_SEGUNDOS.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',